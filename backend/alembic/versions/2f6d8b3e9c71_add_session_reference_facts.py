@@ -0,0 +1,28 @@
+"""add session reference facts
+
+Revision ID: 2f6d8b3e9c71
+Revises: 71d0c5a8e2f4
+Create Date: 2026-10-19 19:11:40.520917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '2f6d8b3e9c71'
+down_revision: Union[str, None] = '71d0c5a8e2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-sessions', sa.Column('reference_facts', postgresql.JSONB(astext_type=sa.Text()), server_default=sa.text("'[]'::jsonb"), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('game-sessions', 'reference_facts')
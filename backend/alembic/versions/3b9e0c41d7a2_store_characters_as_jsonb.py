@@ -0,0 +1,48 @@
+"""store characters as jsonb
+
+Revision ID: 3b9e0c41d7a2
+Revises: f6c0d2ad8058
+Create Date: 2026-10-19 10:12:04.318842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e0c41d7a2'
+down_revision: Union[str, None] = 'f6c0d2ad8058'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-sessions', sa.Column('characters', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    # raw_characters holds a JSON encoded string inside a JSON column, unwrap it
+    op.execute(
+        """
+        UPDATE "game-sessions"
+        SET characters = CASE
+            WHEN json_typeof(raw_characters) = 'string' THEN (raw_characters #>> '{}')::jsonb
+            ELSE raw_characters::jsonb
+        END
+        """
+    )
+    op.alter_column('game-sessions', 'characters', nullable=False)
+    op.drop_column('game-sessions', 'raw_characters')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('game-sessions', sa.Column('raw_characters', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    op.execute(
+        """
+        UPDATE "game-sessions"
+        SET raw_characters = to_json(characters::text)
+        """
+    )
+    op.alter_column('game-sessions', 'raw_characters', nullable=False)
+    op.drop_column('game-sessions', 'characters')
@@ -0,0 +1,90 @@
+"""split sessions into playthroughs
+
+Revision ID: 5e8a1b7d3f20
+Revises: c27a9e4f0b13
+Create Date: 2026-10-19 14:22:09.318240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a1b7d3f20'
+down_revision: Union[str, None] = 'c27a9e4f0b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('game-playthroughs',
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('session_id', sa.Uuid(), nullable=True),
+    sa.Column('final_act_synoposis', sa.Text(), nullable=True),
+    sa.Column('remaining_actions', sa.Integer(), nullable=False),
+    sa.Column('final_video_url', sa.String(), nullable=True),
+    sa.Column('closing_remarks', sa.String(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['game-sessions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_game-playthroughs_session_id'), 'game-playthroughs', ['session_id'], unique=False)
+
+    # every existing session becomes its own first playthrough, sharing its id
+    # so that links to sessions already in progress keep working
+    op.execute(
+        '''
+        INSERT INTO "game-playthroughs"
+            (id, session_id, final_act_synoposis, remaining_actions, final_video_url, closing_remarks, version)
+        SELECT id, id, final_act_synoposis, remaining_actions, final_video_url, closing_remarks, version
+        FROM "game-sessions"
+        '''
+    )
+
+    op.add_column('game-story-blocks', sa.Column('playthrough_id', sa.Uuid(), nullable=True))
+    op.execute('UPDATE "game-story-blocks" SET playthrough_id = session_id')
+    op.create_foreign_key(None, 'game-story-blocks', 'game-playthroughs', ['playthrough_id'], ['id'])
+    op.create_index(op.f('ix_game-story-blocks_playthrough_id'), 'game-story-blocks', ['playthrough_id'], unique=False)
+    op.drop_column('game-story-blocks', 'session_id')
+
+    op.drop_column('game-sessions', 'final_act_synoposis')
+    op.drop_column('game-sessions', 'remaining_actions')
+    op.drop_column('game-sessions', 'final_video_url')
+    op.drop_column('game-sessions', 'closing_remarks')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('game-sessions', sa.Column('closing_remarks', sa.String(), nullable=True))
+    op.add_column('game-sessions', sa.Column('final_video_url', sa.String(), nullable=True))
+    op.add_column('game-sessions', sa.Column('remaining_actions', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('game-sessions', sa.Column('final_act_synoposis', sa.Text(), nullable=True))
+    op.alter_column('game-sessions', 'remaining_actions', server_default=None)
+
+    # only the playthrough sharing the session id can be folded back, any other
+    # playthroughs and their story blocks are lost
+    op.execute(
+        '''
+        UPDATE "game-sessions" AS s
+        SET final_act_synoposis = p.final_act_synoposis,
+            remaining_actions = p.remaining_actions,
+            final_video_url = p.final_video_url,
+            closing_remarks = p.closing_remarks
+        FROM "game-playthroughs" AS p
+        WHERE p.id = s.id
+        '''
+    )
+    op.execute('UPDATE "game-sessions" SET remaining_actions = total_actions WHERE id NOT IN (SELECT id FROM "game-playthroughs")')
+
+    op.add_column('game-story-blocks', sa.Column('session_id', sa.Uuid(), nullable=True))
+    op.execute('DELETE FROM "game-story-blocks" WHERE playthrough_id NOT IN (SELECT id FROM "game-sessions")')
+    op.execute('UPDATE "game-story-blocks" SET session_id = playthrough_id')
+    op.create_foreign_key(None, 'game-story-blocks', 'game-sessions', ['session_id'], ['id'])
+    op.drop_index(op.f('ix_game-story-blocks_playthrough_id'), table_name='game-story-blocks')
+    op.drop_column('game-story-blocks', 'playthrough_id')
+
+    op.drop_index(op.f('ix_game-playthroughs_session_id'), table_name='game-playthroughs')
+    op.drop_table('game-playthroughs')
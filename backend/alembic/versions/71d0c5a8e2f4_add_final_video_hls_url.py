@@ -0,0 +1,28 @@
+"""add final video hls url
+
+Revision ID: 71d0c5a8e2f4
+Revises: e3b7f19c4a52
+Create Date: 2026-10-19 18:02:13.774301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '71d0c5a8e2f4'
+down_revision: Union[str, None] = 'e3b7f19c4a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-playthroughs', sa.Column('final_video_hls_url', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('game-playthroughs', 'final_video_hls_url')
@@ -0,0 +1,28 @@
+"""add session version
+
+Revision ID: 8d41f5a2c6e9
+Revises: 3b9e0c41d7a2
+Create Date: 2026-10-19 11:40:51.902317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41f5a2c6e9'
+down_revision: Union[str, None] = '3b9e0c41d7a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-sessions', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('game-sessions', 'version')
@@ -0,0 +1,34 @@
+"""add session inventory columns
+
+Revision ID: 9a4c7e2b5d16
+Revises: 5e8a1b7d3f20
+Create Date: 2026-10-19 15:48:31.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4c7e2b5d16'
+down_revision: Union[str, None] = '5e8a1b7d3f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-sessions', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('game-sessions', sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True))
+    # sessions which already have a playthrough are no longer fresh
+    op.execute('UPDATE "game-sessions" SET claimed_at = now() WHERE id IN (SELECT session_id FROM "game-playthroughs")')
+    op.create_index('ix_game-sessions_fresh', 'game-sessions', ['visual_style'], unique=False, postgresql_where=sa.text('claimed_at IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_game-sessions_fresh', table_name='game-sessions', postgresql_where=sa.text('claimed_at IS NULL'))
+    op.drop_column('game-sessions', 'claimed_at')
+    op.drop_column('game-sessions', 'created_at')
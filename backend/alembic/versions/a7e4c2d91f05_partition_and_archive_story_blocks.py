@@ -0,0 +1,159 @@
+"""partition and archive story blocks
+
+Revision ID: a7e4c2d91f05
+Revises: d5a93f7c0b28
+Create Date: 2026-10-19 23:12:40.518934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e4c2d91f05'
+down_revision: Union[str, None] = 'd5a93f7c0b28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_COLUMNS_ = 'id, number, previous_action, actions_consumed, is_final_act, dialogue, backdrop_image_url, possible_actions, playthrough_id, backdrop_ready, video_clip_url, created_at'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-playthroughs', sa.Column('archived_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('game-playthroughs', sa.Column('rehydrated_at', sa.DateTime(timezone=True), nullable=True))
+
+    op.create_table('playthrough-archives',
+    sa.Column('playthrough_id', sa.Uuid(), nullable=False),
+    sa.Column('blocks', sa.LargeBinary(), nullable=False),
+    sa.Column('block_count', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['playthrough_id'], ['game-playthroughs.id'], ),
+    sa.PrimaryKeyConstraint('playthrough_id')
+    )
+    # already compressed, so kept out of line without compressing it again
+    op.execute('ALTER TABLE "playthrough-archives" ALTER COLUMN blocks SET STORAGE EXTERNAL')
+
+    # an existing table cannot be partitioned, so the blocks are copied into a
+    # new one, with the old table's names moved out of the way first
+    op.rename_table('game-story-blocks', 'game-story-blocks-unpartitioned')
+    op.execute('ALTER TABLE "game-story-blocks-unpartitioned" RENAME CONSTRAINT "game-story-blocks_pkey" TO "game-story-blocks-unpartitioned_pkey"')
+    op.execute('ALTER SEQUENCE "game-story-blocks_id_seq" RENAME TO "game-story-blocks-unpartitioned_id_seq"')
+    op.drop_index(op.f('ix_game-story-blocks_playthrough_id'), table_name='game-story-blocks-unpartitioned')
+
+    op.create_table('game-story-blocks',
+    sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+    sa.Column('number', sa.Integer(), nullable=False),
+    sa.Column('previous_action', sa.String(), nullable=False),
+    sa.Column('actions_consumed', sa.Integer(), nullable=False),
+    sa.Column('is_final_act', sa.Boolean(), nullable=False),
+    sa.Column('dialogue', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('backdrop_image_url', sa.String(), nullable=True),
+    sa.Column('possible_actions', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('playthrough_id', sa.Uuid(), nullable=True),
+    sa.Column('backdrop_ready', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.Column('video_clip_url', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['playthrough_id'], ['game-playthroughs.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index(op.f('ix_game-story-blocks_playthrough_id'), 'game-story-blocks', ['playthrough_id'], unique=False)
+
+    # one partition per month that has blocks, up to a couple of months ahead,
+    # the archiver keeps creating them from then on. Anything outside them,
+    # such as blocks rehydrated after their month's partition was dropped,
+    # lands in the default partition
+    op.execute('CREATE TABLE "game-story-blocks-default" PARTITION OF "game-story-blocks" DEFAULT')
+    op.execute(
+        '''
+        DO $$
+        DECLARE
+            month timestamptz := date_trunc(
+                'month',
+                coalesce((SELECT min(created_at) FROM "game-story-blocks-unpartitioned"), now()),
+                'UTC'
+            );
+        BEGIN
+            WHILE month <= date_trunc('month', now(), 'UTC') + interval '2 months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "game-story-blocks" FOR VALUES FROM (%L) TO (%L)',
+                    'game-story-blocks-' || to_char(month AT TIME ZONE 'UTC', 'YYYY-MM'),
+                    month,
+                    month + interval '1 month'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+        '''
+    )
+
+    op.execute(f'INSERT INTO "game-story-blocks" ({_COLUMNS_}) SELECT {_COLUMNS_} FROM "game-story-blocks-unpartitioned"')
+    op.execute(
+        '''
+        SELECT setval(
+            pg_get_serial_sequence('"game-story-blocks"', 'id'),
+            coalesce((SELECT max(id) FROM "game-story-blocks"), 0) + 1,
+            false
+        )
+        '''
+    )
+    op.drop_table('game-story-blocks-unpartitioned')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # archived blocks can only be decompressed by the application
+    op.execute(
+        '''
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM "playthrough-archives") THEN
+                RAISE EXCEPTION 'archived playthroughs must be rehydrated before downgrading';
+            END IF;
+        END $$
+        '''
+    )
+
+    op.rename_table('game-story-blocks', 'game-story-blocks-partitioned')
+    op.execute('ALTER TABLE "game-story-blocks-partitioned" RENAME CONSTRAINT "game-story-blocks_pkey" TO "game-story-blocks-partitioned_pkey"')
+    op.execute('ALTER SEQUENCE "game-story-blocks_id_seq" RENAME TO "game-story-blocks-partitioned_id_seq"')
+    op.drop_index(op.f('ix_game-story-blocks_playthrough_id'), table_name='game-story-blocks-partitioned')
+
+    op.create_table('game-story-blocks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('number', sa.Integer(), nullable=False),
+    sa.Column('previous_action', sa.String(), nullable=False),
+    sa.Column('actions_consumed', sa.Integer(), nullable=False),
+    sa.Column('is_final_act', sa.Boolean(), nullable=False),
+    sa.Column('dialogue', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('backdrop_image_url', sa.String(), nullable=True),
+    sa.Column('possible_actions', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('playthrough_id', sa.Uuid(), nullable=True),
+    sa.Column('backdrop_ready', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.Column('video_clip_url', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['playthrough_id'], ['game-playthroughs.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_game-story-blocks_playthrough_id'), 'game-story-blocks', ['playthrough_id'], unique=False)
+
+    op.execute(f'INSERT INTO "game-story-blocks" ({_COLUMNS_}) SELECT {_COLUMNS_} FROM "game-story-blocks-partitioned"')
+    op.execute(
+        '''
+        SELECT setval(
+            pg_get_serial_sequence('"game-story-blocks"', 'id'),
+            coalesce((SELECT max(id) FROM "game-story-blocks"), 0) + 1,
+            false
+        )
+        '''
+    )
+    # partitions are dropped along with it
+    op.drop_table('game-story-blocks-partitioned')
+
+    op.drop_table('playthrough-archives')
+    op.drop_column('game-playthroughs', 'rehydrated_at')
+    op.drop_column('game-playthroughs', 'archived_at')
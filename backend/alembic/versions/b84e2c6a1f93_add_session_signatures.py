@@ -0,0 +1,41 @@
+"""add session signatures
+
+Revision ID: b84e2c6a1f93
+Revises: 2f6d8b3e9c71
+Create Date: 2026-10-19 20:03:26.184502
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b84e2c6a1f93'
+down_revision: Union[str, None] = '2f6d8b3e9c71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('session-signatures',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Uuid(), nullable=True),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('minhash', sa.LargeBinary(), nullable=False),
+    sa.Column('bands', postgresql.ARRAY(sa.BigInteger()), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['game-sessions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_session-signatures_session_id'), 'session-signatures', ['session_id'], unique=False)
+    op.create_index('ix_session-signatures_bands', 'session-signatures', ['bands'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_session-signatures_bands', table_name='session-signatures', postgresql_using='gin')
+    op.drop_index(op.f('ix_session-signatures_session_id'), table_name='session-signatures')
+    op.drop_table('session-signatures')
@@ -0,0 +1,28 @@
+"""add prepared opening block
+
+Revision ID: c27a9e4f0b13
+Revises: 8d41f5a2c6e9
+Create Date: 2026-10-19 13:05:27.551093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c27a9e4f0b13'
+down_revision: Union[str, None] = '8d41f5a2c6e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-sessions', sa.Column('opening_block', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('game-sessions', 'opening_block')
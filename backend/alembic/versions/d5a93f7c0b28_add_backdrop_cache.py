@@ -0,0 +1,40 @@
+"""add backdrop cache
+
+Revision ID: d5a93f7c0b28
+Revises: b84e2c6a1f93
+Create Date: 2026-10-19 20:47:51.302716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a93f7c0b28'
+down_revision: Union[str, None] = 'b84e2c6a1f93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('backdrop-cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('visual_style', sa.String(), nullable=False),
+    sa.Column('description', sa.Text(), nullable=False),
+    sa.Column('embedding', sa.LargeBinary(), nullable=False),
+    sa.Column('image_url', sa.String(), nullable=False),
+    sa.Column('playthrough_id', sa.Uuid(), nullable=True),
+    sa.Column('latency', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_backdrop-cache_visual_style'), 'backdrop-cache', ['visual_style'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_backdrop-cache_visual_style'), table_name='backdrop-cache')
+    op.drop_table('backdrop-cache')
@@ -0,0 +1,50 @@
+"""track block recovery state
+
+Revision ID: e3b7f19c4a52
+Revises: 9a4c7e2b5d16
+Create Date: 2026-10-19 17:11:46.205873
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b7f19c4a52'
+down_revision: Union[str, None] = '9a4c7e2b5d16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('game-story-blocks', sa.Column('backdrop_ready', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('game-story-blocks', sa.Column('video_clip_url', sa.String(), nullable=True))
+    op.add_column('game-story-blocks', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+    # a block still showing the backdrop it started with never got its own
+    op.execute(
+        '''
+        UPDATE "game-story-blocks" AS b
+        SET backdrop_ready = true
+        FROM "game-playthroughs" AS p, "game-sessions" AS s
+        WHERE p.id = b.playthrough_id
+          AND s.id = p.session_id
+          AND b.backdrop_image_url IS DISTINCT FROM s.promo_image_url
+          AND NOT EXISTS (
+            SELECT 1 FROM "game-story-blocks" AS previous
+            WHERE previous.playthrough_id = b.playthrough_id
+              AND previous.number = b.number - 1
+              AND previous.backdrop_image_url = b.backdrop_image_url
+          )
+        '''
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('game-story-blocks', 'created_at')
+    op.drop_column('game-story-blocks', 'video_clip_url')
+    op.drop_column('game-story-blocks', 'backdrop_ready')
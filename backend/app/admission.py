@@ -0,0 +1,218 @@
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+
+# rough USD estimates, only used to enforce spend budgets
+ESTIMATED_COSTS = {
+    "luma.image": 0.02,
+    "luma.video": 0.3,
+    "pixtral": 0.001,
+}
+# used to turn per million token backend costs into a per call estimate
+_ESTIMATED_CALL_TOKENS_ = 2000
+
+# the playthrough upstream calls are charged to, inherited by spawned tasks
+current_budget_key: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_budget_key", default=None
+)
+
+
+def llm_call_cost(cost_per_million_tokens: float) -> float:
+    return cost_per_million_tokens * _ESTIMATED_CALL_TOKENS_ / 1_000_000
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted, it is never queued"""
+
+    def __init__(self, reason: str, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, tokens: float = 1) -> float:
+        """Takes tokens, returning 0 or the seconds until they are available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per key, the least recently used keys are forgotten"""
+
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int = 10_000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def check(self, key: str):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+
+        retry_after = bucket.take()
+        if retry_after > 0:
+            metrics.incr(f"admission.{self.name}.rate_limited")
+            raise Rejected(
+                "rate_limited",
+                "too many requests, slow down",
+                retry_after=retry_after,
+            )
+
+    def refund(self, key: str):
+        """Gives back the token taken for a request that was not let through"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+
+
+class SpendBudget:
+    def __init__(self, limit: float, max_keys: int = 10_000):
+        self.limit = limit
+        self.max_keys = max_keys
+        self._spent: OrderedDict[str, float] = OrderedDict()
+
+    def spent(self, key: str) -> float:
+        return self._spent.get(key, 0)
+
+    def charge(self, key: str, cost: float):
+        self._spent[key] = self.spent(key) + cost
+        self._spent.move_to_end(key)
+        if len(self._spent) > self.max_keys:
+            self._spent.popitem(last=False)
+
+    def check(self, key: str):
+        if self.spent(key) >= self.limit:
+            metrics.incr("admission.budget_exhausted")
+            raise Rejected("budget_exhausted", "this story has used up its budget")
+
+
+class UpstreamLimiter:
+    """
+    Caps concurrent calls to an upstream. Calls wait briefly for a free slot
+    and are rejected after that, rather than queueing behind a backlog
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self, queue_timeout: float | None):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), queue_timeout)
+        except TimeoutError:
+            metrics.incr(f"admission.{self.name}.overloaded")
+            raise Rejected(
+                "overloaded",
+                f"{self.name} is overloaded, try again shortly",
+                retry_after=queue_timeout,
+            )
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+
+class Admission:
+    """
+    Decides which commands and upstream calls are let through. Everything
+    here is per process, limits are divided between workers accordingly
+    """
+
+    def __init__(self):
+        self.clients = RateLimiter(
+            "client", Config.admission_client_rate, Config.admission_client_burst
+        )
+        self.sessions = RateLimiter(
+            "session", Config.admission_session_rate, Config.admission_session_burst
+        )
+        self.budgets = SpendBudget(Config.admission_session_budget)
+        self.upstreams = {
+            name: UpstreamLimiter(name, limit)
+            for name, limit in Config.admission_upstream_limits.items()
+        }
+        self._active_turns: set[str] = set()
+
+    def admit_turn(self, client: str, key: str):
+        """
+        Admits a player command for a playthrough, which only ever has one
+        turn being written at a time. Rejected commands are never queued
+        """
+        if key in self._active_turns:
+            metrics.incr("admission.turn_in_progress")
+            raise Rejected("busy", "the story is still being written")
+        self.budgets.check(key)
+        self.clients.check(client)
+        try:
+            self.sessions.check(key)
+        except Rejected:
+            # not let through, so the player keeps their token
+            self.clients.refund(client)
+            raise
+        self._active_turns.add(key)
+
+    def finish_turn(self, key: str):
+        self._active_turns.discard(key)
+
+    @asynccontextmanager
+    async def upstream(
+        self,
+        name: str,
+        cost: float = 0,
+        queue_timeout: float | None = Config.admission_queue_timeout,
+    ):
+        """
+        Holds a slot for a call to an upstream, charging its estimated cost
+        to the current playthrough. Background work nobody is waiting on can
+        pass a queue_timeout of None to wait for a slot instead
+        """
+        limiter = self.upstreams.get(name)
+        if limiter is None:
+            logger.warning(f"no admission limit configured for {name}")
+            yield
+            return
+
+        async with limiter.slot(queue_timeout):
+            key = current_budget_key.get()
+            if key is not None:
+                self.budgets.charge(key, cost)
+            metrics.incr(f"admission.{name}.admitted")
+            yield
+
+    def snapshot(self) -> dict:
+        return {
+            f"{name}.running": limiter.running
+            for name, limiter in self.upstreams.items()
+        }
+
+
+admission = Admission()
@@ -0,0 +1,274 @@
+import lzma
+import uuid
+import asyncio
+import datetime
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.database import engine, connection
+from app.logging import logger
+from app.metrics import metrics
+from app import serialization
+import app.models as appmodels
+
+_PARTITION_PREFIX_ = f"{appmodels.GameStoryBlock.__tablename__}-"
+# the archived block columns, the playthrough is implied by the archive
+_BLOCK_COLUMNS_ = [
+    column.key
+    for column in appmodels.GameStoryBlock.__table__.columns
+    if column.key != "playthrough_id"
+]
+
+
+def _month(at: datetime.datetime) -> datetime.date:
+    return at.astimezone(datetime.UTC).date().replace(day=1)
+
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _partition_bounds(month: datetime.date) -> tuple[datetime.datetime, ...]:
+    return tuple(
+        datetime.datetime.combine(m, datetime.time(), datetime.UTC)
+        for m in (month, _next_month(month))
+    )
+
+
+def pack(blocks: list[appmodels.GameStoryBlock]) -> bytes:
+    return lzma.compress(
+        serialization.dumps(
+            [{key: getattr(block, key) for key in _BLOCK_COLUMNS_} for block in blocks]
+        )
+    )
+
+
+def unpack_values(data: bytes) -> list[dict]:
+    """The archived blocks' columns, as they were serialised"""
+    return serialization.loads(lzma.decompress(data))
+
+
+def unpack(data: bytes) -> list[appmodels.GameStoryBlock]:
+    blocks = []
+    for values in unpack_values(data):
+        block = appmodels.GameStoryBlock(**values)
+        block.created_at = datetime.datetime.fromisoformat(values["created_at"])
+        blocks.append(block)
+    return blocks
+
+
+class Archiver:
+    """
+    Keeps the story blocks table down to the playthroughs still being played.
+    Blocks are partitioned by month, partitions are created ahead of time and
+    dropped once empty. Finished playthroughs left alone for long enough have
+    their blocks compressed into an archive, and are rehydrated whenever they
+    are opened again
+    """
+
+    def __init__(
+        self, interval: float, after: float, batch_size: int, months_ahead: int
+    ):
+        self.interval = interval
+        self.after = after
+        self.batch_size = batch_size
+        self.months_ahead = months_ahead
+
+    def _partitions(self, session: Session) -> dict[datetime.date, str]:
+        names = session.scalars(
+            sqlalchemy.text("""
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+                WHERE parent.relname = :table
+                """),
+            {"table": appmodels.GameStoryBlock.__tablename__},
+        )
+        partitions = {}
+        for name in names:
+            try:
+                month = datetime.datetime.strptime(
+                    name.removeprefix(_PARTITION_PREFIX_), "%Y-%m"
+                ).date()
+            except ValueError:
+                # the default partition
+                continue
+            partitions[month] = name
+        return partitions
+
+    def _create_partition(self, session: Session, month: datetime.date):
+        name = f"{_PARTITION_PREFIX_}{month:%Y-%m}"
+        start, end = _partition_bounds(month)
+        try:
+            with session.begin_nested():
+                session.execute(
+                    sqlalchemy.text(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF '
+                        f'"{appmodels.GameStoryBlock.__tablename__}" '
+                        f"FOR VALUES FROM ('{start.isoformat()}') "
+                        f"TO ('{end.isoformat()}')"
+                    )
+                )
+        except sqlalchemy.exc.DBAPIError as e:
+            # the default partition already holds blocks of that month, they
+            # keep landing there until it has been emptied
+            logger.warning(f"archive: unable to create partition {name}: {e!r}")
+            return
+        logger.info(f"archive: created partition {name}")
+
+    def maintain_partitions(self):
+        """
+        Creates the partitions for the coming months, and drops the partitions
+        of months long gone that archival has emptied
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        # run off the event loop, so on a connection of its own
+        with Session(engine) as session:
+            partitions = self._partitions(session)
+
+            month = _month(now)
+            for _ in range(self.months_ahead + 1):
+                if month not in partitions:
+                    self._create_partition(session, month)
+                month = _next_month(month)
+
+            cutoff = _month(now - datetime.timedelta(seconds=self.after))
+            for month, name in sorted(partitions.items()):
+                if month >= cutoff:
+                    break
+                # locked first, so blocks being rehydrated into it cannot be lost
+                session.execute(
+                    sqlalchemy.text(f'LOCK TABLE "{name}" IN ACCESS EXCLUSIVE MODE')
+                )
+                empty = session.execute(
+                    sqlalchemy.text(f'SELECT NOT EXISTS (SELECT 1 FROM "{name}")')
+                ).scalar()
+                if empty:
+                    session.execute(sqlalchemy.text(f'DROP TABLE "{name}"'))
+                    metrics.incr("archive.partitions_dropped")
+                    logger.info(f"archive: dropped empty partition {name}")
+            session.commit()
+
+    def archive(self) -> int:
+        """Archives a batch of finished playthroughs, returning how many"""
+        block = appmodels.GameStoryBlock
+        playthrough = appmodels.GamePlaythrough
+        cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+            seconds=self.after
+        )
+        last_played = (
+            sqlalchemy.select(sqlalchemy.func.max(block.created_at))
+            .where(block.playthrough_id == playthrough.id)
+            .scalar_subquery()
+        )
+        # skipping locked rows lets every worker archive at once
+        statement = (
+            sqlalchemy.select(playthrough.id)
+            .where(playthrough.final_video_url.is_not(None))
+            .where(playthrough.archived_at.is_(None))
+            # whichever came last, blocks played since a rehydration count too
+            .where(
+                sqlalchemy.func.greatest(playthrough.rehydrated_at, last_played)
+                < cutoff
+            )
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+        with Session(engine) as session:
+            playthrough_ids = list(session.scalars(statement))
+            for playthrough_id in playthrough_ids:
+                blocks = session.scalars(
+                    sqlalchemy.select(block)
+                    .where(block.playthrough_id == playthrough_id)
+                    .order_by(block.number)
+                ).all()
+                packed = pack(blocks)
+
+                archive = appmodels.PlaythroughArchive()
+                archive.playthrough_id = playthrough_id
+                archive.blocks = packed
+                archive.block_count = len(blocks)
+                session.add(archive)
+                session.execute(
+                    sqlalchemy.delete(block).where(
+                        block.playthrough_id == playthrough_id
+                    )
+                )
+                # the playthrough reads the same as before, so its version stays
+                session.execute(
+                    sqlalchemy.update(playthrough)
+                    .where(playthrough.id == playthrough_id)
+                    .values(archived_at=sqlalchemy.func.now())
+                )
+                metrics.incr("archive.blocks_archived", len(blocks))
+                metrics.incr("archive.bytes_archived", len(packed))
+            session.commit()
+
+        metrics.incr("archive.archived", len(playthrough_ids))
+        return len(playthrough_ids)
+
+    def rehydrate(self, playthrough_id: str | uuid.UUID) -> bool:
+        """
+        Moves an archived playthrough's blocks back into the story blocks
+        table. Does nothing if the playthrough is not archived, or someone
+        else got to it first
+        """
+        with Session(connection) as session:
+            archive = session.scalars(
+                sqlalchemy.select(appmodels.PlaythroughArchive)
+                .where(appmodels.PlaythroughArchive.playthrough_id == playthrough_id)
+                .with_for_update()
+            ).one_or_none()
+            if archive is None:
+                return False
+
+            playthrough = session.get(appmodels.GamePlaythrough, archive.playthrough_id)
+            for block in unpack(archive.blocks):
+                block.playthrough_id = playthrough.id
+                session.add(block)
+            session.delete(archive)
+            playthrough.archived_at = None
+            playthrough.rehydrated_at = datetime.datetime.now(datetime.UTC)
+            session.commit()
+
+        metrics.incr("archive.rehydrated")
+        logger.debug(f"archive: rehydrated {playthrough_id}")
+        return True
+
+    def forget(self, session: Session, playthrough: appmodels.GamePlaythrough):
+        """
+        Discards the archived blocks of a playthrough being reset, along with
+        when it was last rehydrated
+        """
+        session.execute(
+            sqlalchemy.delete(appmodels.PlaythroughArchive).where(
+                appmodels.PlaythroughArchive.playthrough_id == playthrough.id
+            )
+        )
+        playthrough.archived_at = None
+        playthrough.rehydrated_at = None
+
+    async def run(self):
+        logger.info("archive: archiving finished playthroughs")
+        while True:
+            try:
+                await asyncio.to_thread(self.maintain_partitions)
+            except Exception as e:
+                logger.error(f"archive: partition maintenance failed: {e!r}")
+            try:
+                while await asyncio.to_thread(self.archive) == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"archive: archiving failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+
+archiver = Archiver(
+    interval=Config.archive_interval,
+    after=Config.archive_after,
+    batch_size=Config.archive_batch_size,
+    months_ahead=Config.archive_partition_months_ahead,
+)
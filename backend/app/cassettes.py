@@ -0,0 +1,225 @@
+import gzip
+import json
+import time
+import atexit
+import base64
+import asyncio
+import hashlib
+import threading
+import httpx
+from pathlib import Path
+from collections import defaultdict, deque
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+
+# only what clients need to parse a response, everything else is dropped
+_KEPT_HEADERS_ = {"content-type", "location", "retry-after"}
+# request fields that differ between otherwise identical calls
+_VOLATILE_FIELDS_ = {"random_seed"}
+
+
+class CassetteMiss(RuntimeError):
+    pass
+
+
+def _request_key(request: httpx.Request) -> tuple[str, str]:
+    """The request line, and the request line along with a digest of its body"""
+    line = f"{request.method} {request.url.copy_with(fragment=None)}"
+    body = request.content
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload = {k: v for k, v in payload.items() if k not in _VOLATILE_FIELDS_}
+        body = json.dumps(payload, sort_keys=True).encode()
+    except ValueError:
+        pass
+    return line, f"{line} {hashlib.sha256(body).hexdigest()[:16]}"
+
+
+def _encode_body(content: bytes, content_type: str) -> dict:
+    if content_type.startswith("application/json") or content_type.startswith("text/"):
+        try:
+            return {"text": content.decode()}
+        except UnicodeDecodeError:
+            pass
+    return {"base64": base64.b64encode(content).decode()}
+
+
+def _decode_body(entry: dict) -> bytes:
+    if "text" in entry:
+        return entry["text"].encode()
+    return base64.b64decode(entry["base64"])
+
+
+class Cassette:
+    """
+    Upstream traffic recorded as gzipped JSON lines, one request and response
+    per line, along with how long the response took. Requests are matched on
+    their method, URL and body, falling back to the method and URL alone. A
+    request made more often than it was recorded, such as a generation being
+    polled, keeps getting the last recorded response
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file: gzip.GzipFile | None = None
+        self._exact: dict[str, deque[dict]] = defaultdict(deque)
+        self._loose: dict[str, deque[dict]] = defaultdict(deque)
+        self._loaded = False
+
+    def record(self, request: httpx.Request, response: httpx.Response, elapsed: float):
+        line, key = _request_key(request)
+        content_type = response.headers.get("content-type", "")
+        entry = {
+            "key": key,
+            "line": line,
+            "elapsed": round(elapsed, 3),
+            "status": response.status_code,
+            "headers": {
+                k: v for k, v in response.headers.items() if k.lower() in _KEPT_HEADERS_
+            },
+        } | _encode_body(response.content, content_type)
+
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = gzip.open(self.path, "wb")
+            self._file.write(json.dumps(entry, separators=(",", ":")).encode() + b"\n")
+            # flushed per entry, a crashed process leaves the gzip stream without
+            # its end, but with every entry up to the crash readable
+            self._file.flush()
+        metrics.incr("cassette.recorded")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            with gzip.open(self.path, "rb") as file:
+                try:
+                    for raw in file:
+                        if not raw.endswith(b"\n"):
+                            break
+                        entry = json.loads(raw)
+                        self._exact[entry["key"]].append(entry)
+                        self._loose[entry["line"]].append(entry)
+                except EOFError:
+                    logger.warning(f"cassettes: {self.path} was cut short")
+            self._loaded = True
+
+    def _take(self, entries: deque[dict], other: deque[dict]) -> dict:
+        entry = entries[0]
+        if len(entries) > 1:
+            entries.popleft()
+        # replayed, so not matched the other way again unless it is all there is
+        if len(other) > 1:
+            for i, candidate in enumerate(other):
+                if candidate is entry:
+                    del other[i]
+                    break
+        return entry
+
+    def replay(self, request: httpx.Request) -> dict:
+        self._load()
+        line, key = _request_key(request)
+        with self._lock:
+            if len(self._exact[key]) > 0:
+                entry = self._take(self._exact[key], self._loose[line])
+                metrics.incr("cassette.replayed")
+            elif len(self._loose[line]) > 0:
+                recorded_key = self._loose[line][0]["key"]
+                entry = self._take(self._loose[line], self._exact[recorded_key])
+                metrics.incr("cassette.replayed_loosely")
+            else:
+                metrics.incr("cassette.missed")
+                raise CassetteMiss(f"no recording for {line}")
+        return entry
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        cassette: Cassette,
+        mode: str,
+        time_scale: float,
+        inner: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.cassette = cassette
+        self.mode = mode
+        self.time_scale = time_scale
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.mode == "replay":
+            await request.aread()
+            entry = self.cassette.replay(request)
+            # the original latency, scaled, so concurrency behaves as it did
+            await asyncio.sleep(entry["elapsed"] * self.time_scale)
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                content=_decode_body(entry),
+                request=request,
+            )
+
+        started_at = time.monotonic()
+        response = await self.inner.handle_async_request(request)
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        self.cassette.record(request, response, time.monotonic() - started_at)
+        # the body has been decoded, so encoding and length no longer apply
+        headers = [
+            (k, v)
+            for k, v in response.headers.items()
+            if k.lower()
+            not in ("content-encoding", "content-length", "transfer-encoding")
+        ]
+        return httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=response.content,
+            request=request,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+_cassette: Cassette | None = None
+if Config.cassette_mode in ("record", "replay"):
+    _cassette = Cassette(Config.cassette_path)
+    atexit.register(_cassette.close)
+    logger.info(f"cassettes: {Config.cassette_mode} {Config.cassette_path}")
+
+
+def http_client(client: httpx.AsyncClient | None = None) -> httpx.AsyncClient | None:
+    """
+    An HTTP client for an upstream SDK which records or replays its traffic,
+    keeping the base URL, headers and timeout of the client it replaces. The
+    client is returned untouched when cassettes are off
+    """
+    if _cassette is None:
+        return client
+
+    time_scale = 1.0
+    if Config.cassette_mode == "replay":
+        time_scale = Config.cassette_time_scale
+    transport = CassetteTransport(_cassette, Config.cassette_mode, time_scale)
+    if client is None:
+        return httpx.AsyncClient(transport=transport)
+    return httpx.AsyncClient(
+        base_url=client.base_url,
+        headers=client.headers,
+        timeout=client.timeout,
+        transport=transport,
+    )
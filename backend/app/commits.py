@@ -0,0 +1,188 @@
+import uuid
+import typing
+import asyncio
+import itertools
+import sqlalchemy
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app.database import engine
+import app.models as appmodels
+
+_CHANNEL_ = "playthrough_commits"
+# postgres caps notification payloads at 8000 bytes
+_MAX_PAYLOAD_ = 7900
+_MAX_RECONNECT_DELAY_ = 30
+
+# called with a playthrough id and its committed version, if known
+Subscriber = typing.Callable[[str, int | None], None]
+
+
+class CommitFeed:
+    """
+    Tells subscribers whenever changes to a playthrough, or its story blocks,
+    are committed. Commits in this worker are picked up from session events,
+    and announced to other workers through a Postgres notification sent as
+    part of the same transaction, so it is only ever delivered once the
+    changes are visible. A subscriber is called for every commit exactly once
+    per worker, and told when notifications may have been missed
+    """
+
+    def __init__(self):
+        # identifies this worker's notifications, which it already knows about
+        self.worker_id = uuid.uuid4().hex[:12]
+        # only while listening are other workers' commits known about
+        self.listening = False
+        self._subscribers: list[Subscriber] = []
+        self._resync_subscribers: list[typing.Callable[[], None]] = []
+
+    def subscribe(self, subscriber: Subscriber):
+        self._subscribers.append(subscriber)
+
+    def on_resync(self, subscriber: typing.Callable[[], None]):
+        """Called when notifications from other workers may have been missed"""
+        self._resync_subscribers.append(subscriber)
+
+    def record(self, session: Session, playthrough_id: str, version: int | None = None):
+        """
+        Records a playthrough written with plain statements, which session
+        events never see, as part of the session's next commit
+        """
+        _changed_playthroughs(session)[str(playthrough_id)] = version
+
+    def _publish(self, playthroughs: dict[str, int | None]):
+        for playthrough_id, version in playthroughs.items():
+            for subscriber in self._subscribers:
+                try:
+                    subscriber(playthrough_id, version)
+                except Exception as e:
+                    logger.error(f"commit subscriber failed: {e!r}")
+
+    def _resync(self):
+        metrics.incr("commits.resyncs")
+        for subscriber in self._resync_subscribers:
+            subscriber()
+
+    def _payloads(self, playthroughs: dict[str, int | None]) -> list[str]:
+        entries = [
+            f"{playthrough_id}:{'' if version is None else version}"
+            for playthrough_id, version in playthroughs.items()
+        ]
+        payloads = []
+        current = self.worker_id
+        for entry in entries:
+            if len(current) + len(entry) + 1 > _MAX_PAYLOAD_:
+                payloads.append(current)
+                current = self.worker_id
+            current = f"{current},{entry}"
+        payloads.append(current)
+        return payloads
+
+    def _received(self, payload: str):
+        worker_id, *entries = payload.split(",")
+        if worker_id == self.worker_id:
+            return
+        playthroughs = {}
+        for entry in entries:
+            playthrough_id, _, version = entry.partition(":")
+            playthroughs[playthrough_id] = int(version) if version != "" else None
+        metrics.incr("commits.received", len(playthroughs))
+        self._publish(playthroughs)
+
+    async def run(self):
+        """Listens for commits made by other workers"""
+        loop = asyncio.get_running_loop()
+        delay = 1
+        while True:
+            raw = None
+            try:
+                raw = await asyncio.to_thread(engine.raw_connection)
+                dbapi_connection = raw.driver_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {_CHANNEL_}")
+                logger.info(f"commits: listening as {self.worker_id}")
+                # anything committed while not listening has been missed
+                self._resync()
+                self.listening = True
+                delay = 1
+
+                lost = asyncio.Event()
+
+                def readable():
+                    try:
+                        dbapi_connection.poll()
+                    except Exception as e:
+                        logger.warning(f"commits: listener connection lost: {e!r}")
+                        lost.set()
+                        return
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        try:
+                            self._received(notify.payload)
+                        except Exception as e:
+                            logger.error(f"commits: bad notification: {e!r}")
+
+                loop.add_reader(dbapi_connection.fileno(), readable)
+                try:
+                    await lost.wait()
+                finally:
+                    loop.remove_reader(dbapi_connection.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"commits: unable to listen: {e!r}")
+            finally:
+                self.listening = False
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(delay)
+            delay = min(_MAX_RECONNECT_DELAY_, delay * 2)
+
+
+commits = CommitFeed()
+
+
+def _changed_playthroughs(session: Session) -> dict[str, int | None]:
+    return session.info.setdefault("committed_playthroughs", {})
+
+
+@sqlalchemy.event.listens_for(Session, "after_flush")
+def _collect(session: Session, flush_context):
+    changed = _changed_playthroughs(session)
+    for instance in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, appmodels.GamePlaythrough):
+            changed[str(instance.id)] = instance.version
+        elif isinstance(instance, appmodels.GameStoryBlock):
+            if instance.playthrough_id is not None:
+                changed.setdefault(str(instance.playthrough_id), None)
+
+
+@sqlalchemy.event.listens_for(Session, "before_commit")
+def _announce(session: Session):
+    # flushed now, rather than by the commit, so every change is collected
+    session.flush()
+    changed = session.info.get("committed_playthroughs")
+    if not changed or not Config.commits_notify:
+        return
+    for payload in commits._payloads(changed):
+        session.execute(
+            sqlalchemy.select(sqlalchemy.func.pg_notify(_CHANNEL_, payload))
+        )
+
+
+@sqlalchemy.event.listens_for(Session, "after_commit")
+def _committed(session: Session):
+    changed = session.info.pop("committed_playthroughs", None)
+    if changed:
+        commits._publish(changed)
+
+
+@sqlalchemy.event.listens_for(Session, "after_rollback")
+def _rolled_back(session: Session):
+    session.info.pop("committed_playthroughs", None)
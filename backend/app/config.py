@@ -17,3 +17,160 @@ class Config:
     db_port = int(os.environ["DB_PORT"])
     db_host = os.environ["DB_HOST"]
     db_database = os.environ["DB_DATABASE"]
+    # streaming replicas of the primary as host:port pairs, sharing its credentials
+    db_replicas = [
+        (host, int(port))
+        for host, port in (
+            pair.rsplit(":", 1)
+            for pair in os.environ.get("DB_REPLICAS", "").split(",")
+            if pair != ""
+        )
+    ]
+    # seconds a replica may fall behind before reads skip it
+    db_replica_max_lag = float(os.environ.get("DB_REPLICA_MAX_LAG", 5))
+    db_replica_check_interval = float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 1))
+
+    llm_timeout = float(os.environ.get("LLM_TIMEOUT", 60))
+    llm_retries = int(os.environ.get("LLM_RETRIES", 2))
+    llm_retry_backoff = float(os.environ.get("LLM_RETRY_BACKOFF", 1))
+    llm_hedge_enabled = os.environ.get("LLM_HEDGE_ENABLED", "true") == "true"
+    llm_breaker_threshold = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+    llm_breaker_reset_after = float(os.environ.get("LLM_BREAKER_RESET_AFTER", 30))
+
+    ollama_model = os.environ.get("OLLAMA_MODEL", None)
+    ollama_base_url = os.environ.get("OLLAMA_BASE_URL", None)
+
+    graphql_persisted_queries = int(os.environ.get("GRAPHQL_PERSISTED_QUERIES", 1000))
+    # seconds a finished game may be served before revalidating its ETag, kept
+    # short as resetting a finished game changes it again
+    graphql_finished_max_age = int(os.environ.get("GRAPHQL_FINISHED_MAX_AGE", 60))
+
+    media_mirror_enabled = os.environ.get("MEDIA_MIRROR_ENABLED", "true") == "true"
+    media_storage = os.environ.get("MEDIA_STORAGE", "filesystem")
+    media_root = os.environ.get("MEDIA_ROOT", "./media")
+    media_base_url = os.environ.get("MEDIA_BASE_URL", "http://localhost:8000/media")
+    media_image_widths = [
+        int(w) for w in os.environ.get("MEDIA_IMAGE_WIDTHS", "320,640,1280").split(",")
+    ]
+    media_s3_bucket = os.environ.get("MEDIA_S3_BUCKET", None)
+    media_s3_public_url = os.environ.get("MEDIA_S3_PUBLIC_URL", None)
+    media_s3_endpoint_url = os.environ.get("MEDIA_S3_ENDPOINT_URL", None)
+
+    pregenerate_opening_block = (
+        os.environ.get("PREGENERATE_OPENING_BLOCK", "true") == "true"
+    )
+
+    # fresh sessions are generated ahead of time, refilling in the background
+    inventory_enabled = os.environ.get("INVENTORY_ENABLED", "false") == "true"
+    inventory_size = int(os.environ.get("INVENTORY_SIZE", 2))
+    # visual styles contain commas, so they are separated by semicolons
+    inventory_visual_styles = [
+        s for s in os.environ.get("INVENTORY_VISUAL_STYLES", "").split(";") if s != ""
+    ]
+    inventory_concurrency = int(os.environ.get("INVENTORY_CONCURRENCY", 2))
+    inventory_session_cost = float(os.environ.get("INVENTORY_SESSION_COST", 0.5))
+    inventory_hourly_budget = float(os.environ.get("INVENTORY_HOURLY_BUDGET", 5))
+    inventory_refill_interval = float(os.environ.get("INVENTORY_REFILL_INTERVAL", 30))
+
+    # commands per second, and bursts, allowed from one client and one playthrough
+    admission_client_rate = float(os.environ.get("ADMISSION_CLIENT_RATE", 0.5))
+    admission_client_burst = int(os.environ.get("ADMISSION_CLIENT_BURST", 5))
+    admission_session_rate = float(os.environ.get("ADMISSION_SESSION_RATE", 0.2))
+    admission_session_burst = int(os.environ.get("ADMISSION_SESSION_BURST", 3))
+    # estimated USD a single playthrough may spend on generation
+    admission_session_budget = float(os.environ.get("ADMISSION_SESSION_BUDGET", 5))
+    # concurrent calls allowed per upstream, beyond which calls are rejected
+    admission_upstream_limits = {
+        name: int(limit)
+        for name, limit in (
+            pair.split("=")
+            for pair in os.environ.get(
+                "ADMISSION_UPSTREAM_LIMITS",
+                "mistral-small=16,mistral-large=4,mistral-embed=8,ollama=2,pixtral=8,luma=8",
+            ).split(",")
+        )
+    }
+    admission_queue_timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2))
+
+    ws_heartbeat_interval = float(os.environ.get("WS_HEARTBEAT_INTERVAL", 15))
+    ws_heartbeat_timeout = float(os.environ.get("WS_HEARTBEAT_TIMEOUT", 45))
+    ws_send_queue_size = int(os.environ.get("WS_SEND_QUEUE_SIZE", 32))
+    ws_send_timeout = float(os.environ.get("WS_SEND_TIMEOUT", 10))
+    # events kept per playthrough so reconnecting clients can resume
+    ws_history_size = int(os.environ.get("WS_HISTORY_SIZE", 64))
+
+    # what happens to a playthrough's work once all its sockets are gone:
+    # "cancel", "finish-stage" or "finish-all"
+    tasks_abandon_policy = os.environ.get("TASKS_ABANDON_POLICY", "finish-stage")
+    # seconds to wait for a reconnect before a playthrough counts as abandoned
+    tasks_abandon_grace = float(os.environ.get("TASKS_ABANDON_GRACE", 15))
+    tasks_drain_timeout = float(os.environ.get("TASKS_DRAIN_TIMEOUT", 25))
+
+    # re-drives backdrops and final videos left incomplete by failures or restarts
+    recovery_enabled = os.environ.get("RECOVERY_ENABLED", "false") == "true"
+    recovery_interval = float(os.environ.get("RECOVERY_INTERVAL", 60))
+    # seconds before incomplete work counts as stuck rather than in progress
+    recovery_backdrop_after = float(os.environ.get("RECOVERY_BACKDROP_AFTER", 300))
+    recovery_final_video_after = float(
+        os.environ.get("RECOVERY_FINAL_VIDEO_AFTER", 60 * 30)
+    )
+    recovery_concurrency = int(os.environ.get("RECOVERY_CONCURRENCY", 2))
+    recovery_max_attempts = int(os.environ.get("RECOVERY_MAX_ATTEMPTS", 5))
+
+    # reference material longer than this is digested chunk by chunk before
+    # session generation, summaries are then merged a few at a time
+    ingest_threshold_chars = int(os.environ.get("INGEST_THRESHOLD_CHARS", 12000))
+    ingest_chunk_chars = int(os.environ.get("INGEST_CHUNK_CHARS", 6000))
+    ingest_reduce_fan_in = int(os.environ.get("INGEST_REDUCE_FAN_IN", 4))
+    ingest_concurrency = int(os.environ.get("INGEST_CONCURRENCY", 8))
+    ingest_max_facts = int(os.environ.get("INGEST_MAX_FACTS", 60))
+
+    # story turns only see the reference facts most relevant to the action
+    fact_embedding_model = os.environ.get("FACT_EMBEDDING_MODEL", "mistral-embed")
+    fact_index_root = os.environ.get("FACT_INDEX_ROOT", "./indexes")
+    fact_index_top_k = int(os.environ.get("FACT_INDEX_TOP_K", 6))
+    fact_index_max_open = int(os.environ.get("FACT_INDEX_MAX_OPEN", 64))
+
+    # sessions with reference material or a synopsis this similar to an existing
+    # session's, by estimated Jaccard similarity, are near duplicates
+    dedup_enabled = os.environ.get("DEDUP_ENABLED", "true") == "true"
+    dedup_threshold = float(os.environ.get("DEDUP_THRESHOLD", 0.8))
+
+    # backdrops for scenes this similar to a cached one, in the same visual
+    # style, reuse the cached image
+    backdrop_cache_enabled = os.environ.get("BACKDROP_CACHE_ENABLED", "true") == "true"
+    backdrop_cache_threshold = float(os.environ.get("BACKDROP_CACHE_THRESHOLD", 0.92))
+    # cached backdrops a single playthrough may be shown
+    backdrop_cache_max_reuse = int(os.environ.get("BACKDROP_CACHE_MAX_REUSE", 2))
+    # most recent backdrops compared against, per visual style
+    backdrop_cache_size = int(os.environ.get("BACKDROP_CACHE_SIZE", 2000))
+    backdrop_cache_refresh_interval = float(
+        os.environ.get("BACKDROP_CACHE_REFRESH_INTERVAL", 60)
+    )
+
+    # "record" captures Mistral and Luma traffic to the cassette, "replay" serves
+    # it back without network access, with latencies scaled by the time scale
+    cassette_mode = os.environ.get("CASSETTE_MODE", "off")
+    cassette_path = os.environ.get("CASSETTE_PATH", "./cassettes/recording.jsonl.gz")
+    cassette_time_scale = float(os.environ.get("CASSETTE_TIME_SCALE", 1))
+
+    # commits are announced to other workers with NOTIFY, so they can drop
+    # what they cached about the playthroughs written
+    commits_notify = os.environ.get("COMMITS_NOTIFY", "true") == "true"
+    # resolved games cached per worker, up to roughly this many bytes
+    game_cache_enabled = os.environ.get("GAME_CACHE_ENABLED", "true") == "true"
+    game_cache_max_bytes = int(os.environ.get("GAME_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+    # encoder for GraphQL responses and WebSocket frames, "orjson" or "stdlib"
+    json_codec = os.environ.get("JSON_CODEC", "orjson")
+
+    # finished playthroughs left alone for this long have their story blocks
+    # compressed into an archive, and brought back when opened again
+    archive_enabled = os.environ.get("ARCHIVE_ENABLED", "false") == "true"
+    archive_after = float(os.environ.get("ARCHIVE_AFTER", 30 * 24 * 60 * 60))
+    archive_interval = float(os.environ.get("ARCHIVE_INTERVAL", 60 * 60))
+    archive_batch_size = int(os.environ.get("ARCHIVE_BATCH_SIZE", 100))
+    # monthly story block partitions created ahead of time
+    archive_partition_months_ahead = int(
+        os.environ.get("ARCHIVE_PARTITION_MONTHS_AHEAD", 2)
+    )
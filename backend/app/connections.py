@@ -0,0 +1,254 @@
+import time
+import asyncio
+import itertools
+from collections import OrderedDict, defaultdict, deque
+from functools import cached_property
+from fastapi import WebSocket
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app import serialization
+
+# only the latest of these matters to a client, older pending ones are replaced
+COALESCED_EVENTS = {"updated"}
+# safe to drop when a client falls behind
+DROPPABLE_EVENTS = {"ping"}
+# playthroughs whose event history is kept
+_MAX_HISTORIES_ = 10_000
+
+
+class Frame:
+    """
+    An event along with its encoding, shared by every socket it is sent to so
+    that it is encoded once however many players are watching
+    """
+
+    def __init__(self, event: dict):
+        self.event = event
+
+    @property
+    def type(self) -> str:
+        return self.event["type"]
+
+    @property
+    def id(self) -> int | None:
+        return self.event.get("id")
+
+    @cached_property
+    def text(self) -> str:
+        metrics.incr("ws.encoded")
+        return serialization.dumps_text(self.event)
+
+
+class Connection:
+    """
+    A connected socket and its bounded outbound queue. Events are sent by a
+    single sender task, so a slow client never blocks whoever sends to it
+    """
+
+    def __init__(self, key: str, websocket: WebSocket, queue_size: int):
+        self.key = key
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.queue: deque[Frame] = deque()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._closing: asyncio.Task | None = None
+
+    def seen(self):
+        self.last_seen = time.monotonic()
+
+    def send(self, event: dict | Frame) -> bool:
+        if self.closed:
+            return False
+
+        frame = event if isinstance(event, Frame) else Frame(event)
+        if frame.type in COALESCED_EVENTS:
+            for i, pending in enumerate(self.queue):
+                if pending.type == frame.type:
+                    del self.queue[i]
+                    metrics.incr("ws.coalesced")
+                    break
+
+        if len(self.queue) >= self.queue_size:
+            droppable = next(
+                (i for i, f in enumerate(self.queue) if f.type in DROPPABLE_EVENTS),
+                None,
+            )
+            if droppable is None:
+                # too far behind, the client reconnects and resumes instead
+                metrics.incr("ws.overflowed")
+                logger.warning(f"ws: closing slow connection for {self.key}")
+                self.close()
+                return False
+            del self.queue[droppable]
+            metrics.incr("ws.dropped")
+
+        self.queue.append(frame)
+        self._ready.set()
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._ready.set()
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        # held on to, so it is never collected before the socket is closed
+        self._closing = asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close()
+        except Exception as e:
+            # most likely already closed by the client
+            logger.debug(f"ws: closing the socket for {self.key} failed: {e!r}")
+
+    async def wait_closed(self):
+        """Waits for the sender, the heartbeat and the socket to be done with"""
+        current = asyncio.current_task()
+        await asyncio.gather(
+            *(task for task in self._tasks if task is not current),
+            return_exceptions=True,
+        )
+        if self._closing is not None:
+            await self._closing
+
+    async def _send_loop(self, send_timeout: float):
+        while not self.closed:
+            if len(self.queue) == 0:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame = self.queue.popleft()
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send_text(frame.text), send_timeout
+                )
+            except Exception as e:
+                logger.debug(f"ws: send to {self.key} failed: {e!r}")
+                self.close()
+
+    async def _heartbeat_loop(self, interval: float, timeout: float):
+        while not self.closed:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_seen > timeout:
+                metrics.incr("ws.timed_out")
+                logger.debug(f"ws: connection for {self.key} timed out")
+                self.close()
+                return
+            self.send({"type": "ping"})
+
+
+class ConnectionManager:
+    """
+    Tracks sockets per playthrough. Events published to a playthrough are
+    numbered and kept for a while, so that a client reconnecting with the id
+    of the last event it saw only receives what it missed
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        history_size: int,
+        heartbeat_interval: float,
+        heartbeat_timeout: float,
+        send_timeout: float,
+    ):
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.send_timeout = send_timeout
+        self._connections: dict[str, set[Connection]] = defaultdict(set)
+        self._history: OrderedDict[str, deque[Frame]] = OrderedDict()
+        # events up to these ids are no longer kept, per playthrough
+        self._evicted_up_to: dict[str, int] = {}
+        # ids keep increasing across restarts, and differ between workers
+        self._first_id = time.time_ns() // 1000
+        self._last_id = self._first_id - 1
+        self._ids = itertools.count(self._first_id)
+
+    def connected(self, key: str) -> int:
+        return len(self._connections.get(key, ()))
+
+    def publish(self, key: str, event: dict) -> dict:
+        self._last_id = next(self._ids)
+        event = event | {"id": self._last_id}
+        frame = Frame(event)
+        history = self._history.setdefault(key, deque())
+        self._history.move_to_end(key)
+        history.append(frame)
+        if len(history) > self.history_size:
+            self._evicted_up_to[key] = history.popleft().id
+        if len(self._history) > _MAX_HISTORIES_:
+            forgotten_key, _ = self._history.popitem(last=False)
+            self._evicted_up_to.pop(forgotten_key, None)
+
+        for connection in list(self._connections.get(key, ())):
+            connection.send(frame)
+        return event
+
+    def _replay(self, connection: Connection, last_event_id: int):
+        key = connection.key
+        history = self._history.get(key)
+        if (
+            # issued by another worker, or before a restart
+            not self._first_id <= last_event_id <= self._last_id
+            # forgotten, or never published here
+            or history is None
+            or last_event_id < self._evicted_up_to.get(key, 0)
+        ):
+            # missed events are not known here, the client has to refetch everything
+            metrics.incr("ws.resyncs")
+            connection.send({"type": "resync"})
+            return
+
+        missed = [f for f in history if f.id > last_event_id]
+        metrics.incr("ws.resumes")
+        for frame in missed:
+            connection.send(frame)
+
+    async def connect(
+        self, key: str, websocket: WebSocket, last_event_id: int | None = None
+    ) -> Connection:
+        await websocket.accept()
+        connection = Connection(key, websocket, self.queue_size)
+        connection._tasks = [
+            asyncio.create_task(connection._send_loop(self.send_timeout)),
+            asyncio.create_task(
+                connection._heartbeat_loop(
+                    self.heartbeat_interval, self.heartbeat_timeout
+                )
+            ),
+        ]
+        self._connections[key].add(connection)
+        metrics.incr("ws.connected")
+
+        if last_event_id is not None:
+            self._replay(connection, last_event_id)
+        return connection
+
+    async def disconnect(self, connection: Connection):
+        connection.close()
+        connections = self._connections.get(connection.key)
+        if connections is not None:
+            connections.discard(connection)
+            if len(connections) == 0:
+                del self._connections[connection.key]
+            metrics.incr("ws.disconnected")
+        await connection.wait_closed()
+
+
+connections = ConnectionManager(
+    queue_size=Config.ws_send_queue_size,
+    history_size=Config.ws_history_size,
+    heartbeat_interval=Config.ws_heartbeat_interval,
+    heartbeat_timeout=Config.ws_heartbeat_timeout,
+    send_timeout=Config.ws_send_timeout,
+)
@@ -1,15 +1,27 @@
 import sqlalchemy
 from app.config import Config
 
-engine = sqlalchemy.create_engine(
-    sqlalchemy.engine.URL(
-        drivername="postgresql",
-        username=Config.db_username,
-        password=Config.db_password,
-        port=Config.db_port,
-        host=Config.db_host,
-        database=Config.db_database,
-        query={},
+
+def _create_engine(host: str, port: int, **kwargs) -> sqlalchemy.Engine:
+    return sqlalchemy.create_engine(
+        sqlalchemy.engine.URL(
+            drivername="postgresql",
+            username=Config.db_username,
+            password=Config.db_password,
+            port=port,
+            host=host,
+            database=Config.db_database,
+            query={},
+        ),
+        **kwargs,
     )
-)
+
+
+engine = _create_engine(Config.db_host, Config.db_port)
 connection = engine.connect()
+
+# read only replicas of the primary, only ever read through app.replicas
+replica_engines = {
+    f"{host}:{port}": _create_engine(host, port, pool_pre_ping=True)
+    for host, port in Config.db_replicas
+}
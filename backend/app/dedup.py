@@ -0,0 +1,214 @@
+import re
+import uuid
+import hashlib
+import sqlalchemy
+import numpy as np
+from collections import defaultdict
+from dataclasses import dataclass
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.metrics import metrics
+import app.models as appmodels
+
+# changing any of these invalidates every stored signature
+_SHINGLE_WORDS_ = 5
+_PERMUTATIONS_ = 128
+_BANDS_ = 16
+_ROWS_ = _PERMUTATIONS_ // _BANDS_
+_PRIME_ = (1 << 61) - 1
+_MAX_HASH_ = (1 << 32) - 1
+_SLICE_ = 4096
+
+# fixed, so signatures stay comparable across processes and releases
+_rng_ = np.random.default_rng(20250419)
+_A_ = _rng_.integers(1, 1 << 31, size=_PERMUTATIONS_, dtype=np.uint64)
+_B_ = _rng_.integers(0, 1 << 31, size=_PERMUTATIONS_, dtype=np.uint64)
+
+
+class DuplicateSession(Exception):
+    def __init__(self, session_id: uuid.UUID, kind: str, similarity: float):
+        super().__init__(
+            f"{kind} is a near duplicate of session {session_id} ({similarity:.0%} similar)"
+        )
+        self.session_id = session_id
+        self.kind = kind
+        self.similarity = similarity
+
+
+def _shingles(text: str) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < _SHINGLE_WORDS_:
+        return {" ".join(words)}
+    return {
+        " ".join(words[i : i + _SHINGLE_WORDS_])
+        for i in range(len(words) - _SHINGLE_WORDS_ + 1)
+    }
+
+
+def minhash(text: str) -> np.ndarray:
+    hashes = np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(s.encode(), digest_size=4).digest(), "little"
+            )
+            for s in _shingles(text)
+        ),
+        dtype=np.uint64,
+    )
+    signature = np.full(_PERMUTATIONS_, _MAX_HASH_, dtype=np.uint64)
+    # in slices, so long documents never need a shingles x permutations matrix
+    for i in range(0, len(hashes), _SLICE_):
+        # one universal hash per permutation, a and b are small enough not to overflow
+        permuted = (np.outer(hashes[i : i + _SLICE_], _A_) + _B_) % _PRIME_ & _MAX_HASH_
+        np.minimum(signature, permuted.min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+
+def _band_hashes(kind: str, signature: np.ndarray) -> list[int]:
+    # the kind and band number are hashed in, so only like bands ever match
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                f"{kind}:{band}:".encode()
+                + signature[band * _ROWS_ : (band + 1) * _ROWS_].tobytes(),
+                digest_size=8,
+            ).digest(),
+            "little",
+            signed=True,
+        )
+        for band in range(_BANDS_)
+    ]
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """The estimated Jaccard similarity of two signatures"""
+    return float(
+        np.mean(np.frombuffer(a, dtype=np.uint32) == np.frombuffer(b, dtype=np.uint32))
+    )
+
+
+def sign(kind: str, text: str) -> appmodels.SessionSignature:
+    signature = minhash(text)
+    row = appmodels.SessionSignature()
+    row.kind = kind
+    row.minhash = signature.tobytes()
+    row.bands = _band_hashes(kind, signature)
+    return row
+
+
+def find_duplicate(
+    session: Session,
+    signature: appmodels.SessionSignature,
+    threshold: float = Config.dedup_threshold,
+) -> tuple[uuid.UUID, float] | None:
+    """The most similar session above the threshold, if there is one"""
+    table = appmodels.SessionSignature.__table__
+    statement = (
+        sqlalchemy.select(table.c.session_id, table.c.minhash)
+        .where(table.c.kind == signature.kind)
+        .where(table.c.bands.overlap(signature.bands))
+    )
+    best = None
+    for session_id, candidate in session.execute(statement):
+        score = similarity(signature.minhash, candidate)
+        if score >= threshold and (best is None or score > best[1]):
+            best = (session_id, score)
+
+    metrics.incr(f"dedup.{signature.kind}.{'duplicate' if best else 'unique'}")
+    return best
+
+
+def backfill(session: Session) -> int:
+    """
+    Signs the synopsis of sessions generated before signatures existed. Their
+    original reference material was never stored, so it cannot be signed
+    """
+    signed = (
+        sqlalchemy.select(appmodels.SessionSignature.session_id)
+        .where(appmodels.SessionSignature.kind == "synopsis")
+        .scalar_subquery()
+    )
+    statement = sqlalchemy.select(
+        appmodels.GameSession.id, appmodels.GameSession.synopsis
+    ).where(appmodels.GameSession.id.not_in(signed))
+
+    count = 0
+    for session_id, synopsis in session.execute(statement).all():
+        row = sign("synopsis", synopsis)
+        row.session_id = session_id
+        session.add(row)
+        count += 1
+    session.commit()
+    return count
+
+
+@dataclass
+class DuplicateGroup:
+    kind: str
+    session_ids: list[uuid.UUID]
+    # the lowest similarity between two sessions in the group that were compared
+    similarity: float
+
+
+def report(
+    session: Session, threshold: float = Config.dedup_threshold
+) -> list[DuplicateGroup]:
+    """
+    Groups existing sessions whose reference material or synopsis are near
+    duplicates. Only sessions sharing a band are compared, so the report does
+    not grow quadratically with the number of sessions
+    """
+    table = appmodels.SessionSignature.__table__
+    statement = sqlalchemy.select(
+        table.c.session_id, table.c.kind, table.c.minhash, table.c.bands
+    ).execution_options(yield_per=1000)
+
+    buckets: dict[int, list[int]] = defaultdict(list)
+    rows: list[tuple[uuid.UUID, str, bytes]] = []
+    for session_id, kind, signature, bands in session.execute(statement):
+        for band in bands:
+            buckets[band].append(len(rows))
+        rows.append((session_id, kind, signature))
+
+    parent = list(range(len(rows)))
+    lowest: dict[int, float] = {}
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    compared: set[tuple[int, int]] = set()
+    for members in buckets.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1 :]:
+                pair = (min(a, b), max(a, b))
+                if pair in compared or rows[a][0] == rows[b][0]:
+                    continue
+                compared.add(pair)
+                score = similarity(rows[a][2], rows[b][2])
+                if score < threshold:
+                    continue
+                root_a, root_b = find(a), find(b)
+                parent[root_b] = root_a
+                lowest[root_a] = min(
+                    score, lowest.get(root_a, 1), lowest.get(root_b, 1)
+                )
+
+    groups: dict[int, list[int]] = defaultdict(list)
+    for i in range(len(rows)):
+        groups[find(i)].append(i)
+
+    return sorted(
+        (
+            DuplicateGroup(
+                kind=rows[root][1],
+                session_ids=sorted({rows[i][0] for i in members}, key=str),
+                similarity=lowest[root],
+            )
+            for root, members in groups.items()
+            if len({rows[i][0] for i in members}) > 1
+        ),
+        key=lambda g: (g.kind, -len(g.session_ids), g.similarity),
+    )
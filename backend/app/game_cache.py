@@ -0,0 +1,128 @@
+import typing
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from app.config import Config
+from app.metrics import metrics
+from app.commits import commits
+from app import serialization
+
+# playthroughs remembered as invalidated, for loads still in flight
+_MAX_INVALIDATED_ = 10000
+
+
+@dataclass
+class _Entry:
+    version: int
+    value: typing.Any
+    size: int
+
+
+def _size(value: typing.Any) -> int:
+    # roughly what the entry takes once serialised, which is proportionate to
+    # the memory it holds on to
+    return len(serialization.dumps(value))
+
+
+class GameStateCache:
+    """
+    Resolved games keyed by playthrough id and version, least recently used
+    ones dropped once the cache takes up more than its share of memory.
+    Entries are invalidated whenever changes to the playthrough are committed,
+    in this worker or any other. A load started before an invalidation never
+    stores what it read, as it may predate the commit
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        # sequence number of the latest invalidation of each playthrough
+        self._invalidated: OrderedDict[str, int] = OrderedDict()
+        self._cleared = 0
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def get(self, key: str) -> tuple[typing.Any | None, int]:
+        """
+        The cached game, if there is one, and otherwise a ticket to store it
+        with once it has been loaded. Nothing is cached while commits made by
+        other workers cannot be listened for
+        """
+        if not commits.listening:
+            # other workers' commits would go unnoticed
+            metrics.incr("game_cache.bypassed")
+            return None, 0
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                metrics.incr("game_cache.hits")
+                return entry.value, 0
+            metrics.incr("game_cache.misses")
+            return None, next(self._sequence)
+
+    def put(self, key: str, ticket: int, version: int, value: typing.Any):
+        if ticket == 0:
+            return
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if ticket <= max(self._invalidated.get(key, 0), self._cleared):
+                metrics.incr("game_cache.stale")
+                return
+            current = self._entries.get(key)
+            if current is not None and current.version > version:
+                return
+            self._evict(key)
+            self._entries[key] = _Entry(version=version, value=value, size=size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+                metrics.incr("game_cache.evictions")
+
+    def invalidate(self, key: str, version: int | None = None):
+        """
+        Drops the cached game, unless it is already at the committed version
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and version is not None and entry.version >= version:
+                return
+            self._evict(key)
+            self._invalidated[key] = next(self._sequence)
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > _MAX_INVALIDATED_:
+                # forgotten invalidations are made up for by invalidating everything
+                _, sequence = self._invalidated.popitem(last=False)
+                self._cleared = max(self._cleared, sequence)
+        metrics.incr("game_cache.invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self._cleared = next(self._sequence)
+
+    def snapshot(self) -> dict:
+        hits = metrics.count("game_cache.hits")
+        lookups = hits + metrics.count("game_cache.misses")
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hit_rate": 0.0 if lookups == 0 else hits / lookups,
+        }
+
+
+game_cache = GameStateCache(max_bytes=Config.game_cache_max_bytes)
+
+commits.subscribe(game_cache.invalidate)
+# commits made by other workers while not listening were never seen
+commits.on_resync(game_cache.clear)
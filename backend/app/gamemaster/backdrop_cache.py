@@ -0,0 +1,229 @@
+import time
+import uuid
+import asyncio
+import sqlalchemy
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app.database import engine
+from app.admission import ESTIMATED_COSTS
+from app.gamemaster.embeddings import embed
+import app.models as appmodels
+
+_MAX_PENDING_ = 256
+
+
+@dataclass
+class _Entries:
+    urls: list[str]
+    # url to the playthrough it was generated for
+    origins: dict[str, uuid.UUID | None]
+    latencies: list[float]
+    matrix: np.ndarray
+    loaded_at: float
+
+
+@dataclass
+class _Pending:
+    visual_style: str
+    description: str
+    embedding: np.ndarray
+    playthrough_id: uuid.UUID | None
+    latency: float
+
+
+class BackdropCache:
+    """
+    Reuses backdrops across playthroughs and sessions. Backdrops are keyed by
+    visual style and the embedding of the scene description they were drawn
+    from, a new scene close enough to a cached one reuses its image. Cached
+    backdrops are shown at most once per playthrough, and a playthrough only
+    reuses so many backdrops before always getting fresh ones
+    """
+
+    def __init__(
+        self, threshold: float, max_reuse: int, size: int, refresh_interval: float
+    ):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._styles: dict[str, _Entries] = {}
+        # generated backdrops waiting to be mirrored before they are cached
+        self._pending: OrderedDict[str, _Pending] = OrderedDict()
+
+    def _load(self, visual_style: str) -> _Entries:
+        table = appmodels.BackdropCacheEntry.__table__
+        statement = (
+            sqlalchemy.select(
+                table.c.image_url,
+                table.c.playthrough_id,
+                table.c.latency,
+                table.c.embedding,
+            )
+            .where(table.c.visual_style == visual_style)
+            .order_by(table.c.created_at.desc())
+            .limit(self.size)
+        )
+        # run off the event loop, so on a connection of its own
+        with Session(engine) as session:
+            rows = session.execute(statement).all()
+
+        return _Entries(
+            urls=[row.image_url for row in rows],
+            origins={row.image_url: row.playthrough_id for row in rows},
+            latencies=[row.latency for row in rows],
+            matrix=(
+                np.stack(
+                    [np.frombuffer(row.embedding, dtype=np.float32) for row in rows]
+                )
+                if len(rows) > 0
+                else np.empty((0, 0), dtype=np.float32)
+            ),
+            loaded_at=time.monotonic(),
+        )
+
+    async def _entries(self, visual_style: str) -> _Entries:
+        # reloaded now and then to pick up backdrops cached by other workers
+        entries = self._styles.get(visual_style)
+        if (
+            entries is None
+            or time.monotonic() - entries.loaded_at > self.refresh_interval
+        ):
+            entries = await asyncio.to_thread(self._load, visual_style)
+            self._styles[visual_style] = entries
+        return entries
+
+    async def lookup(
+        self,
+        visual_style: str,
+        description: str,
+        playthrough_id: uuid.UUID | None,
+        shown_urls: set[str],
+    ) -> tuple[str | None, np.ndarray | None]:
+        """
+        A cached backdrop for the scene, if there is one the playthrough may
+        reuse. The scene's embedding is returned as well, so that a backdrop
+        generated after a miss can be cached without embedding it again
+        """
+        if not Config.backdrop_cache_enabled:
+            return None, None
+
+        try:
+            embedding = (await embed([description]))[0]
+            entries = await self._entries(visual_style)
+        except Exception as e:
+            logger.warning(f"backdrop cache unavailable: {e!r}")
+            metrics.incr("backdrop_cache.errors")
+            return None, None
+
+        if len(entries.urls) == 0 or entries.matrix.shape[1] != embedding.shape[0]:
+            metrics.incr("backdrop_cache.misses")
+            return None, embedding
+
+        # prepared opening backdrops have no origin, every playthrough shows one
+        reused = sum(
+            1
+            for url in shown_urls
+            if entries.origins.get(url) not in (None, playthrough_id)
+        )
+        if reused >= self.max_reuse:
+            metrics.incr("backdrop_cache.capped")
+            metrics.incr("backdrop_cache.misses")
+            return None, embedding
+
+        scores = entries.matrix @ embedding
+        for i, url in enumerate(entries.urls):
+            if url in shown_urls:
+                scores[i] = -1
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            metrics.incr("backdrop_cache.misses")
+            return None, embedding
+
+        metrics.incr("backdrop_cache.hits")
+        metrics.incr("backdrop_cache.latency_saved", entries.latencies[best])
+        metrics.incr("backdrop_cache.spend_saved", ESTIMATED_COSTS["luma.image"])
+        logger.debug(f"backdrop cache hit ({scores[best]:.2f}): {entries.urls[best]}")
+        return entries.urls[best], embedding
+
+    def generated(
+        self,
+        url: str,
+        visual_style: str,
+        description: str,
+        embedding: np.ndarray | None,
+        playthrough_id: uuid.UUID | None,
+        latency: float,
+    ):
+        """Holds on to a generated backdrop until it is mirrored"""
+        if embedding is None:
+            return
+        self._pending[url] = _Pending(
+            visual_style=visual_style,
+            description=description,
+            embedding=embedding,
+            playthrough_id=playthrough_id,
+            latency=latency,
+        )
+        while len(self._pending) > _MAX_PENDING_:
+            self._pending.popitem(last=False)
+
+    def _store(self, entry: appmodels.BackdropCacheEntry):
+        # run off the event loop, so on a connection of its own
+        with Session(engine) as session:
+            session.add(entry)
+            session.commit()
+
+    async def remember(self, url: str, mirrored_url: str):
+        """Caches a generated backdrop under its mirrored URL"""
+        pending = self._pending.pop(url, None)
+        if pending is None:
+            return
+
+        entry = appmodels.BackdropCacheEntry()
+        entry.visual_style = pending.visual_style
+        entry.description = pending.description
+        entry.embedding = pending.embedding.astype(np.float32).tobytes()
+        entry.image_url = mirrored_url
+        entry.playthrough_id = pending.playthrough_id
+        entry.latency = pending.latency
+        try:
+            await asyncio.to_thread(self._store, entry)
+        except Exception as e:
+            logger.warning(f"unable to cache backdrop: {e!r}")
+            return
+
+        # visible to this worker straight away, other workers see it once they reload
+        entries = self._styles.get(pending.visual_style)
+        if entries is not None and len(entries.urls) == 0:
+            del self._styles[pending.visual_style]
+        elif entries is not None and entries.matrix.shape[1] == len(pending.embedding):
+            entries.urls.insert(0, mirrored_url)
+            entries.origins[mirrored_url] = pending.playthrough_id
+            entries.latencies.insert(0, pending.latency)
+            entries.matrix = np.vstack(
+                [pending.embedding[np.newaxis, :], entries.matrix]
+            )
+        metrics.incr("backdrop_cache.stored")
+
+    def snapshot(self) -> dict:
+        hits = metrics.count("backdrop_cache.hits")
+        lookups = hits + metrics.count("backdrop_cache.misses")
+        return {
+            "hit_rate": 0.0 if lookups == 0 else hits / lookups,
+            "latency_saved": metrics.count("backdrop_cache.latency_saved"),
+            "spend_saved": metrics.count("backdrop_cache.spend_saved"),
+        }
+
+
+backdrop_cache = BackdropCache(
+    threshold=Config.backdrop_cache_threshold,
+    max_reuse=Config.backdrop_cache_max_reuse,
+    size=Config.backdrop_cache_size,
+    refresh_interval=Config.backdrop_cache_refresh_interval,
+)
@@ -0,0 +1,203 @@
+import time
+import uuid
+import typing
+import asyncio
+from sqlalchemy.orm import Session
+from urllib.parse import quote
+from langchain_core.prompts import ChatPromptTemplate
+from app.config import Config
+from app.logging import logger
+from app.tasks import supervisor
+from app.luma import generate_image
+from app.media import mirror_asset
+from app.connections import connections
+from app.models import GamePlaythrough, GameStoryBlock
+from app.gamemaster.router import router, CallType
+from app.gamemaster.backdrop_cache import backdrop_cache
+from app.gamemaster.generate_next_story_block import TextAction, PhotoAction
+
+_write_scene_summary_ = """
+You are a helpful art director for a text-based adventure game.
+
+You will be provided with context for the current story, along with what has
+just happened and the action the player has taken. Describe the scene where the
+next part of the story is most likely to take place, focusing on the setting,
+lighting, mood and who is present.
+
+Keep the description succinct and no longer than 3 sentences. Respond with only
+the description, and nothing else
+"""
+
+_scene_context_template_ = """
+## Synopsis
+{project_synopsis}
+
+## Current Act Synopsis
+{project_current_act_synopsis}
+
+## Main Character
+{project_main_character}
+
+## Recent Dialogue
+{recent_dialogue}
+
+## Player Action
+{player_action}
+"""
+
+_write_scene_summary_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_scene_summary_),
+        ("human", _scene_context_template_),
+    ]
+)
+
+
+def backdrop_prompt(visual_style: str, description: str) -> str:
+    return f"""
+Using the visual styles: {visual_style}
+
+Without including any text in the art, generate artwork for a novel inspired by the following scene:
+
+{description}
+"""
+
+
+def _scene_context(
+    playthrough: GamePlaythrough, action: typing.Union[TextAction, PhotoAction]
+) -> dict:
+    game_session = playthrough.session
+    blocks = sorted(playthrough.story_blocks, key=lambda b: b.number)
+    main_character = next(c for c in game_session.characters if c.is_main_character)
+
+    act_synopsis = game_session.opening_act_synopsis
+    if len(blocks) > 0:
+        act_synopsis = game_session.middle_act_synopsis
+
+    recent_dialogue = "The story is just beginning"
+    if len(blocks) > 0:
+        recent_dialogue = "\n- ".join(blocks[-1].dialogue[-3:])
+
+    player_action = "None"
+    if isinstance(action, TextAction) and action.text != "":
+        player_action = action.text
+    elif isinstance(action, PhotoAction):
+        player_action = "The main character summons a magical item to assist them"
+
+    return {
+        "project_synopsis": game_session.synopsis,
+        "project_current_act_synopsis": act_synopsis,
+        "project_main_character": f"Name: {main_character.name}\nBackground: {main_character.background}",
+        "recent_dialogue": recent_dialogue,
+        "player_action": player_action,
+    }
+
+
+async def _generate_backdrop(
+    context: dict,
+    visual_style: str,
+    playthrough_id: uuid.UUID | None,
+    shown_urls: set[str],
+) -> str:
+    if Config.stub_image_generation:
+        logger.debug("stub image - performing artificial wait")
+        await asyncio.sleep(3)
+        return f"https://placehold.co/400?text={quote('backdrop image URL')}"
+
+    description = context["project_current_act_synopsis"]
+    if not Config.stub_text_generation:
+        response = await router.invoke(
+            CallType.SCENE_SUMMARY, _write_scene_summary_prompt_, context
+        )
+        description = response.text
+
+    cached_url, embedding = await backdrop_cache.lookup(
+        visual_style, description, playthrough_id, shown_urls
+    )
+    if cached_url is not None:
+        return cached_url
+
+    started_at = time.monotonic()
+    url = await generate_image(backdrop_prompt(visual_style, description), "3:4")
+    backdrop_cache.generated(
+        url,
+        visual_style,
+        description,
+        embedding,
+        playthrough_id,
+        time.monotonic() - started_at,
+    )
+    return url
+
+
+def start_backdrop(
+    playthrough: GamePlaythrough, action: typing.Union[TextAction, PhotoAction]
+) -> asyncio.Task[str]:
+    """
+    Starts generating the backdrop for the next story block from a short scene
+    summary, so that it renders while the dialogue is still being written
+    """
+    context = _scene_context(playthrough, action)
+    shown_urls = {
+        block.backdrop_image_url
+        for block in playthrough.story_blocks
+        if block.backdrop_image_url is not None
+    }
+    return supervisor.spawn(
+        _generate_backdrop(
+            context, playthrough.session.visual_style, playthrough.id, shown_urls
+        ),
+        key=None if playthrough.id is None else str(playthrough.id),
+        name="backdrop",
+    )
+
+
+async def complete_backdrop(
+    session: Session,
+    playthrough: GamePlaythrough,
+    story_block: GameStoryBlock,
+    backdrop: asyncio.Task[str] | None = None,
+):
+    """
+    Stores the backdrop of a story block, generating it from the dialogue if
+    the early backdrop failed or was never started. Does nothing if another
+    worker stored one first
+    """
+    key = str(playthrough.id)
+    game = playthrough.session
+    url = None
+    if backdrop is not None:
+        try:
+            url = await backdrop
+        except Exception as e:
+            logger.warning(f"early backdrop failed, generating from dialogue: {e!r}")
+    if url is None:
+        url = await generate_image(
+            backdrop_prompt(game.visual_style, "\n- ".join(story_block.dialogue)),
+            "3:4",
+        )
+
+    # locked until committed, so the check holds until the backdrop is stored
+    session.refresh(story_block, with_for_update=True)
+    if story_block.backdrop_ready:
+        session.rollback()
+        logger.info(f"backdrop of block {story_block.id} was stored elsewhere")
+        return
+
+    story_block.backdrop_image_url = url
+    story_block.backdrop_ready = True
+    playthrough.touch()
+    session.add_all([story_block, playthrough])
+    session.commit()
+
+    connections.publish(key, {"type": "updated"})
+
+    mirrored_url = await mirror_asset(story_block.backdrop_image_url)
+    await backdrop_cache.remember(story_block.backdrop_image_url, mirrored_url)
+    if mirrored_url != story_block.backdrop_image_url:
+        story_block.backdrop_image_url = mirrored_url
+        playthrough.touch()
+        session.add_all([story_block, playthrough])
+        session.commit()
+
+        connections.publish(key, {"type": "updated"})
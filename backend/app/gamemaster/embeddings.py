@@ -0,0 +1,29 @@
+import numpy as np
+from mistralai import Mistral
+from app.config import Config
+from app.cassettes import http_client
+from app.admission import admission
+from app.gamemaster.resilience import invoke_resilient
+
+_EMBED_BATCH_SIZE_ = 64
+
+mistral_client = Mistral(api_key=Config.mistral_api_key, async_client=http_client())
+
+
+async def embed(texts: list[str]) -> np.ndarray:
+    """Embeds texts as the rows of a matrix, normalised to unit length"""
+    vectors = []
+    for i in range(0, len(texts), _EMBED_BATCH_SIZE_):
+        batch = texts[i : i + _EMBED_BATCH_SIZE_]
+        async with admission.upstream("mistral-embed"):
+            response = await invoke_resilient(
+                "llm.mistral-embed",
+                lambda: mistral_client.embeddings.create_async(
+                    model=Config.fact_embedding_model, inputs=batch
+                ),
+            )
+        vectors.extend(item.embedding for item in response.data)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    # normalised once, so similarity is a plain dot product
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
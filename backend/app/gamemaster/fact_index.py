@@ -0,0 +1,121 @@
+import os
+import asyncio
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app.gamemaster.embeddings import embed
+
+
+class FactIndex:
+    """
+    Embeddings of every session's reference facts, one row per fact, stored
+    as a .npy file per session and memory mapped when searched. Sessions never
+    change after generation, so an index is written once and only rebuilt
+    when missing, e.g. for sessions generated on another host
+    """
+
+    def __init__(self, root: str, max_open: int):
+        self.root = Path(root)
+        self.max_open = max_open
+        self._open: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._building: dict[str, asyncio.Task[np.ndarray]] = {}
+
+    def _path(self, session_id) -> Path:
+        return self.root / f"{session_id}.npy"
+
+    def _load(self, session_id, rows: int) -> np.ndarray | None:
+        key = str(session_id)
+        matrix = self._open.get(key)
+        if matrix is None:
+            path = self._path(session_id)
+            if not path.is_file():
+                return None
+            matrix = np.load(path, mmap_mode="r")
+            self._open[key] = matrix
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        self._open.move_to_end(key)
+
+        # an index out of step with the facts is as good as none
+        if matrix.shape[0] != rows:
+            self._open.pop(key, None)
+            return None
+        return matrix
+
+    def _write(self, session_id, matrix: np.ndarray):
+        path = self._path(session_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a partially written index is never mapped
+        partial = path.with_name(f".{path.stem}.partial.npy")
+        np.save(partial, matrix)
+        os.replace(partial, path)
+        self._open.pop(str(session_id), None)
+
+    async def build(self, session_id, facts: list[str]) -> np.ndarray:
+        key = str(session_id)
+        task = self._building.get(key)
+        if task is None:
+
+            async def build() -> np.ndarray:
+                try:
+                    matrix = await embed(facts)
+                    await asyncio.to_thread(self._write, session_id, matrix)
+                    metrics.incr("fact_index.built")
+                    return matrix
+                finally:
+                    self._building.pop(key, None)
+
+            task = asyncio.ensure_future(build())
+            self._building[key] = task
+        return await task
+
+    async def search(
+        self, session_id, facts: list[str], query: str, k: int
+    ) -> list[str]:
+        """The k facts most similar to the query, most similar first"""
+        if len(facts) == 0 or k <= 0:
+            return []
+        if len(facts) <= k:
+            return list(facts)
+
+        matrix = self._load(session_id, len(facts))
+        if matrix is None:
+            matrix = await self.build(session_id, facts)
+
+        query_vector = (await embed([query]))[0]
+        scores = matrix @ query_vector
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        metrics.incr("fact_index.searches")
+        return [facts[i] for i in top]
+
+
+fact_index = FactIndex(Config.fact_index_root, Config.fact_index_max_open)
+
+
+async def relevant_reference(game_session, query: str) -> str:
+    """
+    The session's reference summary, followed by the facts most relevant to
+    the query. The number of facts is fixed, so prompts stay the same size no
+    matter how much reference material the session was written from
+    """
+    facts = game_session.reference_facts or []
+    if Config.stub_text_generation or len(facts) == 0:
+        return game_session.reference_material_summary
+
+    try:
+        relevant = await fact_index.search(
+            game_session.id, facts, query, Config.fact_index_top_k
+        )
+    except Exception as e:
+        logger.warning(f"fact retrieval failed, using the summary only: {e!r}")
+        metrics.incr("fact_index.failures")
+        return game_session.reference_material_summary
+
+    return (
+        f"{game_session.reference_material_summary}\n\nRelevant facts:\n"
+        + "\n".join(f"- {fact}" for fact in relevant)
+    )
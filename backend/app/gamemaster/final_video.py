@@ -0,0 +1,135 @@
+import asyncio
+from sqlalchemy.orm import Session
+from langchain_core.prompts import ChatPromptTemplate
+from app.admission import admission, llm_call_cost, ESTIMATED_COSTS
+from app.connections import connections
+from app.logging import logger
+from app.luma import luma_client
+from app.media import mirror_asset
+from app.media.video import stitch
+from app.models import GameSession, GamePlaythrough, GameStoryBlock
+from app.tasks import supervisor
+from app.gamemaster.llms import mistral_small
+from app.gamemaster.resilience import invoke_resilient
+
+_write_clip_scene_ = """
+{base_character}
+
+You will be provided with a synopsis for a short story, along with the reference
+material that influences the story. Use the synopsis to generate a video, and
+use the reference material to generate the video background, mood and setting.
+
+From this information, describe a video scene that would be suitable as a
+trailer for the short story in detail, going into detail on how the scene is
+laid out, who is in the foreground and the camera movements or scene
+transitions.
+
+Keep this description succinct and no longer than 1 paragraph.
+"""
+
+_clip_context_template_ = """
+## Reference Material
+{reference_material}
+
+## Synopsis
+{synopsis}
+
+## Story Events
+{story_events}
+"""
+
+_write_clip_scene_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_clip_scene_),
+        ("human", _clip_context_template_),
+    ]
+)
+
+
+async def generate_clip(game: GameSession, block: GameStoryBlock) -> str:
+    """Generates the final video clip for a single story block"""
+    chain = _write_clip_scene_prompt_ | mistral_small.model
+    story_block_context = {
+        "base_character": "You are a helpful video director",
+        "synopsis": game.synopsis,
+        "reference_material": game.reference_material_summary,
+        "story_events": "\n- ".join(block.dialogue),
+    }
+    async with admission.upstream(
+        mistral_small.name, llm_call_cost(mistral_small.cost), queue_timeout=None
+    ):
+        story_block_response = await invoke_resilient(
+            "llm.final_video_prompt",
+            lambda: chain.ainvoke(story_block_context),
+        )
+
+    logger.debug(f"generating final video, clip {block.number} of {game.total_actions}")
+    async with admission.upstream(
+        "luma", ESTIMATED_COSTS["luma.video"], queue_timeout=None
+    ):
+        generation = await luma_client.generations.create(
+            model="ray-flash-2",
+            prompt=f"""
+Using the visual style: {game.visual_style}
+
+Generate a video using the following description:
+{story_block_response.content}
+""",
+        )
+
+        while True:
+            logger.debug(f"checking clip {block.number} of {game.total_actions}")
+            gen = await luma_client.generations.get(id=generation.id)
+            if gen.state == "completed":
+                logger.debug(f"clip {block.number} generated")
+                return await mirror_asset(gen.assets.video)
+            elif gen.state == "failed":
+                raise RuntimeError(f"Generation failed: {gen.failure_reason}")
+
+            await asyncio.sleep(3)
+
+
+async def create_final_video(session: Session, playthrough: GamePlaythrough):
+    """
+    Generates the clips for the final video, committing each as it completes,
+    then stitches them together. Clips which already exist are kept, so an
+    interrupted final video picks up where it left off. Should stitching
+    fail, the last clip stands in for the final video
+    """
+    key = str(playthrough.id)
+    blocks = sorted(playthrough.story_blocks, key=lambda b: b.number)
+    for block in blocks:
+        if block.video_clip_url is not None:
+            continue
+
+        # every clip is a stage of its own, they take minutes each
+        supervisor.checkpoint(key)
+        block.video_clip_url = await generate_clip(playthrough.session, block)
+        session.add_all([block])
+        session.commit()
+
+    supervisor.checkpoint(key)
+    final_video_url = blocks[-1].video_clip_url
+    final_video_hls_url = None
+    try:
+        stitched = await stitch([block.video_clip_url for block in blocks])
+    except Exception as e:
+        logger.error(f"unable to stitch the final video of {key}: {e!r}")
+        stitched = None
+    if stitched is not None:
+        final_video_url = stitched.mp4_url
+        final_video_hls_url = stitched.hls_url
+
+    if (
+        playthrough.final_video_url != final_video_url
+        or playthrough.final_video_hls_url != final_video_hls_url
+    ):
+        playthrough.final_video_url = final_video_url
+        playthrough.final_video_hls_url = final_video_hls_url
+        playthrough.touch()
+        session.add_all([playthrough])
+        session.commit()
+
+    logger.debug(f"final video of {key} done")
+
+    connections.publish(key, {"type": "updated"})
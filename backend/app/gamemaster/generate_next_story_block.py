@@ -6,23 +6,25 @@ from functools import reduce
 from dataclasses import dataclass
 from urllib.parse import quote
 from app.config import Config
-from app.models import GameSession, GameStoryBlock
+from app.cassettes import http_client
+from app.models import GamePlaythrough, GameStoryBlock
 from app.logging import logger
-from app.gamemaster.llms import llm, GAMEMASTER_BASE_CHARACTER
+from app.gamemaster.llms import GAMEMASTER_BASE_CHARACTER
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
 from app.luma import luma_client
-from app.gamemaster.utils import clean_and_parse_json
+from app.gamemaster.schemas import StoryBlockPayload
+from app.gamemaster.resilience import invoke_resilient
+from app.gamemaster.router import router, CallType
+from app.gamemaster.fact_index import relevant_reference
+from app.admission import admission, ESTIMATED_COSTS
 from lumaai.types import Generation
-from langchain_mistralai import ChatMistralAI
 from mistralai import Mistral
 
 _INTRO_BLOCKS_ = 1
 _CLOSING_BLOCKS_ = 2
 
-is_mistral = isinstance(llm, ChatMistralAI)
-
-mistral_client = Mistral(api_key=Config.mistral_api_key)
+mistral_client = Mistral(api_key=Config.mistral_api_key, async_client=http_client())
 
 _write_final_act_synopsis_ = """
 {base_character}
@@ -75,23 +77,19 @@ _story_block_context_template_ = """
 {additional_requirements}
 """
 
-_write_story_block_ = (
-    ChatPromptTemplate.from_messages(
-        [
-            ("system", _write_act_template_),
-            ("human", _story_block_context_template_),
-        ]
-    )
-) | llm
-
-_write_final_act_synopsis_ = (
-    ChatPromptTemplate.from_messages(
-        [
-            ("system", _write_final_act_synopsis_),
-            ("human", _story_block_context_template_),
-        ]
-    )
-) | llm
+_write_story_block_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_act_template_),
+        ("human", _story_block_context_template_),
+    ]
+)
+
+_write_final_act_synopsis_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_final_act_synopsis_),
+        ("human", _story_block_context_template_),
+    ]
+)
 
 
 @dataclass
@@ -105,11 +103,12 @@ class PhotoAction:
 
 
 async def generate_next_story_block(
-    game_session: GameSession, action: typing.Union[TextAction, PhotoAction]
+    playthrough: GamePlaythrough, action: typing.Union[TextAction, PhotoAction]
 ):
     print("START NEXT BLOCK WRITING")
     parsed_response: dict
-    blocks = game_session.story_blocks
+    game_session = playthrough.session
+    blocks = playthrough.story_blocks
     previous_block = None
     actions_consumed = 1
     if isinstance(action, PhotoAction):
@@ -163,6 +162,7 @@ async def generate_next_story_block(
     else:
         additional_requirements = ""
         project_current_act_synopsis = ""
+        call_type = CallType.STORY_TURN
 
         action_part = ""
         if isinstance(action, TextAction):
@@ -171,25 +171,29 @@ async def generate_next_story_block(
         elif isinstance(action, PhotoAction):
             print("INVOKING MAGIC ASSISTANCE")
             new_story_block.previous_action = "photo"
-            mchat_response = await mistral_client.chat.complete_async(
-                model="pixtral-12b-2409",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
+            async with admission.upstream("pixtral", ESTIMATED_COSTS["pixtral"]):
+                mchat_response = await invoke_resilient(
+                    "llm.pixtral",
+                    lambda: mistral_client.chat.complete_async(
+                        model="pixtral-12b-2409",
+                        messages=[
                             {
-                                "type": "text",
-                                "text": f"""
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": f"""
 What is the most prominent object in this image? For example, this could be either a sword, knife, frying pan or pillow. This could also be animals or plants, like a fish, dog, or flower.
 
 Respond only with the name of the item identified
 """,
-                            },
-                            {"type": "image_url", "image_url": f"{action.url}"},
+                                    },
+                                    {"type": "image_url", "image_url": f"{action.url}"},
+                                ],
+                            }
                         ],
-                    }
-                ],
-            )
+                    ),
+                )
             magic_assistance = mchat_response.choices[0].message.content
             print(f"INVOKED MAGIC ASSISTANCE - {magic_assistance}")
             action_part = f"""
@@ -203,6 +207,18 @@ Continue the dialogue in a way that allows the main character to use the item as
         if previous_block is not None:
             previous_dialogue_part = f"The next dialogue is a continuation of the previous dialogue:\n{"\n- ".join(previous_block.dialogue[-3:])}"
 
+        # facts are retrieved for what is happening now, rather than sending all of them
+        retrieval_query = [new_story_block.previous_action]
+        if isinstance(action, PhotoAction):
+            retrieval_query = [magic_assistance]
+        if previous_block is not None:
+            retrieval_query += previous_block.dialogue[-3:]
+        else:
+            retrieval_query.append(game_session.opening_act_synopsis)
+        project_reference = await relevant_reference(
+            game_session, "\n".join(retrieval_query)
+        )
+
         main_characters = list(
             filter(lambda c: c.is_main_character, game_session.characters)
         )
@@ -212,37 +228,39 @@ Continue the dialogue in a way that allows the main character to use the item as
         )
 
         if block_number == 1:
+            call_type = CallType.OPENING_BLOCK
             project_current_act_synopsis = game_session.opening_act_synopsis
             additional_requirements = "This is the opening dialogue, include more dialogue to introduce the world and the main character"
         elif block_number <= _INTRO_BLOCKS_:
             project_current_act_synopsis = game_session.opening_act_synopsis
             additional_requirements = f"{previous_dialogue_part}{action_part}"
         elif actions_remaining < _CLOSING_BLOCKS_:
-            if game_session.final_act_synoposis != "":
-                final_act_response = await _write_final_act_synopsis_.ainvoke(
-                    {
-                        "project_reference": game_session.reference_material_summary,
-                        "base_character": GAMEMASTER_BASE_CHARACTER,
-                        "project_synopsis": game_session.synopsis,
-                        "project_current_act_synopsis": project_current_act_synopsis,
-                        "project_main_character": f"Name: {main_characters[0].name}\bPersonality: {main_characters[0].personality}\nBackground: {main_characters[0].background}",
-                        "project_supporting_characters_description": "\n\n".join(
-                            list(
-                                map(
-                                    lambda c: f"Name: {c.name}\nPersonality: {c.personality}\nBackground: {c.background}",
-                                    supporting_characters,
-                                )
+            call_type = CallType.CLOSING_TURN
+            if playthrough.final_act_synoposis != "":
+                final_act_context = {
+                    "project_reference": project_reference,
+                    "base_character": GAMEMASTER_BASE_CHARACTER,
+                    "project_synopsis": game_session.synopsis,
+                    "project_current_act_synopsis": project_current_act_synopsis,
+                    "project_main_character": f"Name: {main_characters[0].name}\bPersonality: {main_characters[0].personality}\nBackground: {main_characters[0].background}",
+                    "project_supporting_characters_description": "\n\n".join(
+                        list(
+                            map(
+                                lambda c: f"Name: {c.name}\nPersonality: {c.personality}\nBackground: {c.background}",
+                                supporting_characters,
                             )
-                        ),
-                        "additional_requirements": additional_requirements,
-                    }
+                        )
+                    ),
+                    "additional_requirements": additional_requirements,
+                }
+                final_act_response = await router.invoke(
+                    CallType.FINAL_ACT_SYNOPSIS,
+                    _write_final_act_synopsis_,
+                    final_act_context,
                 )
-                if is_mistral:
-                    game_session.final_act_synoposis = final_act_response.content
-                else:
-                    game_session.final_act_synoposis = final_act_response
+                playthrough.final_act_synoposis = final_act_response.text
 
-            project_current_act_synopsis = game_session.final_act_synoposis
+            project_current_act_synopsis = playthrough.final_act_synoposis
 
             if actions_remaining <= 0:
                 additional_requirements += "\n\nThis is the final dialogue, use this opportunity to write an ending through the dialogue. The possible actions for the player should be an empty array"
@@ -257,28 +275,29 @@ Continue the dialogue in a way that allows the main character to use the item as
         print("ADDITIONAL REQUIREMENTS")
         print(additional_requirements)
 
-        raw_response = await _write_story_block_.ainvoke(
-            {
-                "project_reference": game_session.reference_material_summary,
-                "base_character": GAMEMASTER_BASE_CHARACTER,
-                "project_synopsis": game_session.synopsis,
-                "project_current_act_synopsis": project_current_act_synopsis,
-                "project_main_character": f"Name: {main_characters[0].name}\bPersonality: {main_characters[0].personality}\nBackground: {main_characters[0].background}",
-                "project_supporting_characters_description": "\n\n".join(
-                    list(
-                        map(
-                            lambda c: f"Name: {c.name}\nPersonality: {c.personality}\nBackground: {c.background}",
-                            supporting_characters,
-                        )
+        story_block_context = {
+            "project_reference": project_reference,
+            "base_character": GAMEMASTER_BASE_CHARACTER,
+            "project_synopsis": game_session.synopsis,
+            "project_current_act_synopsis": project_current_act_synopsis,
+            "project_main_character": f"Name: {main_characters[0].name}\bPersonality: {main_characters[0].personality}\nBackground: {main_characters[0].background}",
+            "project_supporting_characters_description": "\n\n".join(
+                list(
+                    map(
+                        lambda c: f"Name: {c.name}\nPersonality: {c.personality}\nBackground: {c.background}",
+                        supporting_characters,
                     )
-                ),
-                "additional_requirements": additional_requirements,
-            }
+                )
+            ),
+            "additional_requirements": additional_requirements,
+        }
+        response = await router.invoke(
+            call_type,
+            _write_story_block_,
+            story_block_context,
+            schema=StoryBlockPayload,
         )
-        if is_mistral:
-            parsed_response = clean_and_parse_json(raw_response.content)
-        else:
-            parsed_response = clean_and_parse_json(raw_response)
+        parsed_response = response.payload.model_dump()
 
     new_story_block.dialogue = parsed_response["dialogue"]
     new_story_block.possible_actions = parsed_response["possible_actions"]
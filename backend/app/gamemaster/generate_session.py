@@ -0,0 +1,272 @@
+import json
+import uuid
+import random
+import typing
+import asyncio
+from sqlalchemy.orm import Session
+from urllib.parse import quote
+from langchain_core.prompts import ChatPromptTemplate
+from app.config import Config
+from app.logging import logger
+from app.database import connection
+from app.dedup import DuplicateSession, sign, find_duplicate
+from app.luma import luma_client
+from app.admission import admission, ESTIMATED_COSTS
+from app.media import mirror_asset
+from app.models import GameSession, SessionSignature
+from app.gamemaster.llms import GAMEMASTER_BASE_CHARACTER
+from app.gamemaster.llms import llm as fast_llm, mistral_large
+from app.gamemaster.opening_block import prepare_opening_block
+from app.gamemaster.ingest import ingest_reference_material
+from app.gamemaster.fact_index import fact_index
+from app.gamemaster.schemas import SessionPayload
+from app.gamemaster.structured import structured, resolve_structured
+from app.gamemaster.resilience import invoke_resilient
+
+VISUAL_STYLES = [
+    "hyper-realism",
+    "comics, halftone",
+    "egyptian, mythology, greek",
+    "animation, cartoon",
+    "cgi, mysterious",
+]
+
+_write_session_ = """
+{base_character}
+
+You will be provided with text that will serve as the reference material for your next story. This material will have historical and cultural significance.
+
+Your story should centre around a main character. Give details of this main character, including a detailed breakdown of their personality and background. The short story should revolve around the main character, illustrating a particularly challenging day in their day-to-day routine in the context of the story setting. Also, introduce a small cast of supporting characters (maximum of 2) who appears in the story.
+
+In addition to the synopsis for the main story, also write two detailed synopsis for different sections of the story. Adhering to the three-act story framework, write details of the setup and confrontation acts only. Rely heavily on the reference material and the background of the main character while writing these acts, while also injecting a little bit of fantasy to make the story interesting.
+
+Finally, include a short prologue built from the synopsis to introduce your story. The prologue should be broken into multiple short lines, fed to the player one at a time, similar to movie openings.
+
+Remember to base your story around the reference material provided. Also extract the key historical and cultural details from this reference material and highlight them in your response.
+
+Your response should only include the content in JSON. The structure of the response should follow this example:
+
+```
+{{ "title": "Act 1", "reference_material_summary": "A summary of the original reference material provided", "synopsis": "A short synopsis introducing the world", "themes": ["nature", "culture", "history"], "main_character": {{ "name": "Mr John Doe", "personality": "A quiet businessman", "background": "Mr John Doe’s detailed background" }}, "supporting_characters": [{{ "name": "Dr Watson", "personality": "Dr Watson’s personality in detail", "background": "Dr Watson’s background" }}, {{ "name": "Mrs Demure", "personality": "Friendly old lady", "background": "Owner and head chef of the neighbourhood bakery" }}], "setup_act": "detailed synopsis of the first act", "confrontation_act": "detailed synopsis of the second act", "prologue": ["Once upon a time…", "In a land far far away…"], "key_facts": ["Pelicans have lived in the park since 1664.", "The park is bordered by three royal palaces."] }}
+```
+```
+    """
+
+_write_session_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_session_),
+        ("human", "{reference_material}"),
+    ]
+)
+
+_write_trailer_ = """
+{base_character}
+
+You will be provided with a synopsis for a short story, along with the reference
+material that influences the story. Use the synopsis to generate a video, and
+use the reference material to generate the video background, mood and setting.
+
+From this information, describe a video scene that would be suitable as a
+trailer for the short story in detail, going into detail on how the scene is
+laid out, who is in the foreground and the camera movements or scene
+transitions.
+
+Keep this description succinct and no longer than 1 paragraph.
+"""
+
+_trailer_context_template_ = """
+## Synopsis
+{synopsis}
+
+## Reference material
+{reference_material}
+"""
+
+_write_trailer_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _write_trailer_),
+        ("human", _trailer_context_template_),
+    ]
+)
+
+DEFAULT_REFERENCE_MATERIAL = """
+This is the most royal of London’s Royal Parks. Shaped by generations of monarchs and bordered by three royal palaces, St. James’s Park is the home of ceremonial events in the capital. From royal weddings and jubilees to military parades and state celebrations – this is the park where history is made. Come and explore it for yourself…
+
+There’s always something to see here - from soldiers in scarlet tunics marching down The Mall to bright beds of flowers bursting with blooms. Don’t miss the classic London views from the lake, where you should also keep an eye out for the famous pelicans who call the park home. Did you know that pelicans have been kept at the park since 1664, when a Russian ambassador presented them to King Charles II? You can often find them perched on benches by the lake, graciously greeting visitors from around the world.  
+
+You’ll spot many famous landmarks in St. James’s Park – from sweeping Admiralty Arch to the ceremonial hotspot Horse Guards Parade. And then of course there’s Buckingham Palace – head down The Mall for that world-famous view! Among the park’s diverse statues, you’ll encounter the statue of Queen Elizabeth the Queen Mother, adorned in a resplendent, flamboyant plumed hat, a testament to regal elegance. Nearby, the simple yet poignant white marble Boy Statue invites reflection, adding a touch of innocence and contemplation to the park’s ambiance.
+
+If you’re looking to get away from the crowds, wander along the peaceful lakeside path where you can admire the spectacular trees and abundance of colourful waterbirds. There’s always something new to discover in this historic landscape – from spring bulbs to autumn colours.  
+            """
+
+
+async def _write_session_payload(reference_material: str) -> dict:
+    if Config.stub_text_generation:
+        with open("./tests/example_gen.json", "r") as file:
+            return json.load(file)
+
+    chain = _write_session_prompt_ | structured(mistral_large.model, SessionPayload)
+    session_context = {
+        "base_character": GAMEMASTER_BASE_CHARACTER,
+        "reference_material": reference_material,
+    }
+
+    logger.debug("start prompt gen")
+    response = await invoke_resilient(
+        "llm.session", lambda: chain.ainvoke(session_context)
+    )
+    payload = await resolve_structured(response, SessionPayload, label="session")
+    return payload.model_dump()
+
+
+def _characters(d: dict) -> list[dict]:
+    characters: list[dict] = list(
+        map(
+            lambda x: x[1]
+            | {
+                "id": 1 + x[0],
+                "profile_image_url": f"https://placehold.co/400?text={quote(x[1]["name"])}",
+                "is_main_character": False,
+            },
+            enumerate(d["supporting_characters"]),
+        )
+    )
+
+    characters.append(
+        d["main_character"]
+        | {
+            "id": 0,
+            "profile_image_url": f"https://placehold.co/400?text={quote(d["main_character"]["name"])}",
+            "is_main_character": True,
+        }
+    )
+    return characters
+
+
+async def _generate_trailer(game_session: GameSession) -> tuple[str, str]:
+    chain = _write_trailer_prompt_ | fast_llm
+    response = await invoke_resilient(
+        "llm.trailer_prompt",
+        lambda: chain.ainvoke(
+            {
+                "base_character": "You are a helpful video director",
+                "synopsis": game_session.synopsis,
+                "reference_material": game_session.reference_material_summary,
+            }
+        ),
+    )
+
+    # nobody waits on inventory generation, so it queues for a slot
+    async with admission.upstream(
+        "luma", ESTIMATED_COSTS["luma.video"], queue_timeout=None
+    ):
+        logger.debug("start video gen")
+        generation = await luma_client.generations.create(
+            model="ray-2",
+            prompt=f"""
+Using the following visual styles: {game_session.visual_style}
+
+Generate a video using the following description:
+{response.content}
+""",
+            loop=True,
+        )
+
+        while True:
+            logger.debug("checking video")
+            gen = await luma_client.generations.get(id=generation.id)
+            if gen.state == "completed":
+                logger.debug("end video gen")
+                return (gen.assets.video, gen.assets.image)
+            elif gen.state == "failed":
+                raise RuntimeError(f"Generation failed: {gen.failure_reason}")
+
+            await asyncio.sleep(3)
+
+
+def _check_duplicate(signature: SessionSignature) -> tuple[uuid.UUID, float] | None:
+    # stubbed stories are all the same story
+    if not Config.dedup_enabled or Config.stub_text_generation:
+        return None
+    with Session(connection) as session:
+        return find_duplicate(session, signature)
+
+
+async def generate_session(
+    visual_style: str | None = None,
+    reference_material: str = DEFAULT_REFERENCE_MATERIAL,
+    on_duplicate: typing.Literal["skip", "link", "allow"] = "skip",
+) -> GameSession:
+    """
+    Writes a complete, ready to play session: the story, its trailer and,
+    when enabled, the opening story block. The session is not committed.
+
+    Reference material close to an existing session's raises DuplicateSession
+    before anything is generated. With on_duplicate="link" the material is
+    also recorded against that session, so it is recognised straight away
+    next time. A synopsis close to an existing session's raises before the
+    trailer is generated, whatever on_duplicate is
+    """
+    reference_signature = sign("reference", reference_material)
+    duplicate = None
+    if on_duplicate != "allow":
+        duplicate = _check_duplicate(reference_signature)
+    if duplicate is not None:
+        session_id, similarity = duplicate
+        if on_duplicate == "link" and similarity < 1:
+            reference_signature.session_id = session_id
+            with Session(connection) as session:
+                session.add(reference_signature)
+                session.commit()
+        raise DuplicateSession(session_id, "reference", similarity)
+
+    # long material is digested first, the session is written from the digest
+    digest = await ingest_reference_material(reference_material)
+    d = await _write_session_payload(
+        reference_material if digest is None else digest.render()
+    )
+
+    game_session = GameSession()
+    game_session.visual_style = visual_style or random.choice(VISUAL_STYLES)
+    game_session.id = uuid.uuid4()
+    game_session.title = d["title"]
+    game_session.themes = d["themes"]
+    game_session.synopsis = d["synopsis"]
+    game_session.opening_video_url = "http://localhost:3000/videos/test.mp4"
+    game_session.opening_act_synopsis = d["setup_act"]
+    game_session.middle_act_synopsis = d["confrontation_act"]
+    game_session.prologue = d["prologue"]
+    game_session.promo_image_url = (
+        f"https://placehold.co/600x400?text={quote("Promo Image")}"
+    )
+    game_session.total_actions = 8
+    game_session.reference_material_summary = d["reference_material_summary"]
+    game_session.reference_facts = d.get("key_facts", [])
+    if digest is not None:
+        game_session.reference_material_summary = digest.summary
+        game_session.reference_facts = digest.facts
+    game_session.set_characters(_characters(d))
+
+    synopsis_signature = sign("synopsis", game_session.synopsis)
+    duplicate = _check_duplicate(synopsis_signature)
+    if duplicate is not None:
+        raise DuplicateSession(duplicate[0], "synopsis", duplicate[1])
+    game_session.signatures = [reference_signature, synopsis_signature]
+
+    if not Config.stub_text_generation and len(game_session.reference_facts) > 0:
+        try:
+            await fact_index.build(game_session.id, game_session.reference_facts)
+        except Exception as e:
+            # rebuilt on first use instead
+            logger.warning(f"failed to index reference facts: {e!r}")
+
+    if not Config.stub_video_generation:
+        video_url, image_url = await _generate_trailer(game_session)
+        game_session.opening_video_url = await mirror_asset(video_url)
+        game_session.promo_image_url = await mirror_asset(image_url)
+
+    if Config.pregenerate_opening_block:
+        logger.debug("start opening block gen")
+        game_session.opening_block = await prepare_opening_block(game_session)
+
+    return game_session
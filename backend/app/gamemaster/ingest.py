@@ -0,0 +1,185 @@
+import re
+import time
+import asyncio
+from dataclasses import dataclass
+from langchain_core.prompts import ChatPromptTemplate
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app.gamemaster.router import router, CallType
+from app.gamemaster.schemas import ReferenceDigestPayload
+
+_digest_chunk_ = """
+You are a meticulous researcher preparing reference material for a story writer.
+
+You will be provided with one part of a longer document. Summarise this part in
+a short paragraph, then list the key historical and cultural facts it contains.
+Each fact should be a single, self-contained sentence that still makes sense
+without the rest of the document. Leave out anything that is not a fact about
+the subject, such as navigation text, references or licensing notices.
+
+Your response should only include the content in JSON. The structure of the
+response should follow this example:
+
+```
+{{ "summary": "A summary of this part of the document", "facts": ["The park was opened to the public in 1603.", "Pelicans have lived in the park since 1664."] }}
+```
+"""
+
+_merge_digests_ = """
+You are a meticulous researcher preparing reference material for a story writer.
+
+You will be provided with the summaries and facts of consecutive parts of a
+longer document. Merge them into a single summary covering all of the parts, in
+no more than a few paragraphs, and a single list of facts. Drop duplicate or
+overlapping facts, keeping the most informative version of each, and keep at
+most {max_facts} of the most significant facts.
+
+Your response should only include the content in JSON. The structure of the
+response should follow this example:
+
+```
+{{ "summary": "A summary of all the parts", "facts": ["The park was opened to the public in 1603.", "Pelicans have lived in the park since 1664."] }}
+```
+"""
+
+_digest_chunk_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _digest_chunk_),
+        ("human", "{chunk}"),
+    ]
+)
+
+_merge_digests_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _merge_digests_),
+        ("human", "{digests}"),
+    ]
+)
+
+
+@dataclass
+class ReferenceDigest:
+    summary: str
+    facts: list[str]
+
+    def render(self) -> str:
+        facts = "\n".join(f"- {fact}" for fact in self.facts)
+        return f"## Summary\n{self.summary}\n\n## Key Facts\n{facts}"
+
+
+def chunk_text(text: str, size: int) -> list[str]:
+    """
+    Splits text into chunks of at most `size` characters, breaking between
+    paragraphs where possible and between sentences otherwise
+    """
+    pieces: list[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if paragraph == "":
+            continue
+        if len(paragraph) <= size:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            # a single overlong sentence is cut wherever it has to be
+            pieces.extend(sentence[i : i + size] for i in range(0, len(sentence), size))
+
+    chunks: list[str] = []
+    current = ""
+    for piece in pieces:
+        if current != "" and len(current) + len(piece) + 2 > size:
+            chunks.append(current)
+            current = ""
+        current = piece if current == "" else f"{current}\n\n{piece}"
+    if current != "":
+        chunks.append(current)
+    return chunks
+
+
+def _unique_facts(facts: list[str]) -> list[str]:
+    seen: set[str] = set()
+    unique = []
+    for fact in facts:
+        normalised = " ".join(fact.lower().split()).rstrip(".")
+        if normalised == "" or normalised in seen:
+            continue
+        seen.add(normalised)
+        unique.append(fact.strip())
+    return unique
+
+
+async def _digest_chunk(chunk: str) -> ReferenceDigest:
+    response = await router.invoke(
+        CallType.REFERENCE_CHUNK,
+        _digest_chunk_prompt_,
+        {"chunk": chunk},
+        schema=ReferenceDigestPayload,
+    )
+    return ReferenceDigest(
+        summary=response.payload.summary,
+        facts=_unique_facts(response.payload.facts),
+    )
+
+
+async def _merge_digests(digests: list[ReferenceDigest]) -> ReferenceDigest:
+    if len(digests) == 1:
+        return digests[0]
+
+    parts = "\n\n".join(
+        f"# Part {i + 1}\n{digest.render()}" for i, digest in enumerate(digests)
+    )
+    response = await router.invoke(
+        CallType.REFERENCE_REDUCE,
+        _merge_digests_prompt_,
+        {"digests": parts, "max_facts": Config.ingest_max_facts},
+        schema=ReferenceDigestPayload,
+    )
+    return ReferenceDigest(
+        summary=response.payload.summary,
+        facts=_unique_facts(response.payload.facts)[: Config.ingest_max_facts],
+    )
+
+
+async def ingest_reference_material(text: str) -> ReferenceDigest | None:
+    """
+    Digests long reference material into a summary and a list of key facts.
+    Chunks are digested in parallel with a fast model, then merged a few at a
+    time, level by level, until a single digest remains. Every chunk and merge
+    is one call, so cost grows linearly with the document while the time taken
+    grows with the number of levels. Returns None for material short enough to
+    be used as it is
+    """
+    if len(text) <= Config.ingest_threshold_chars or Config.stub_text_generation:
+        return None
+
+    started_at = time.monotonic()
+    chunks = chunk_text(text, Config.ingest_chunk_chars)
+    limit = asyncio.Semaphore(Config.ingest_concurrency)
+
+    async def bounded(coro):
+        async with limit:
+            return await coro
+
+    digests = await asyncio.gather(*(bounded(_digest_chunk(c)) for c in chunks))
+
+    levels = 0
+    fan_in = max(2, Config.ingest_reduce_fan_in)
+    while len(digests) > 1:
+        levels += 1
+        digests = await asyncio.gather(
+            *(
+                bounded(_merge_digests(digests[i : i + fan_in]))
+                for i in range(0, len(digests), fan_in)
+            )
+        )
+
+    digest = digests[0]
+    elapsed = time.monotonic() - started_at
+    metrics.incr("ingest.chunks", len(chunks))
+    metrics.observe("ingest.latency", elapsed)
+    logger.info(
+        f"ingested {len(text)} characters in {len(chunks)} chunks and {levels} merge levels, "
+        f"{len(digest.facts)} facts in {elapsed:.1f}s"
+    )
+    return digest
@@ -1,17 +1,65 @@
 import random
+from dataclasses import dataclass
+from langchain_core.language_models import BaseChatModel
 from app.config import Config
-from langchain_ollama.llms import OllamaLLM
+from app.cassettes import http_client
+from langchain_ollama import ChatOllama
 from langchain_mistralai import ChatMistralAI
 
-# llm = OllamaLLM(model="mistral-small", seed=random.seed())
-# llm = OllamaLLM(model="gemma3:12b", seed=random.seed())
-llm = ChatMistralAI(
-    model_name="mistral-small-latest",
-    temperature=0.3,
-    random_seed=random.seed(),
-    api_key=Config.mistral_api_key,
+
+@dataclass
+class Backend:
+    name: str
+    model: BaseChatModel
+    # approximate USD per million output tokens, used to enforce cost budgets
+    cost: float
+
+
+mistral_small = Backend(
+    name="mistral-small",
+    model=ChatMistralAI(
+        model_name="mistral-small-latest",
+        temperature=0.3,
+        random_seed=random.seed(),
+        api_key=Config.mistral_api_key,
+        # retries and deadlines are handled by app.gamemaster.resilience
+        max_retries=1,
+    ),
+    cost=0.3,
+)
+
+mistral_large = Backend(
+    name="mistral-large",
+    model=ChatMistralAI(
+        model_name="mistral-large-latest",
+        temperature=0.3,
+        api_key=Config.mistral_api_key,
+        max_retries=1,
+    ),
+    cost=6.0,
 )
 
+# swapped so that traffic can be recorded and replayed
+for backend in (mistral_small, mistral_large):
+    backend.model.async_client = http_client(backend.model.async_client)
+
+backends = [mistral_small, mistral_large]
+
+if Config.ollama_model is not None:
+    backends.append(
+        Backend(
+            name="ollama",
+            model=ChatOllama(
+                model=Config.ollama_model,
+                base_url=Config.ollama_base_url,
+                temperature=0.3,
+            ),
+            cost=0,
+        )
+    )
+
+llm = mistral_small.model
+
 GAMEMASTER_BASE_CHARACTER = """
 You are a passionate story writer, with a knack for writing stories based around
 real world history and culture.
@@ -0,0 +1,52 @@
+from app.media import mirror_asset
+from app.models import GameSession, GamePlaythrough, GameStoryBlock
+from app.gamemaster.backdrops import start_backdrop
+from app.gamemaster.backdrop_cache import backdrop_cache
+from app.gamemaster.generate_next_story_block import (
+    generate_next_story_block,
+    TextAction,
+)
+
+
+async def prepare_opening_block(game_session: GameSession) -> dict:
+    """
+    Writes the opening story block and its backdrop ahead of time. The opening
+    block only depends on the generated session, so it can be stored with it
+    and served as soon as a player starts the game
+    """
+    # a throwaway playthrough, it is never added to the database
+    playthrough = GamePlaythrough(session=game_session, story_blocks=[])
+    action = TextAction(text="")
+    backdrop = start_backdrop(playthrough, action)
+    try:
+        block = await generate_next_story_block(playthrough, action)
+    except BaseException:
+        backdrop.cancel()
+        raise
+
+    backdrop_url = await backdrop
+    mirrored_url = await mirror_asset(backdrop_url)
+    await backdrop_cache.remember(backdrop_url, mirrored_url)
+    return {
+        "dialogue": block.dialogue,
+        "possible_actions": block.possible_actions,
+        "backdrop_image_url": mirrored_url,
+    }
+
+
+def opening_story_block(playthrough: GamePlaythrough) -> GameStoryBlock | None:
+    """Materialises the session's prepared opening block, if there is one"""
+    game_session = playthrough.session
+    if game_session.opening_block is None:
+        return None
+
+    block = GameStoryBlock()
+    block.number = 1
+    block.previous_action = ""
+    block.actions_consumed = 1
+    block.is_final_act = block.actions_consumed >= game_session.total_actions
+    block.dialogue = game_session.opening_block["dialogue"]
+    block.possible_actions = game_session.opening_block["possible_actions"]
+    block.backdrop_image_url = game_session.opening_block["backdrop_image_url"]
+    block.backdrop_ready = True
+    return block
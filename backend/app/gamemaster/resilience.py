@@ -0,0 +1,181 @@
+import time
+import random
+import typing
+import asyncio
+import httpx
+from dataclasses import dataclass
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+
+T = typing.TypeVar("T")
+
+_RETRYABLE_STATUS_CODES_ = {408, 425, 429, 500, 502, 503, 504}
+
+# minimum number of latency samples before the p95 is trusted for hedging
+_HEDGE_MIN_SAMPLES_ = 20
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast once an upstream has failed repeatedly, allowing a single trial
+    call through after a cool down period to check whether it has recovered
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_after: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        if self._opened_at is None:
+            return False
+        return time.monotonic() - self._opened_at < self.reset_after
+
+    def before_call(self):
+        if self._opened_at is None:
+            return
+        if self.is_open or self._trial_in_flight:
+            metrics.incr(f"{self.name}.circuit_rejected")
+            raise CircuitOpenError(f"{self.name} - circuit open")
+        self._trial_in_flight = True
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"{self.name} - circuit closed")
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_in_flight = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"{self.name} - circuit opened")
+            self._opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        # an abandoned call says nothing about the upstream either way, but a
+        # trial left in flight would keep the circuit open for good
+        self._trial_in_flight = False
+
+
+@dataclass
+class CallPolicy:
+    timeout: float = Config.llm_timeout
+    retries: int = Config.llm_retries
+    backoff: float = Config.llm_retry_backoff
+    hedge: bool = Config.llm_hedge_enabled
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name,
+            failure_threshold=Config.llm_breaker_threshold,
+            reset_after=Config.llm_breaker_reset_after,
+        )
+    return _breakers[name]
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+    return status_code in _RETRYABLE_STATUS_CODES_
+
+
+def hedge_delay(name: str) -> float | None:
+    if len(metrics.samples(f"{name}.latency")) < _HEDGE_MIN_SAMPLES_:
+        return None
+    return metrics.percentile(f"{name}.latency", 95)
+
+
+async def _first_success(
+    name: str, call: typing.Callable[[], typing.Awaitable[T]], delay: float | None
+) -> T:
+    tasks = {asyncio.ensure_future(call())}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if len(done) == 0:
+                metrics.incr(f"{name}.hedged")
+                tasks.add(asyncio.ensure_future(call()))
+
+        error: BaseException | None = None
+        while len(tasks) > 0:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def invoke_resilient(
+    name: str,
+    call: typing.Callable[[], typing.Awaitable[T]],
+    policy: CallPolicy | None = None,
+    breaker: str | None = None,
+) -> T:
+    """
+    Runs an upstream call with a deadline per attempt, jittered retries on
+    retryable errors and an optional hedged duplicate request once the call
+    has taken longer than its recent p95. `call` must create a new request
+    every time it is invoked. Calls sharing an upstream can share a circuit
+    breaker by name, it defaults to the name of the call
+    """
+    if policy is None:
+        policy = CallPolicy()
+    circuit = circuit_breaker(breaker or name)
+
+    attempt = 0
+    while True:
+        circuit.before_call()
+        delay = hedge_delay(name) if policy.hedge else None
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                _first_success(name, call, delay), timeout=policy.timeout
+            )
+        except asyncio.CancelledError:
+            circuit.record_cancelled()
+            raise
+        except Exception as e:
+            metrics.incr(f"{name}.errors")
+            if not is_retryable(e):
+                # the provider answered, so this says nothing about its health
+                circuit.record_success()
+                raise
+            circuit.record_failure()
+            if attempt >= policy.retries:
+                raise
+            attempt += 1
+            backoff = policy.backoff * (2 ** (attempt - 1))
+            backoff = random.uniform(0, backoff)
+            logger.warning(f"{name} - retrying in {backoff:.2f}s after: {e!r}")
+            metrics.incr(f"{name}.retries")
+            await asyncio.sleep(backoff)
+            continue
+
+        circuit.record_success()
+        metrics.observe(f"{name}.latency", time.monotonic() - started_at)
+        return result
@@ -0,0 +1,181 @@
+import time
+import typing
+from enum import Enum
+from dataclasses import dataclass, field
+from pydantic import BaseModel
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+from app.logging import logger
+from app.metrics import metrics
+from app.admission import admission, llm_call_cost
+from app.gamemaster.llms import Backend, backends
+from app.gamemaster.structured import structured, resolve_structured
+from app.gamemaster.resilience import CallPolicy, circuit_breaker, invoke_resilient
+
+
+class CallType(Enum):
+    OPENING_BLOCK = "opening_block"
+    STORY_TURN = "story_turn"
+    CLOSING_TURN = "closing_turn"
+    FINAL_ACT_SYNOPSIS = "final_act_synopsis"
+    SCENE_SUMMARY = "scene_summary"
+    REFERENCE_CHUNK = "reference_chunk"
+    REFERENCE_REDUCE = "reference_reduce"
+
+
+@dataclass
+class Route:
+    # preferred backends, in order
+    candidates: typing.List[str]
+    # seconds, backends with a live p95 above this are tried last
+    latency_budget: float
+    # backends costing more than this are only used when nothing else works
+    max_cost: float
+
+
+_routes_: dict[CallType, Route] = {
+    CallType.OPENING_BLOCK: Route(
+        candidates=["mistral-small", "ollama", "mistral-large"],
+        latency_budget=20,
+        max_cost=1,
+    ),
+    CallType.STORY_TURN: Route(
+        candidates=["mistral-small", "ollama", "mistral-large"],
+        latency_budget=12,
+        max_cost=1,
+    ),
+    CallType.CLOSING_TURN: Route(
+        candidates=["mistral-large", "mistral-small", "ollama"],
+        latency_budget=20,
+        max_cost=10,
+    ),
+    CallType.FINAL_ACT_SYNOPSIS: Route(
+        candidates=["mistral-large", "mistral-small", "ollama"],
+        latency_budget=30,
+        max_cost=10,
+    ),
+    CallType.SCENE_SUMMARY: Route(
+        candidates=["mistral-small", "ollama"],
+        latency_budget=8,
+        max_cost=1,
+    ),
+    CallType.REFERENCE_CHUNK: Route(
+        candidates=["mistral-small", "ollama"],
+        latency_budget=20,
+        max_cost=1,
+    ),
+    CallType.REFERENCE_REDUCE: Route(
+        candidates=["mistral-small", "ollama"],
+        latency_budget=30,
+        max_cost=1,
+    ),
+}
+
+
+@dataclass
+class LLMResult:
+    """The uniform result of a routed call, regardless of the backend used"""
+
+    text: str
+    backend: str
+    latency: float
+    payload: typing.Optional[BaseModel] = None
+
+
+@dataclass
+class ModelRouter:
+    routes: dict[CallType, Route]
+    backends: dict[str, Backend] = field(default_factory=dict)
+
+    def latency(self, backend: Backend) -> float | None:
+        return metrics.percentile(f"llm.{backend.name}.latency", 95)
+
+    def plan(self, call_type: CallType) -> typing.List[Backend]:
+        """
+        Orders the backends for a call: in-budget backends which are healthy
+        and fast enough come first, in the configured order, followed by slow
+        ones, with over-budget backends held back as a last resort
+        """
+        route = self.routes[call_type]
+        available = [
+            self.backends[name]
+            for name in route.candidates
+            if name in self.backends and not circuit_breaker(f"llm.{name}").is_open
+        ]
+
+        def is_fast(backend: Backend) -> bool:
+            latency = self.latency(backend)
+            return latency is None or latency <= route.latency_budget
+
+        affordable = [b for b in available if b.cost <= route.max_cost]
+        fast = [b for b in affordable if is_fast(b)]
+        slow = sorted(
+            [b for b in affordable if not is_fast(b)], key=lambda b: self.latency(b)
+        )
+        over_budget = [b for b in available if b.cost > route.max_cost]
+        return fast + slow + over_budget
+
+    async def invoke(
+        self,
+        call_type: CallType,
+        prompt: ChatPromptTemplate,
+        context: dict,
+        schema: type[BaseModel] | None = None,
+    ) -> LLMResult:
+        route = self.routes[call_type]
+        plan = self.plan(call_type)
+        if len(plan) == 0:
+            raise RuntimeError(f"no backend available for {call_type.value}")
+
+        error: Exception | None = None
+        for backend in plan:
+            if backend.cost > route.max_cost:
+                logger.warning(f"{call_type.value} - over budget, using {backend.name}")
+                metrics.incr(f"llm.{call_type.value}.over_budget")
+
+            if schema is None:
+                chain = prompt | backend.model
+            else:
+                chain = prompt | structured(backend.model, schema)
+
+            started_at = time.monotonic()
+            try:
+                async with admission.upstream(
+                    backend.name, llm_call_cost(backend.cost)
+                ):
+                    response = await invoke_resilient(
+                        f"llm.{backend.name}",
+                        lambda: chain.ainvoke(context),
+                        policy=CallPolicy(timeout=route.latency_budget * 2),
+                    )
+                payload = None
+                if schema is not None:
+                    payload = await resolve_structured(
+                        response, schema, label=call_type.value
+                    )
+                if isinstance(response, dict):
+                    response = response["raw"]
+            except Exception as e:
+                logger.warning(f"{call_type.value} - {backend.name} failed: {e!r}")
+                metrics.incr(f"llm.{call_type.value}.fallbacks")
+                error = e
+                continue
+
+            metrics.incr(f"llm.{call_type.value}.{backend.name}")
+            return LLMResult(
+                text=(
+                    response.content
+                    if isinstance(response, BaseMessage)
+                    else str(response)
+                ),
+                backend=backend.name,
+                latency=time.monotonic() - started_at,
+                payload=payload,
+            )
+
+        raise error
+
+
+router = ModelRouter(
+    routes=_routes_, backends={backend.name: backend for backend in backends}
+)
@@ -0,0 +1,46 @@
+import typing
+from pydantic import BaseModel, Field
+
+
+class StoryBlockPayload(BaseModel):
+    """The structured response expected when writing a single story block"""
+
+    dialogue: typing.List[str] = Field(
+        description="Lines of dialogue, fed to the player one at a time"
+    )
+    possible_actions: typing.List[str] = Field(
+        description="Suggested actions for the main character, empty for the final dialogue"
+    )
+
+
+class CharacterPayload(BaseModel):
+    name: str
+    personality: str
+    background: str
+
+
+class SessionPayload(BaseModel):
+    """The structured response expected when generating a new game session"""
+
+    title: str
+    reference_material_summary: str
+    synopsis: str
+    themes: typing.List[str]
+    main_character: CharacterPayload
+    supporting_characters: typing.List[CharacterPayload]
+    setup_act: str
+    confrontation_act: str
+    prologue: typing.List[str]
+    key_facts: typing.List[str] = Field(
+        default_factory=list,
+        description="Key historical and cultural facts from the reference material",
+    )
+
+
+class ReferenceDigestPayload(BaseModel):
+    """The structured response expected when digesting reference material"""
+
+    summary: str = Field(description="A summary of the reference material")
+    facts: typing.List[str] = Field(
+        description="Key historical and cultural facts, one self-contained fact each"
+    )
@@ -0,0 +1,131 @@
+import json
+import typing
+from pydantic import BaseModel, ValidationError
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+from app.logging import logger
+from app.metrics import metrics
+from app.gamemaster.llms import llm as repair_llm
+from app.gamemaster.utils import clean_and_parse_json
+from app.gamemaster.resilience import invoke_resilient
+
+Schema = typing.TypeVar("Schema", bound=BaseModel)
+
+
+class StructuredOutputError(RuntimeError):
+    pass
+
+
+_repair_template_ = """
+You will be provided with a JSON response that failed validation, along with the
+validation errors and the JSON schema it must follow.
+
+Fix the response so that it matches the schema. Keep all of the original content
+where possible, only fill in or restructure what is needed.
+
+Respond with only the corrected JSON, and nothing else
+"""
+
+_repair_context_template_ = """
+## Schema
+{schema}
+
+## Validation Errors
+{errors}
+
+## Response
+{response}
+"""
+
+_repair_prompt_ = ChatPromptTemplate.from_messages(
+    [
+        ("system", _repair_template_),
+        ("human", _repair_context_template_),
+    ]
+)
+
+
+def structured(llm, schema: type[BaseModel]):
+    """
+    Binds the provider's JSON schema mode where available. The raw message is
+    always kept so that a failed parse can be repaired instead of regenerated
+    """
+    if hasattr(llm, "with_structured_output"):
+        try:
+            return llm.with_structured_output(
+                schema, method="json_schema", include_raw=True
+            )
+        except NotImplementedError:
+            pass
+    return llm
+
+
+def _message_text(response) -> str:
+    if isinstance(response, BaseMessage):
+        return response.content
+    return str(response)
+
+
+def _message_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0
+    return usage.get("total_tokens", 0)
+
+
+def _validate(text: str, schema: type[Schema]) -> Schema:
+    return schema.model_validate(clean_and_parse_json(text))
+
+
+async def resolve_structured(response, schema: type[Schema], label: str) -> Schema:
+    """
+    Turns the output of a `structured` chain into a validated payload, falling
+    back to tolerant parsing and then a single cheap repair call
+    """
+    metrics.incr(f"{label}.turns")
+
+    raw = response
+    if isinstance(response, dict) and "raw" in response:
+        raw = response["raw"]
+        if response.get("parsed") is not None:
+            metrics.incr(f"{label}.tokens", _message_tokens(raw))
+            return response["parsed"]
+
+    tokens = _message_tokens(raw)
+    metrics.incr(f"{label}.tokens", tokens)
+    text = _message_text(raw)
+
+    try:
+        return _validate(text, schema)
+    except (ValueError, ValidationError) as e:
+        error = e
+
+    logger.warning(f"{label} - invalid structured output, attempting repair: {error}")
+    metrics.incr(f"{label}.repairs")
+
+    try:
+        repair_chain = _repair_prompt_ | structured(repair_llm, schema)
+        repair_context = {
+            "schema": json.dumps(schema.model_json_schema()),
+            "errors": str(error),
+            "response": text,
+        }
+        repair_response = await invoke_resilient(
+            "llm.repair", lambda: repair_chain.ainvoke(repair_context)
+        )
+        if isinstance(repair_response, dict) and "raw" in repair_response:
+            metrics.incr(
+                f"{label}.tokens_repair", _message_tokens(repair_response["raw"])
+            )
+            if repair_response.get("parsed") is not None:
+                metrics.incr(f"{label}.repairs_succeeded")
+                return repair_response["parsed"]
+            repair_response = repair_response["raw"]
+
+        payload = _validate(_message_text(repair_response), schema)
+        metrics.incr(f"{label}.repairs_succeeded")
+        return payload
+    except Exception as e:
+        metrics.incr(f"{label}.turns_failed")
+        metrics.incr(f"{label}.tokens_wasted", tokens)
+        raise StructuredOutputError(f"{label} - unable to repair output: {e}") from e
@@ -1,13 +1,64 @@
+import re
 import json
 
+_TRAILING_COMMA_ = re.compile(r",(\s*[}\]])")
+
+
+def _extract_json_object(text: str) -> str:
+    """
+    Finds the first JSON object in the text, ignoring any prose or code fences
+    around it. If the object was cut off, open strings and brackets are closed
+    so that whatever was generated can still be recovered
+    """
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("no JSON object found in response")
+
+    closers = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            continue
+
+        if c == '"':
+            in_string = True
+        elif c == "{":
+            closers.append("}")
+        elif c == "[":
+            closers.append("]")
+        elif c in "}]":
+            closers.pop()
+            if len(closers) == 0:
+                return text[start : i + 1]
+
+    # partial output, close whatever is still open
+    partial = text[start:]
+    if escaped:
+        partial = partial[:-1]
+    if in_string:
+        partial += '"'
+    partial = partial.rstrip().rstrip(",").rstrip(":")
+    if partial.endswith('"') and closers and closers[-1] == "}":
+        # a dangling key without a value cannot be recovered, drop it
+        key_start = partial.rfind('"', 0, len(partial) - 1)
+        if partial[:key_start].rstrip().endswith(("{", ",")):
+            partial = partial[:key_start].rstrip().rstrip(",")
+    return partial + "".join(reversed(closers))
+
 
 def clean_and_parse_json(llm_response: str) -> dict:
-    lines = llm_response.splitlines()
-    if lines[0].startswith("`"):
-        lines = lines[1:]
-    if lines[-1].startswith("`"):
-        lines = lines[:-1]
-    print("TEST")
-    print("\n".join(lines))
-    print("TEST")
-    return json.loads("\n".join(lines))
+    try:
+        return json.loads(llm_response)
+    except json.JSONDecodeError:
+        pass
+
+    candidate = _extract_json_object(llm_response)
+    return json.loads(_TRAILING_COMMA_.sub(r"\1", candidate))
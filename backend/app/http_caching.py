@@ -0,0 +1,294 @@
+import json
+import uuid
+import typing
+import hashlib
+import sqlalchemy
+import graphql
+from collections import OrderedDict
+from functools import lru_cache
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.types.unset import UNSET
+from app.config import Config
+from app.replicas import replicas
+from app.metrics import metrics
+from app import serialization
+import app.models as appmodels
+
+
+class PersistedQueryNotFound(Exception):
+    pass
+
+
+class PersistedQueryStore:
+    """
+    Bounded store of queries registered through the automatic persisted queries
+    protocol, clients re-register a query whenever it has been evicted
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._queries: OrderedDict[str, str] = OrderedDict()
+
+    def resolve(self, query: str | None, extensions: dict | None) -> str | None:
+        persisted = (extensions or {}).get("persistedQuery")
+        if persisted is None:
+            return query
+
+        query_hash = persisted.get("sha256Hash", "")
+        if query is not None:
+            if hashlib.sha256(query.encode()).hexdigest() != query_hash:
+                raise ValueError("provided sha does not match query")
+            self._queries[query_hash] = query
+            self._queries.move_to_end(query_hash)
+            if len(self._queries) > self.max_size:
+                self._queries.popitem(last=False)
+            return query
+
+        if query_hash not in self._queries:
+            metrics.incr("graphql.persisted_query_misses")
+            raise PersistedQueryNotFound()
+        metrics.incr("graphql.persisted_query_hits")
+        self._queries.move_to_end(query_hash)
+        return self._queries[query_hash]
+
+
+@lru_cache(maxsize=256)
+def _parse(query: str) -> graphql.DocumentNode | None:
+    try:
+        return graphql.parse(query)
+    except graphql.GraphQLError:
+        return None
+
+
+def _cacheable_scope(
+    query: str,
+    operation_name: str | None,
+    variables: dict | None,
+    cacheable_fields: set[str],
+) -> list[str] | None | typing.Literal[False]:
+    """
+    Returns the playthrough ids a read only query depends on, None when it
+    depends on the listed sessions, or False when the query cannot be cached
+    """
+    document = _parse(query)
+    if document is None:
+        return False
+
+    operations = [
+        d
+        for d in document.definitions
+        if isinstance(d, graphql.OperationDefinitionNode)
+    ]
+    if operation_name is not None:
+        operations = [
+            o for o in operations if o.name and o.name.value == operation_name
+        ]
+    if len(operations) != 1 or operations[0].operation != graphql.OperationType.QUERY:
+        return False
+
+    playthrough_ids = []
+    lists_sessions = False
+    for selection in operations[0].selection_set.selections:
+        if not isinstance(selection, graphql.FieldNode):
+            return False
+        name = selection.name.value
+        if name == "__typename":
+            continue
+        if name not in cacheable_fields:
+            return False
+        if name != "game":
+            lists_sessions = True
+            continue
+
+        for argument in selection.arguments:
+            if argument.name.value != "id":
+                continue
+            value = None
+            if isinstance(argument.value, graphql.VariableNode):
+                value = (variables or {}).get(argument.value.name.value)
+            elif isinstance(argument.value, graphql.StringValueNode):
+                value = argument.value.value
+            try:
+                playthrough_ids.append(str(uuid.UUID(value)))
+            except (TypeError, ValueError):
+                return False
+
+    if lists_sessions:
+        # sessions and playthroughs are versioned separately
+        return None if len(playthrough_ids) == 0 else False
+    if len(playthrough_ids) == 0:
+        return False
+    return playthrough_ids
+
+
+def _versions(playthrough_ids: list[str] | None) -> tuple[str, bool]:
+    """
+    Fingerprints the versions of the given playthroughs, or of all sessions,
+    and reports whether every one of them is finished, which only a reset
+    changes
+    """
+
+    def load(session: Session) -> tuple[str, bool] | list:
+        if playthrough_ids is None:
+            table = appmodels.GameSession.__table__
+            statement = sqlalchemy.select(
+                sqlalchemy.func.count(),
+                sqlalchemy.func.md5(
+                    sqlalchemy.func.string_agg(
+                        sqlalchemy.cast(table.c.id, sqlalchemy.Text)
+                        + ":"
+                        + sqlalchemy.cast(table.c.version, sqlalchemy.Text),
+                        postgresql.aggregate_order_by(
+                            sqlalchemy.literal_column("','"), table.c.id
+                        ),
+                    )
+                ),
+            )
+            count, fingerprint = session.execute(statement).one()
+            return (f"{count}:{fingerprint}", False)
+
+        table = appmodels.GamePlaythrough.__table__
+        statement = sqlalchemy.select(
+            table.c.id, table.c.version, table.c.final_video_url
+        ).where(table.c.id.in_(playthrough_ids))
+        return session.execute(statement).all()
+
+    rows = replicas.read(load, keys=playthrough_ids or [])
+    if playthrough_ids is None:
+        return rows
+
+    fingerprint = ",".join(sorted(f"{row.id}:{row.version}" for row in rows))
+    finished = len(rows) == len(playthrough_ids) and all(
+        row.final_video_url is not None for row in rows
+    )
+    return (fingerprint, finished)
+
+
+class CachingGraphQLRouter(GraphQLRouter):
+    """
+    GraphQL router supporting automatic persisted queries, and conditional
+    requests for read only queries. ETags are derived from the version of the
+    sessions or playthroughs a query reads, so an unchanged result is answered with a 304
+    without executing the query
+    """
+
+    def __init__(self, *args, cacheable_fields: set[str], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cacheable_fields = cacheable_fields
+        self.persisted_queries = PersistedQueryStore(Config.graphql_persisted_queries)
+
+    def should_render_graphql_ide(self, request) -> bool:
+        if request.query_params.get("extensions") is not None:
+            return False
+        return super().should_render_graphql_ide(request)
+
+    def decode_json(self, data: str | bytes) -> object:
+        return serialization.loads(data)
+
+    def encode_json(self, data: object) -> str:
+        # text, as subscriptions send it as WebSocket text frames
+        return serialization.dumps_text(data)
+
+    def create_response(self, response_data, sub_response: Response) -> Response:
+        # encoded straight to bytes, skipping a round trip through str
+        response = Response(
+            serialization.dumps(response_data),
+            media_type="application/json",
+            status_code=sub_response.status_code or 200,
+        )
+        response.headers.raw.extend(sub_response.headers.raw)
+        return response
+
+    async def parse_http_body(self, request) -> GraphQLRequestData:
+        request_data = await super().parse_http_body(request)
+        persisted_query = getattr(request.request.state, "persisted_query", None)
+        if request_data.query is None and persisted_query is not None:
+            request_data.query = persisted_query
+        return request_data
+
+    async def process_result(self, request, result):
+        request.state.graphql_errors = bool(result.errors)
+        return await super().process_result(request, result)
+
+    async def _request_data(self, request: Request) -> dict:
+        if request.method == "GET":
+            data = self.parse_query_params(request.query_params)
+        elif "application/json" in request.headers.get("content-type", ""):
+            data = self.parse_json(await request.body())
+        else:
+            return {}
+
+        if isinstance(data.get("extensions"), str):
+            data["extensions"] = self.parse_json(data["extensions"])
+        return data
+
+    async def run(self, request, context=UNSET, root_value=UNSET):
+        if self.is_websocket_request(request):
+            return await super().run(request, context=context, root_value=root_value)
+
+        # the ETag and the result must come from the same database
+        with replicas.pinned():
+            return await self._run(request, context, root_value)
+
+    async def _run(self, request, context, root_value):
+        data = await self._request_data(request)
+        try:
+            query = self.persisted_queries.resolve(
+                data.get("query"), data.get("extensions")
+            )
+        except PersistedQueryNotFound:
+            return JSONResponse(
+                {
+                    "errors": [
+                        {
+                            "message": "PersistedQueryNotFound",
+                            "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                        }
+                    ]
+                }
+            )
+        except ValueError as e:
+            return JSONResponse({"errors": [{"message": str(e)}]}, status_code=400)
+        request.state.persisted_query = query
+
+        scope = False
+        if query is not None:
+            scope = _cacheable_scope(
+                query,
+                data.get("operationName"),
+                data.get("variables"),
+                self.cacheable_fields,
+            )
+        if scope is False:
+            return await super().run(request, context=context, root_value=root_value)
+
+        versions, finished = _versions(scope)
+        etag_source = json.dumps(
+            [query, data.get("operationName"), data.get("variables"), versions],
+            sort_keys=True,
+        )
+        etag = f'"{hashlib.sha256(etag_source.encode()).hexdigest()[:32]}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": (
+                f"public, max-age={Config.graphql_finished_max_age}"
+                if finished
+                else "no-cache"
+            ),
+        }
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            metrics.incr("graphql.not_modified")
+            return Response(status_code=304, headers=headers)
+
+        response = await super().run(request, context=context, root_value=root_value)
+        has_errors = getattr(request.state, "graphql_errors", True)
+        if response.status_code == 200 and not has_errors:
+            response.headers.update(headers)
+        return response
@@ -0,0 +1,174 @@
+import time
+import uuid
+import asyncio
+import sqlalchemy
+from collections import Counter, deque
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.database import connection
+from app.logging import logger
+from app.metrics import metrics
+from app.tasks import supervisor
+from app.gamemaster.generate_session import generate_session, VISUAL_STYLES
+import app.models as appmodels
+
+_HOUR_ = 60 * 60
+_MAX_BACKOFF_ = 60 * 30
+
+
+class SessionInventory:
+    """
+    Keeps a number of fresh, fully generated sessions ready for every visual
+    style, so players never wait on session generation. Sessions stop being
+    fresh once claimed by a player, which triggers a refill. Generation is
+    capped both in concurrency and in estimated spend over the last hour
+    """
+
+    def __init__(
+        self,
+        visual_styles: list[str],
+        size: int,
+        concurrency: int,
+        session_cost: float,
+        hourly_budget: float,
+    ):
+        self.visual_styles = visual_styles
+        self.size = size
+        self.concurrency = concurrency
+        self.session_cost = session_cost
+        self.hourly_budget = hourly_budget
+        self._in_flight: Counter[str] = Counter()
+        self._spend: deque[tuple[float, float]] = deque()
+        self._failures: Counter[str] = Counter()
+        self._retry_at: dict[str, float] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._refill_requested: asyncio.Event | None = None
+
+    def spent_last_hour(self) -> float:
+        cutoff = time.monotonic() - _HOUR_
+        while len(self._spend) > 0 and self._spend[0][0] < cutoff:
+            self._spend.popleft()
+        return sum(cost for _, cost in self._spend)
+
+    def _fresh_counts(self) -> dict[str, int]:
+        table = appmodels.GameSession.__table__
+        statement = (
+            sqlalchemy.select(table.c.visual_style, sqlalchemy.func.count())
+            .where(table.c.claimed_at.is_(None))
+            .where(table.c.visual_style.in_(self.visual_styles))
+            .group_by(table.c.visual_style)
+        )
+        with Session(connection) as session:
+            return dict(session.execute(statement).all())
+
+    def deficits(self) -> dict[str, int]:
+        """Sessions missing per visual style, including those being generated"""
+        counts = self._fresh_counts()
+        return {
+            style: self.size - counts.get(style, 0) - self._in_flight[style]
+            for style in self.visual_styles
+        }
+
+    def refill(self):
+        now = time.monotonic()
+        deficits = {
+            style: missing
+            for style, missing in self.deficits().items()
+            if missing > 0 and self._retry_at.get(style, 0) <= now
+        }
+        while len(deficits) > 0:
+            if sum(self._in_flight.values()) >= self.concurrency:
+                return
+            if self.spent_last_hour() + self.session_cost > self.hourly_budget:
+                metrics.incr("inventory.budget_exhausted")
+                logger.warning("inventory budget exhausted, not refilling")
+                return
+
+            # the emptiest style is refilled first
+            style = max(deficits, key=lambda s: deficits[s])
+            deficits[style] -= 1
+            if deficits[style] == 0:
+                del deficits[style]
+
+            self._spend.append((now, self.session_cost))
+            self._in_flight[style] += 1
+            supervisor.spawn(self._generate(style), name=f"inventory {style}")
+
+    async def _generate(self, visual_style: str):
+        started_at = time.monotonic()
+        try:
+            # every style is written from the same material on purpose
+            game_session = await generate_session(
+                visual_style=visual_style, on_duplicate="allow"
+            )
+            with Session(connection) as session:
+                session.add_all([game_session])
+                session.commit()
+                logger.info(f"inventory: generated {game_session.id} ({visual_style})")
+
+            self._failures[visual_style] = 0
+            metrics.incr("inventory.generated")
+            metrics.observe("inventory.latency", time.monotonic() - started_at)
+        except Exception as e:
+            # failed sessions still cost, so back off before retrying the style
+            self._failures[visual_style] += 1
+            backoff = min(
+                _MAX_BACKOFF_,
+                Config.inventory_refill_interval * 2 ** self._failures[visual_style],
+            )
+            self._retry_at[visual_style] = time.monotonic() + backoff
+            metrics.incr("inventory.failed")
+            logger.error(f"inventory: unable to generate {visual_style} session: {e!r}")
+        finally:
+            self._in_flight[visual_style] -= 1
+            self.request_refill()
+
+    def claim(self, session: Session, session_id: uuid.UUID) -> bool:
+        """
+        Atomically marks a session as no longer fresh, as part of the caller's
+        transaction. Only the first player to pick a session claims it
+        """
+        table = appmodels.GameSession.__table__
+        statement = (
+            sqlalchemy.update(table)
+            .where(table.c.id == session_id)
+            .where(table.c.claimed_at.is_(None))
+            .values(claimed_at=sqlalchemy.func.now(), version=table.c.version + 1)
+            .returning(table.c.id)
+        )
+        claimed = session.execute(statement).first() is not None
+        if claimed:
+            metrics.incr("inventory.claimed")
+        return claimed
+
+    def request_refill(self):
+        if self._loop is None or self._refill_requested is None:
+            return
+        self._loop.call_soon_threadsafe(self._refill_requested.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._refill_requested = asyncio.Event()
+        logger.info(f"inventory: keeping {self.size} sessions per visual style")
+        while True:
+            self._refill_requested.clear()
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"inventory: refill failed: {e!r}")
+
+            try:
+                await asyncio.wait_for(
+                    self._refill_requested.wait(), Config.inventory_refill_interval
+                )
+            except TimeoutError:
+                pass
+
+
+inventory = SessionInventory(
+    visual_styles=Config.inventory_visual_styles or VISUAL_STYLES,
+    size=Config.inventory_size,
+    concurrency=Config.inventory_concurrency,
+    session_cost=Config.inventory_session_cost,
+    hourly_budget=Config.inventory_hourly_budget,
+)
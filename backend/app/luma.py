@@ -1,6 +1,28 @@
+import asyncio
 from app.config import Config
+from app.cassettes import http_client
+from app.logging import logger
+from app.admission import admission, ESTIMATED_COSTS
 from lumaai import AsyncLumaAI
 
 luma_client = AsyncLumaAI(
     auth_token=Config.luma_api_key,
+    http_client=http_client(),
 )
+
+
+async def generate_image(prompt: str, aspect_ratio: str) -> str:
+    async with admission.upstream("luma", ESTIMATED_COSTS["luma.image"]):
+        generation = await luma_client.generations.image.create(
+            prompt=prompt,
+            aspect_ratio=aspect_ratio,
+        )
+        while True:
+            logger.debug("checking image")
+            gen = await luma_client.generations.get(id=generation.id)
+            if gen.state == "completed":
+                logger.debug("image ready")
+                return gen.assets.image
+            elif gen.state == "failed":
+                raise RuntimeError(f"Generation failed: {gen.failure_reason}")
+            await asyncio.sleep(2)
@@ -0,0 +1,229 @@
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import mimetypes
+import httpx
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from urllib.parse import urlparse
+from PIL import Image
+from app.config import Config
+from app.logging import logger
+from app.media.storage import storage
+from app import serialization
+
+_DOWNLOAD_CHUNK_SIZE_ = 1024 * 256
+# manifests of mirrored assets kept in memory, they never change once written
+_MAX_MANIFESTS_ = 10000
+
+
+@dataclass
+class Manifest:
+    """
+    What was generated alongside a mirrored asset, written when it is
+    mirrored so serving it never has to check storage. None when unknown
+    """
+
+    widths: list[int] | None = None
+    poster: bool | None = None
+
+
+_manifests: OrderedDict[str, Manifest] = OrderedDict()
+
+
+def is_mirrored(url: str) -> bool:
+    return url.startswith(f"{Config.media_base_url}/")
+
+
+def _key_from_url(url: str) -> str:
+    return url.removeprefix(f"{Config.media_base_url}/")
+
+
+def _stem(key: str) -> str:
+    return key.rsplit(".", 1)[0]
+
+
+def _variant_key(key: str, width: int) -> str:
+    return f"{_stem(key)}_w{width}.webp"
+
+
+def _poster_key(key: str) -> str:
+    return f"{_stem(key)}_poster.jpg"
+
+
+def _manifest_key(key: str) -> str:
+    return f"{_stem(key)}_manifest.json"
+
+
+def _remember_manifest(key: str, manifest: Manifest):
+    _manifests[key] = manifest
+    _manifests.move_to_end(key)
+    while len(_manifests) > _MAX_MANIFESTS_:
+        _manifests.popitem(last=False)
+
+
+def _manifest(key: str) -> Manifest:
+    manifest = _manifests.get(key)
+    if manifest is not None:
+        _manifests.move_to_end(key)
+        return manifest
+
+    # read once per worker, assets mirrored by another worker or before
+    # manifests were written
+    data = storage.read(_manifest_key(key))
+    manifest = Manifest() if data is None else Manifest(**serialization.loads(data))
+    _remember_manifest(key, manifest)
+    return manifest
+
+
+def _record_manifest(key: str, directory: Path, **generated):
+    manifest = _manifest(key)
+    for name, value in generated.items():
+        setattr(manifest, name, value)
+    path = directory / "manifest.json"
+    path.write_bytes(serialization.dumps(asdict(manifest)))
+    storage.put_file(_manifest_key(key), path, "application/json")
+
+
+def srcset(url: str | None) -> str | None:
+    """Responsive image candidates for a mirrored image, if any were generated"""
+    if url is None or not is_mirrored(url):
+        return None
+
+    key = _key_from_url(url)
+    manifest = _manifest(key)
+    if manifest.widths is None:
+        # mirrored before manifests were written, checked just the once
+        manifest.widths = [
+            width
+            for width in Config.media_image_widths
+            if storage.exists(_variant_key(key, width))
+        ]
+    if len(manifest.widths) == 0:
+        return None
+    return ", ".join(
+        f"{storage.url(_variant_key(key, width))} {width}w" for width in manifest.widths
+    )
+
+
+def poster_url(url: str | None) -> str | None:
+    if url is None or not is_mirrored(url):
+        return None
+
+    key = _key_from_url(url)
+    manifest = _manifest(key)
+    if manifest.poster is None:
+        manifest.poster = storage.exists(_poster_key(key))
+    if not manifest.poster:
+        return None
+    return storage.url(_poster_key(key))
+
+
+async def download(url: str, directory: Path) -> tuple[Path, str, str]:
+    """
+    Streams a URL into the directory, returning the file along with the
+    SHA-256 of its content and its content type
+    """
+    path = directory / "download"
+    hasher = hashlib.sha256()
+    async with httpx.AsyncClient(follow_redirects=True, timeout=60) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "")
+            with open(path, "wb") as file:
+                async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK_SIZE_):
+                    hasher.update(chunk)
+                    file.write(chunk)
+
+    return (path, hasher.hexdigest(), content_type.split(";")[0].strip())
+
+
+def _create_image_variants(key: str, path: Path, directory: Path):
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        # never upscale, a variant as wide as the original would only copy it
+        widths = [width for width in Config.media_image_widths if width < image.width]
+        for width in widths:
+            variant_key = _variant_key(key, width)
+            if storage.exists(variant_key):
+                continue
+
+            variant = image.resize((width, round(image.height * width / image.width)))
+            variant_path = directory / f"w{width}.webp"
+            variant.save(variant_path, "WEBP", quality=80)
+            storage.put_file(variant_key, variant_path, "image/webp")
+    _record_manifest(key, directory, widths=widths)
+
+
+async def create_poster(key: str, path: Path, directory: Path):
+    """Stores the first frame of the video stored under the key as its poster"""
+    poster_key = _poster_key(key)
+    if storage.exists(poster_key):
+        await asyncio.to_thread(_record_manifest, key, directory, poster=True)
+        return
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        logger.warning("ffmpeg not available, skipping video poster")
+        await asyncio.to_thread(_record_manifest, key, directory, poster=False)
+        return
+
+    poster_path = directory / "poster.jpg"
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        str(path),
+        "-frames:v",
+        "1",
+        "-q:v",
+        "3",
+        str(poster_path),
+    )
+    if await process.wait() != 0:
+        raise RuntimeError(f"unable to extract poster for {key}")
+    await asyncio.to_thread(storage.put_file, poster_key, poster_path, "image/jpeg")
+    await asyncio.to_thread(_record_manifest, key, directory, poster=True)
+
+
+async def mirror(url: str) -> str:
+    """
+    Downloads a generated asset into content addressed storage along with its
+    responsive variants or poster, returning the mirrored URL
+    """
+    if is_mirrored(url):
+        return url
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        path, digest, content_type = await download(url, directory)
+
+        extension = (
+            mimetypes.guess_extension(content_type) or Path(urlparse(url).path).suffix
+        )
+        key = f"{digest[:2]}/{digest}{extension}"
+        if not storage.exists(key):
+            await asyncio.to_thread(storage.put_file, key, path, content_type)
+
+        if content_type.startswith("image/"):
+            await asyncio.to_thread(_create_image_variants, key, path, directory)
+        elif content_type.startswith("video/"):
+            await create_poster(key, path, directory)
+
+    return storage.url(key)
+
+
+async def mirror_asset(url: str | None) -> str | None:
+    """Mirrors an asset, keeping the original URL if that is not possible"""
+    if url is None or not Config.media_mirror_enabled:
+        return url
+
+    try:
+        return await mirror(url)
+    except Exception as e:
+        logger.warning(f"unable to mirror {url}: {e!r}")
+        return url
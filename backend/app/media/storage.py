@@ -0,0 +1,151 @@
+import os
+import abc
+import shutil
+from pathlib import Path
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+from app.config import Config
+
+# mirrored assets are content addressed, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class Storage(abc.ABC):
+    """
+    Content addressed blob storage for mirrored media. Keys are only ever
+    written once, so an existing key never has to be checked for staleness
+    """
+
+    def __init__(self):
+        self._known_keys: set[str] = set()
+
+    def exists(self, key: str) -> bool:
+        if key in self._known_keys:
+            return True
+        if self._exists(key):
+            self._known_keys.add(key)
+            return True
+        return False
+
+    def put_file(self, key: str, path: Path, content_type: str):
+        self._put_file(key, path, content_type)
+        self._known_keys.add(key)
+
+    def url(self, key: str) -> str:
+        return f"{Config.media_base_url}/{key}"
+
+    @abc.abstractmethod
+    def read(self, key: str) -> bytes | None:
+        """The stored blob, or None if there is none under the key"""
+
+    @abc.abstractmethod
+    def _exists(self, key: str) -> bool: ...
+
+    @abc.abstractmethod
+    def _put_file(self, key: str, path: Path, content_type: str): ...
+
+    @abc.abstractmethod
+    def response(self, key: str, request: Request) -> Response: ...
+
+
+class FilesystemStorage(Storage):
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = Path(root).resolve()
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"invalid media key: {key}")
+        return path
+
+    def read(self, key: str) -> bytes | None:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        return path.read_bytes()
+
+    def _exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def _put_file(self, key: str, path: Path, content_type: str):
+        destination = self._path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a partially written file is never served
+        partial = destination.with_name(f".{destination.name}.partial")
+        shutil.copyfile(path, partial)
+        os.replace(partial, destination)
+
+    def response(self, key: str, request: Request) -> Response:
+        try:
+            path = self._path(key)
+        except ValueError:
+            return Response(status_code=404)
+        if not path.is_file():
+            return Response(status_code=404)
+        # FileResponse answers Range requests, needed for video seeking
+        return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+
+class S3Storage(Storage):
+    """
+    Any S3 compatible object store. Assets are served straight from the bucket
+    (or a CDN in front of it), the API only redirects to them
+    """
+
+    def __init__(self, bucket: str, public_url: str, endpoint_url: str | None):
+        super().__init__()
+        import boto3
+
+        self.bucket = bucket
+        self.public_url = public_url
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def _put_file(self, key: str, path: Path, content_type: str):
+        self.client.upload_file(
+            str(path),
+            self.bucket,
+            key,
+            ExtraArgs={
+                "ContentType": content_type,
+                "CacheControl": IMMUTABLE_CACHE_CONTROL,
+            },
+        )
+
+    def response(self, key: str, request: Request) -> Response:
+        return RedirectResponse(
+            f"{self.public_url}/{key}",
+            status_code=301,
+            headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL},
+        )
+
+
+def _create_storage() -> Storage:
+    match Config.media_storage:
+        case "filesystem":
+            return FilesystemStorage(Config.media_root)
+        case "s3":
+            return S3Storage(
+                bucket=Config.media_s3_bucket,
+                public_url=Config.media_s3_public_url,
+                endpoint_url=Config.media_s3_endpoint_url,
+            )
+        case _:
+            raise ValueError(f"unknown media storage: {Config.media_storage}")
+
+
+storage = _create_storage()
@@ -0,0 +1,135 @@
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass
+from app.logging import logger
+from app.media import download, create_poster
+from app.media.storage import storage
+
+_HLS_SEGMENT_SECONDS_ = 4
+
+
+@dataclass
+class StitchedVideo:
+    mp4_url: str
+    hls_url: str
+
+
+def _stitched_prefix(clip_urls: list[str]) -> str:
+    # the same clips, in the same order, always stitch into the same video
+    digest = hashlib.sha256("\n".join(clip_urls).encode()).hexdigest()
+    return f"final/{digest[:2]}/{digest}"
+
+
+async def _ffmpeg(ffmpeg: str, *args: str) -> bool:
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        *args,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        logger.warning(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+        return False
+    return True
+
+
+async def _concat(ffmpeg: str, clips: list[Path], output: Path, directory: Path):
+    playlist = directory / "clips.txt"
+    playlist.write_text("".join(f"file '{clip}'\n" for clip in clips))
+    concat = ["-f", "concat", "-safe", "0", "-i", str(playlist)]
+    faststart = ["-movflags", "+faststart", str(output)]
+
+    # clips from the same model share codecs, so they normally just get copied
+    if await _ffmpeg(ffmpeg, *concat, "-c", "copy", *faststart):
+        return
+
+    logger.warning("clips could not be concatenated as is, re-encoding")
+    encode = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-c:a", "aac"]
+    if not await _ffmpeg(ffmpeg, *concat, *encode, *faststart):
+        raise RuntimeError("unable to concatenate final video clips")
+
+
+async def _segment(ffmpeg: str, video: Path, directory: Path) -> list[Path]:
+    directory.mkdir()
+    succeeded = await _ffmpeg(
+        ffmpeg,
+        "-i",
+        str(video),
+        "-c",
+        "copy",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(_HLS_SEGMENT_SECONDS_),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_filename",
+        str(directory / "segment_%03d.ts"),
+        str(directory / "index.m3u8"),
+    )
+    if not succeeded:
+        raise RuntimeError("unable to segment final video")
+    return sorted(directory.iterdir())
+
+
+def _store(key: str, path: Path):
+    content_type = "video/mp4"
+    if path.suffix == ".m3u8":
+        content_type = "application/vnd.apple.mpegurl"
+    elif path.suffix == ".ts":
+        content_type = "video/mp2t"
+    storage.put_file(key, path, content_type)
+
+
+async def stitch(clip_urls: list[str]) -> StitchedVideo | None:
+    """
+    Concatenates clips into a single fast-start MP4, along with an HLS
+    playlist of the same video. Stitched videos are stored under a key
+    derived from their clips, so they are only made again when clips change.
+    Returns None when ffmpeg is not available
+    """
+    prefix = _stitched_prefix(clip_urls)
+    mp4_key = f"{prefix}.mp4"
+    # the playlist is written last, once it exists everything else does too
+    hls_key = f"{prefix}/index.m3u8"
+    if storage.exists(hls_key):
+        return StitchedVideo(storage.url(mp4_key), storage.url(hls_key))
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        logger.warning("ffmpeg not available, final video clips are not stitched")
+        return None
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        downloads = await asyncio.gather(
+            *[
+                download(url, _mkdir(directory / f"clip_{i:03d}"))
+                for i, url in enumerate(clip_urls)
+            ]
+        )
+        clips = [path for path, _, _ in downloads]
+
+        video = directory / "final.mp4"
+        await _concat(ffmpeg, clips, video, directory)
+        segments = await _segment(ffmpeg, video, directory / "hls")
+
+        await asyncio.to_thread(_store, mp4_key, video)
+        await create_poster(mp4_key, video, directory)
+        for segment in segments:
+            if segment.suffix != ".m3u8":
+                await asyncio.to_thread(_store, f"{prefix}/{segment.name}", segment)
+        await asyncio.to_thread(_store, hls_key, directory / "hls" / "index.m3u8")
+
+    return StitchedVideo(storage.url(mp4_key), storage.url(hls_key))
+
+
+def _mkdir(path: Path) -> Path:
+    path.mkdir()
+    return path
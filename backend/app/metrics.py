@@ -0,0 +1,66 @@
+import threading
+from collections import defaultdict, deque
+
+
+class Metrics:
+    """
+    In-process counters and rolling samples, shared by the gamemaster and the
+    API so generation health can be inspected without external tooling
+    """
+
+    def __init__(self, window: int = 256):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters: dict[str, float] = defaultdict(float)
+        self._samples: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=self._window)
+        )
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self._samples[name].append(value)
+
+    def count(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def samples(self, name: str) -> list[float]:
+        with self._lock:
+            return list(self._samples.get(name, ()))
+
+    def percentile(self, name: str, pct: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) == 0:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def ratio(self, numerator: str, denominator: str) -> float:
+        total = self.count(denominator)
+        if total == 0:
+            return 0.0
+        return self.count(numerator) / total
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            sample_names = list(self._samples.keys())
+
+        return {
+            "counters": counters,
+            "latencies": {
+                name: {
+                    "p50": self.percentile(name, 50),
+                    "p95": self.percentile(name, 95),
+                }
+                for name in sample_names
+            },
+        }
+
+
+metrics = Metrics()
@@ -1,6 +1,7 @@
 from functools import cached_property
-import json
+import uuid
 import typing
+import datetime
 import sqlalchemy
 import sqlalchemy.orm
 from dataclasses import dataclass
@@ -10,6 +11,8 @@ import app.database  # import for side effects
 int_list = list[int]
 str_list = list[str]
 json_list = list[int] | list[str]
+json_object = dict
+json_object_list = list[dict]
 json_scalar = typing.Union[float, str, bool]
 
 
@@ -19,11 +22,13 @@ class Base(sqlalchemy.orm.DeclarativeBase):
         str_list: postgresql.JSONB,
         int_list: postgresql.JSONB,
         json_list: postgresql.JSONB,
+        json_object: postgresql.JSONB,
+        json_object_list: postgresql.JSONB,
         json_scalar: postgresql.JSON,
     }
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Character:
     id: int
     name: str
@@ -35,6 +40,14 @@ class Character:
 
 class GameSession(Base):
     __tablename__ = "game-sessions"
+    __table_args__ = (
+        # the inventory counts fresh sessions per visual style
+        sqlalchemy.Index(
+            "ix_game-sessions_fresh",
+            "visual_style",
+            postgresql_where=sqlalchemy.text("claimed_at IS NULL"),
+        ),
+    )
 
     id = sqlalchemy.orm.mapped_column(sqlalchemy.Uuid, primary_key=True)
     title: sqlalchemy.orm.Mapped[str]
@@ -45,6 +58,10 @@ class GameSession(Base):
     reference_material_summary: sqlalchemy.orm.Mapped[str] = (
         sqlalchemy.orm.mapped_column(sqlalchemy.Text())
     )
+    # key facts extracted from the reference material
+    reference_facts: sqlalchemy.orm.Mapped[str_list] = sqlalchemy.orm.mapped_column(
+        default=list, server_default=sqlalchemy.text("'[]'::jsonb")
+    )
     opening_video_url: sqlalchemy.orm.Mapped[str]
     opening_act_synopsis: sqlalchemy.orm.Mapped[str] = sqlalchemy.orm.mapped_column(
         sqlalchemy.Text()
@@ -52,26 +69,85 @@ class GameSession(Base):
     middle_act_synopsis: sqlalchemy.orm.Mapped[str] = sqlalchemy.orm.mapped_column(
         sqlalchemy.Text()
     )
+    character_data: sqlalchemy.orm.Mapped[json_object_list] = (
+        sqlalchemy.orm.mapped_column("characters")
+    )
+    prologue: sqlalchemy.orm.Mapped[str_list]
+    total_actions: sqlalchemy.orm.Mapped[int]
+    # opening block written ahead of time, served when the game is started
+    opening_block: sqlalchemy.orm.Mapped[typing.Optional[json_object]]
+    version: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(
+        default=0, server_default="0"
+    )
+    created_at: sqlalchemy.orm.Mapped[datetime.datetime] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now()
+    )
+    # set once a player first picks the session, fresh sessions have none
+    claimed_at: sqlalchemy.orm.Mapped[typing.Optional[datetime.datetime]] = (
+        sqlalchemy.orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+    )
+
+    signatures: sqlalchemy.orm.Mapped[typing.List["SessionSignature"]] = (
+        sqlalchemy.orm.relationship(back_populates="session")
+    )
+
+    @cached_property
+    def characters(self) -> list[Character]:
+        # parsed once per loaded session, characters never change after generation
+        return list(map(lambda c: Character(**c), self.character_data))
+
+    def set_characters(self, characters: list[dict]):
+        self.character_data = characters
+        self.__dict__.pop("characters", None)
+
+    def touch(self):
+        # bumped on every committed change, conditional requests rely on it
+        self.version = (self.version or 0) + 1
+
+
+class GamePlaythrough(Base):
+    """
+    A single player's progress through a game session. Sessions are generated
+    once and never change, every player gets their own playthrough of it
+    """
+
+    __tablename__ = "game-playthroughs"
+
+    id = sqlalchemy.orm.mapped_column(sqlalchemy.Uuid, primary_key=True)
+    session_id = sqlalchemy.orm.mapped_column(
+        sqlalchemy.Uuid,
+        sqlalchemy.ForeignKey(f"{GameSession.__tablename__}.id"),
+        index=True,
+    )
     final_act_synoposis: sqlalchemy.orm.Mapped[typing.Optional[str]] = (
         sqlalchemy.orm.mapped_column(sqlalchemy.Text())
     )
-    raw_characters: sqlalchemy.orm.Mapped[json_scalar]
-    prologue: sqlalchemy.orm.Mapped[str_list]
     remaining_actions: sqlalchemy.orm.Mapped[int]
-    total_actions: sqlalchemy.orm.Mapped[int]
     final_video_url: sqlalchemy.orm.Mapped[typing.Optional[str]]
-
+    final_video_hls_url: sqlalchemy.orm.Mapped[typing.Optional[str]]
     closing_remarks: sqlalchemy.orm.Mapped[typing.Optional[str]]
+    version: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(
+        default=0, server_default="0"
+    )
+    # set while the story blocks are held in a PlaythroughArchive instead
+    archived_at: sqlalchemy.orm.Mapped[typing.Optional[datetime.datetime]] = (
+        sqlalchemy.orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+    )
+    rehydrated_at: sqlalchemy.orm.Mapped[typing.Optional[datetime.datetime]] = (
+        sqlalchemy.orm.mapped_column(sqlalchemy.DateTime(timezone=True))
+    )
 
+    # one way only, sessions are shared and never reference their playthroughs
+    session: sqlalchemy.orm.Mapped[GameSession] = sqlalchemy.orm.relationship(
+        GameSession, lazy="joined"
+    )
     story_blocks: sqlalchemy.orm.Mapped[typing.List["GameStoryBlock"]] = (
-        sqlalchemy.orm.relationship()
+        sqlalchemy.orm.relationship(back_populates="playthrough")
     )
 
-    @property
-    def characters(self):
-        chars = json.loads(self.raw_characters)
-
-        return list(map(lambda c: Character(**c), chars))
+    def touch(self):
+        # bumped on every committed change, conditional requests rely on it
+        self.version = (self.version or 0) + 1
 
     @property
     def ordered_story_blocks(self):
@@ -79,20 +155,134 @@ class GameSession(Base):
 
 
 class GameStoryBlock(Base):
+    """
+    Partitioned by month of creation, partitions are created ahead of time
+    and dropped once archival has emptied them. The creation time is part of
+    the table's primary key only because partitioning requires it, blocks are
+    identified by their id alone
+    """
+
     __tablename__ = "game-story-blocks"
+    __table_args__ = (
+        sqlalchemy.PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(primary_key=True)
+    id: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(sqlalchemy.Identity())
     number: sqlalchemy.orm.Mapped[int]
     previous_action: sqlalchemy.orm.Mapped[str]
     actions_consumed: sqlalchemy.orm.Mapped[int]
     is_final_act: sqlalchemy.orm.Mapped[bool]
     dialogue: sqlalchemy.orm.Mapped[str_list]
     backdrop_image_url: sqlalchemy.orm.Mapped[typing.Optional[str]]
-    session_id = sqlalchemy.orm.mapped_column(
-        sqlalchemy.Uuid, sqlalchemy.ForeignKey(f"{GameSession.__tablename__}.id")
+    # until then the block shows the previous backdrop
+    backdrop_ready: sqlalchemy.orm.Mapped[bool] = sqlalchemy.orm.mapped_column(
+        default=False, server_default=sqlalchemy.false()
+    )
+    # this block's part of the final video
+    video_clip_url: sqlalchemy.orm.Mapped[typing.Optional[str]]
+    created_at: sqlalchemy.orm.Mapped[datetime.datetime] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now()
+    )
+    playthrough_id = sqlalchemy.orm.mapped_column(
+        sqlalchemy.Uuid,
+        sqlalchemy.ForeignKey(f"{GamePlaythrough.__tablename__}.id"),
+        index=True,
     )
     possible_actions: sqlalchemy.orm.Mapped[str_list]
 
+    playthrough: sqlalchemy.orm.Mapped[GamePlaythrough] = sqlalchemy.orm.relationship(
+        GamePlaythrough, back_populates="story_blocks"
+    )
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class PlaythroughArchive(Base):
+    """
+    The story blocks of a finished playthrough, compressed and moved out of
+    the story blocks table. Brought back whenever the playthrough is opened
+    """
+
+    __tablename__ = "playthrough-archives"
+
+    playthrough_id = sqlalchemy.orm.mapped_column(
+        sqlalchemy.Uuid,
+        sqlalchemy.ForeignKey(f"{GamePlaythrough.__tablename__}.id"),
+        primary_key=True,
+    )
+    # lzma compressed JSON, stored as is since it compresses no further
+    blocks: sqlalchemy.orm.Mapped[bytes] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.LargeBinary()
+    )
+    block_count: sqlalchemy.orm.Mapped[int]
+    archived_at: sqlalchemy.orm.Mapped[datetime.datetime] = (
+        sqlalchemy.orm.mapped_column(
+            sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now()
+        )
+    )
+
+
+class SessionSignature(Base):
+    """
+    A MinHash signature of a session's reference material or synopsis, along
+    with its LSH band hashes. Sessions sharing a band hash are candidate near
+    duplicates, confirmed by comparing their signatures
+    """
+
+    __tablename__ = "session-signatures"
+    __table_args__ = (
+        sqlalchemy.Index(
+            "ix_session-signatures_bands", "bands", postgresql_using="gin"
+        ),
+    )
+
+    id: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(primary_key=True)
+    session_id = sqlalchemy.orm.mapped_column(
+        sqlalchemy.Uuid,
+        sqlalchemy.ForeignKey(f"{GameSession.__tablename__}.id"),
+        index=True,
+    )
+    # "reference" or "synopsis"
+    kind: sqlalchemy.orm.Mapped[str]
+    minhash: sqlalchemy.orm.Mapped[bytes] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.LargeBinary()
+    )
+    bands: sqlalchemy.orm.Mapped[int_list] = sqlalchemy.orm.mapped_column(
+        postgresql.ARRAY(sqlalchemy.BigInteger)
+    )
+    created_at: sqlalchemy.orm.Mapped[datetime.datetime] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now()
+    )
+
     session: sqlalchemy.orm.Mapped[GameSession] = sqlalchemy.orm.relationship(
-        GameSession, back_populates="story_blocks"
+        GameSession, back_populates="signatures"
+    )
+
+
+class BackdropCacheEntry(Base):
+    """
+    A generated backdrop along with the embedding of the scene it was drawn
+    from, so that a similar scene in the same visual style can reuse it
+    """
+
+    __tablename__ = "backdrop-cache"
+
+    id: sqlalchemy.orm.Mapped[int] = sqlalchemy.orm.mapped_column(primary_key=True)
+    visual_style: sqlalchemy.orm.Mapped[str] = sqlalchemy.orm.mapped_column(index=True)
+    description: sqlalchemy.orm.Mapped[str] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.Text()
+    )
+    embedding: sqlalchemy.orm.Mapped[bytes] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.LargeBinary()
+    )
+    image_url: sqlalchemy.orm.Mapped[str]
+    # the playthrough the backdrop was generated for, if any
+    playthrough_id: sqlalchemy.orm.Mapped[typing.Optional[uuid.UUID]] = (
+        sqlalchemy.orm.mapped_column(sqlalchemy.Uuid)
+    )
+    # seconds the generation took, saved again by every reuse
+    latency: sqlalchemy.orm.Mapped[float]
+    created_at: sqlalchemy.orm.Mapped[datetime.datetime] = sqlalchemy.orm.mapped_column(
+        sqlalchemy.DateTime(timezone=True), server_default=sqlalchemy.func.now()
     )
@@ -0,0 +1,203 @@
+import time
+import uuid
+import typing
+import asyncio
+import datetime
+import contextlib
+import sqlalchemy
+from collections import Counter
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.database import engine, connection
+from app.logging import logger
+from app.metrics import metrics
+from app.tasks import supervisor
+from app.gamemaster.backdrops import complete_backdrop
+from app.gamemaster.final_video import create_final_video
+import app.models as appmodels
+
+_MAX_BACKOFF_ = 60 * 60
+_BATCH_SIZE_ = 50
+
+
+class RecoverySweeper:
+    """
+    Periodically finds story blocks whose backdrop never arrived and final
+    acts without a final video, and re-drives only the missing stage. Every
+    job re-checks its stage before and after running, so completed work is
+    never regenerated, and holds a lock while it runs so that only one worker
+    ever runs it
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        backdrop_after: float,
+        final_video_after: float,
+        concurrency: int,
+        max_attempts: int,
+    ):
+        self.interval = interval
+        self.backdrop_after = backdrop_after
+        self.final_video_after = final_video_after
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._in_flight: set[str] = set()
+        self._attempts: Counter[str] = Counter()
+        self._retry_at: dict[str, float] = {}
+        # left out of later sweeps, so they cannot crowd out other work
+        self._given_up_blocks: set[int] = set()
+        self._given_up_playthroughs: set[uuid.UUID] = set()
+
+    def _stuck_backdrops(self, session: Session) -> list[tuple[int, uuid.UUID]]:
+        block = appmodels.GameStoryBlock
+        cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+            seconds=self.backdrop_after
+        )
+        statement = (
+            sqlalchemy.select(block.id, block.playthrough_id)
+            .where(block.backdrop_ready.is_(False))
+            .where(block.created_at < cutoff)
+            .where(block.id.not_in(self._given_up_blocks))
+            .order_by(block.created_at)
+            .limit(_BATCH_SIZE_)
+        )
+        return list(session.execute(statement).tuples())
+
+    def _stuck_final_videos(self, session: Session) -> list[uuid.UUID]:
+        block = appmodels.GameStoryBlock
+        playthrough = appmodels.GamePlaythrough
+        cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+            seconds=self.final_video_after
+        )
+        statement = (
+            sqlalchemy.select(playthrough.id)
+            .join(block, block.playthrough_id == playthrough.id)
+            .where(playthrough.final_video_url.is_(None))
+            .where(block.is_final_act.is_(True))
+            .where(block.created_at < cutoff)
+            .where(playthrough.id.not_in(self._given_up_playthroughs))
+            .order_by(block.created_at)
+            .limit(_BATCH_SIZE_)
+        )
+        return list(session.scalars(statement))
+
+    def _should_start(self, job: str, key: str) -> bool:
+        if job in self._in_flight or len(self._in_flight) >= self.concurrency:
+            return False
+        if self._attempts[job] >= self.max_attempts:
+            return False
+        if self._retry_at.get(job, 0) > time.monotonic():
+            return False
+        # still being worked on by the player's own tasks
+        return not supervisor.busy(key)
+
+    def sweep(self):
+        with Session(connection) as session:
+            backdrops = self._stuck_backdrops(session)
+            final_videos = self._stuck_final_videos(session)
+
+        for block_id, playthrough_id in backdrops:
+            job = f"backdrop:{block_id}"
+            if self._should_start(job, str(playthrough_id)):
+                self._start(job, lambda block_id=block_id: self._backdrop(block_id))
+            elif self._attempts[job] >= self.max_attempts:
+                self._given_up_blocks.add(block_id)
+
+        for playthrough_id in final_videos:
+            job = f"final-video:{playthrough_id}"
+            if self._should_start(job, str(playthrough_id)):
+                self._start(
+                    job,
+                    lambda playthrough_id=playthrough_id: self._final_video(
+                        playthrough_id
+                    ),
+                )
+            elif self._attempts[job] >= self.max_attempts:
+                self._given_up_playthroughs.add(playthrough_id)
+
+    def _start(self, job: str, run: typing.Callable[[], typing.Awaitable]):
+        self._in_flight.add(job)
+        supervisor.spawn(self._run(job, run), name=f"recovery {job}")
+
+    @contextlib.contextmanager
+    def _claim(self, job: str) -> typing.Iterator[bool]:
+        """
+        Takes a lock on the job for as long as it runs. An advisory lock rather
+        than a row lock, the job writes the rows itself, and the database
+        releases it should the worker die
+        """
+        lock_id = sqlalchemy.func.hashtext(f"recovery:{job}")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as claim:
+            claimed = claim.execute(
+                sqlalchemy.select(sqlalchemy.func.pg_try_advisory_lock(lock_id))
+            ).scalar()
+            try:
+                yield claimed
+            finally:
+                if claimed:
+                    claim.execute(
+                        sqlalchemy.select(sqlalchemy.func.pg_advisory_unlock(lock_id))
+                    )
+
+    async def _run(self, job: str, run: typing.Callable[[], typing.Awaitable]):
+        try:
+            with self._claim(job) as claimed:
+                if not claimed:
+                    metrics.incr("recovery.claimed_elsewhere")
+                    logger.debug(f"recovery: {job} is being run by another worker")
+                    return
+                await self._attempt(job, run)
+        except Exception as e:
+            logger.error(f"recovery: unable to claim {job}: {e!r}")
+        finally:
+            self._in_flight.discard(job)
+
+    async def _attempt(self, job: str, run: typing.Callable[[], typing.Awaitable]):
+        self._attempts[job] += 1
+        logger.info(f"recovery: {job}, attempt {self._attempts[job]}")
+        try:
+            await run()
+            metrics.incr("recovery.recovered")
+            self._attempts.pop(job, None)
+            self._retry_at.pop(job, None)
+        except Exception as e:
+            metrics.incr("recovery.failed")
+            backoff = min(_MAX_BACKOFF_, self.interval * 2 ** self._attempts[job])
+            self._retry_at[job] = time.monotonic() + backoff
+            if self._attempts[job] >= self.max_attempts:
+                logger.error(f"recovery: giving up on {job}: {e!r}")
+            else:
+                logger.warning(f"recovery: {job} failed, retrying in {backoff}s")
+
+    async def _backdrop(self, block_id: int):
+        with Session(connection) as session:
+            block = session.get(appmodels.GameStoryBlock, block_id)
+            if block is None or block.backdrop_ready:
+                return
+            await complete_backdrop(session, block.playthrough, block)
+
+    async def _final_video(self, playthrough_id: uuid.UUID):
+        with Session(connection) as session:
+            playthrough = session.get(appmodels.GamePlaythrough, playthrough_id)
+            if playthrough is None or playthrough.final_video_url is not None:
+                return
+            await create_final_video(session, playthrough)
+
+    async def run(self):
+        logger.info("recovery: sweeping for incomplete backdrops and final videos")
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"recovery: sweep failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+
+sweeper = RecoverySweeper(
+    interval=Config.recovery_interval,
+    backdrop_after=Config.recovery_backdrop_after,
+    final_video_after=Config.recovery_final_video_after,
+    concurrency=Config.recovery_concurrency,
+    max_attempts=Config.recovery_max_attempts,
+)
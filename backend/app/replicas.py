@@ -0,0 +1,200 @@
+import time
+import typing
+import asyncio
+import itertools
+import contextlib
+import contextvars
+import sqlalchemy
+import sqlalchemy.exc
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from sqlalchemy.orm import Session
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+from app.database import engine, connection, replica_engines
+from app.commits import commits
+
+T = typing.TypeVar("T")
+
+# playthroughs remembered as recently written
+_MAX_WRITTEN_ = 10000
+# primary WAL positions kept to work out how far behind replicas are
+_MAX_SAMPLES_ = 300
+
+
+def _lsn(value: str) -> int:
+    high, low = value.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: sqlalchemy.Engine
+    healthy: bool = False
+    # everything committed on the primary before this time has been replayed
+    caught_up_to: float = 0
+
+    @property
+    def lag(self) -> float:
+        return time.monotonic() - self.caught_up_to
+
+
+_PRIMARY_ = Replica(name="primary", engine=engine, healthy=True)
+
+# the database chosen for the reads of the current request, once chosen
+_pinned: contextvars.ContextVar[list[Replica] | None] = contextvars.ContextVar(
+    "pinned_replica", default=None
+)
+
+
+class ReplicaRouter:
+    """
+    Sends read only queries to healthy replicas, falling back to the primary.
+    Replicas are checked periodically for how far they have replayed the
+    primary's WAL, and skipped once they fall too far behind. Playthroughs
+    written recently are only read from replicas that have caught up with the
+    write, so players always see their own changes
+    """
+
+    def __init__(self, replicas: list[Replica], max_lag: float, check_interval: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._samples: deque[tuple[float, int]] = deque(maxlen=_MAX_SAMPLES_)
+        self._written: OrderedDict[str, float] = OrderedDict()
+        self._round_robin = itertools.count()
+
+    def wrote(self, key: str):
+        self._written[key] = time.monotonic()
+        self._written.move_to_end(key)
+        while len(self._written) > _MAX_WRITTEN_:
+            self._written.popitem(last=False)
+
+    def _choose(self, keys: typing.Iterable[str]) -> Replica:
+        written_at = max((self._written.get(key, 0) for key in keys), default=0)
+        candidates = [
+            replica
+            for replica in self.replicas
+            if replica.healthy
+            and replica.lag <= self.max_lag
+            and replica.caught_up_to >= written_at
+        ]
+        if len(candidates) == 0:
+            return _PRIMARY_
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Serves every read in the block from the same database"""
+        token = _pinned.set([])
+        try:
+            yield
+        finally:
+            _pinned.reset(token)
+
+    def read(
+        self, load: typing.Callable[[Session], T], keys: typing.Iterable[str] = ()
+    ) -> T:
+        """
+        Runs a read only load against a replica, or the primary when no
+        replica is fit to serve the given playthroughs
+        """
+        pinned = _pinned.get()
+        if pinned is not None and len(pinned) > 0:
+            replica = pinned[0]
+        else:
+            replica = _PRIMARY_ if len(self.replicas) == 0 else self._choose(keys)
+            if pinned is not None:
+                pinned.append(replica)
+
+        if replica is not _PRIMARY_:
+            try:
+                with Session(replica.engine) as session:
+                    result = load(session)
+                metrics.incr(f"db.reads.{replica.name}")
+                return result
+            except sqlalchemy.exc.DBAPIError as e:
+                replica.healthy = False
+                metrics.incr(f"db.reads.{replica.name}.failed")
+                logger.warning(
+                    f"replica {replica.name} failed, reading from primary: {e!r}"
+                )
+                if pinned is not None:
+                    pinned[0] = _PRIMARY_
+
+        metrics.incr("db.reads.primary")
+        with Session(connection) as session:
+            return load(session)
+
+    def check(self):
+        """Measures how far behind the primary each replica is"""
+        # taken first, commits finished by then are at or before the position
+        sampled_at = time.monotonic()
+        with engine.connect() as primary:
+            primary_lsn = _lsn(
+                primary.execute(sqlalchemy.text("SELECT pg_current_wal_lsn()")).scalar()
+            )
+        self._samples.append((sampled_at, primary_lsn))
+
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as c:
+                    in_recovery, replayed = c.execute(
+                        sqlalchemy.text(
+                            "SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()"
+                        )
+                    ).one()
+            except sqlalchemy.exc.DBAPIError as e:
+                if replica.healthy:
+                    logger.warning(f"replica {replica.name} unavailable: {e!r}")
+                replica.healthy = False
+                continue
+
+            if not in_recovery or replayed is None:
+                if replica.healthy:
+                    logger.warning(f"{replica.name} is not replicating, skipping it")
+                replica.healthy = False
+                continue
+
+            # the latest primary position the replica has replayed past
+            replayed = _lsn(replayed)
+            replica.caught_up_to = next(
+                (at for at, lsn in reversed(self._samples) if lsn <= replayed), 0
+            )
+            if not replica.healthy:
+                logger.info(f"replica {replica.name} available")
+            replica.healthy = True
+            metrics.observe(f"db.{replica.name}.lag", replica.lag)
+
+    async def run(self):
+        logger.info(
+            f"replicas: reading from {', '.join(r.name for r in self.replicas)}"
+        )
+        while True:
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                # without the primary's position no replica can be trusted
+                for replica in self.replicas:
+                    replica.healthy = False
+                logger.error(f"replica check failed: {e!r}")
+            await asyncio.sleep(self.check_interval)
+
+    def snapshot(self) -> dict:
+        return {
+            f"{replica.name}.lag": replica.lag if replica.healthy else None
+            for replica in self.replicas
+        }
+
+
+replicas = ReplicaRouter(
+    [Replica(name=name, engine=e) for name, e in replica_engines.items()],
+    max_lag=Config.db_replica_max_lag,
+    check_interval=Config.db_replica_check_interval,
+)
+
+# other workers' commits count as well, for players whose requests are spread
+# across workers
+commits.subscribe(lambda playthrough_id, version: replicas.wrote(playthrough_id))
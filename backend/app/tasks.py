@@ -0,0 +1,153 @@
+import asyncio
+import typing
+from enum import Enum
+from collections import Counter, defaultdict
+from app.config import Config
+from app.logging import logger
+from app.metrics import metrics
+
+
+class AbandonPolicy(Enum):
+    CANCEL = "cancel"
+    FINISH_STAGE = "finish-stage"
+    FINISH_ALL = "finish-all"
+
+
+class Abandoned(Exception):
+    """Raised at a stage boundary when nobody is left to see the next stage"""
+
+
+class TaskSupervisor:
+    """
+    Holds on to background tasks, tagged by playthrough, so that they can be
+    cancelled once a playthrough is abandoned and drained on shutdown.
+    Exceptions are logged and counted rather than lost with the task
+    """
+
+    def __init__(self, policy: AbandonPolicy, grace: float):
+        self.policy = policy
+        self.grace = grace
+        self.draining = False
+        self._tasks: dict[asyncio.Task, str | None] = {}
+        self._by_key: dict[str, set[asyncio.Task]] = defaultdict(set)
+        self._abandoned: set[str] = set()
+        self._pending_abandons: dict[str, asyncio.TimerHandle] = {}
+        self._counts: Counter[str] = Counter()
+
+    def spawn(
+        self,
+        coroutine: typing.Coroutine,
+        key: str | None = None,
+        name: str | None = None,
+    ) -> asyncio.Task:
+        task = asyncio.create_task(coroutine, name=name)
+        self._tasks[task] = key
+        if key is not None:
+            self._by_key[key].add(task)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        key = self._tasks.pop(task, None)
+        if key is not None:
+            tasks = self._by_key.get(key)
+            if tasks is not None:
+                tasks.discard(task)
+                if len(tasks) == 0:
+                    del self._by_key[key]
+                    self._abandoned.discard(key)
+
+        if task.cancelled():
+            self._counts["cancelled"] += 1
+            metrics.incr("tasks.cancelled")
+            return
+
+        error = task.exception()
+        if isinstance(error, Abandoned):
+            self._counts["cancelled"] += 1
+            metrics.incr("tasks.cancelled")
+        elif error is not None:
+            self._counts["failed"] += 1
+            metrics.incr("tasks.failed")
+            logger.error(
+                f"task {task.get_name()} ({key}) failed",
+                exc_info=(type(error), error, error.__traceback__),
+            )
+        else:
+            self._counts["completed"] += 1
+
+    def busy(self, key: str) -> bool:
+        return key in self._by_key
+
+    def checkpoint(self, key: str):
+        """Called between stages, stops work nobody is waiting for any more"""
+        if key in self._abandoned:
+            raise Abandoned(key)
+
+    def abandon(self, key: str):
+        """
+        Called once a playthrough has no sockets left. The policy is applied
+        after a grace period, so that a quick reconnect does not lose work
+        """
+        if self.draining or self.policy == AbandonPolicy.FINISH_ALL:
+            return
+        if key not in self._by_key or key in self._pending_abandons:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._pending_abandons[key] = loop.call_later(
+            self.grace, self._apply_abandon, key
+        )
+
+    def _apply_abandon(self, key: str):
+        self._pending_abandons.pop(key, None)
+        tasks = self._by_key.get(key)
+        if tasks is None:
+            return
+
+        logger.info(f"playthrough {key} abandoned, applying {self.policy.value}")
+        metrics.incr("tasks.abandoned")
+        if self.policy == AbandonPolicy.CANCEL:
+            for task in list(tasks):
+                task.cancel()
+        elif self.policy == AbandonPolicy.FINISH_STAGE:
+            self._abandoned.add(key)
+
+    def resume(self, key: str):
+        handle = self._pending_abandons.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        self._abandoned.discard(key)
+
+    async def drain(self, timeout: float):
+        """Lets in-flight work finish within the deadline, cancelling the rest"""
+        self.draining = True
+        for handle in self._pending_abandons.values():
+            handle.cancel()
+        self._pending_abandons.clear()
+
+        tasks = list(self._tasks)
+        if len(tasks) == 0:
+            return
+
+        logger.info(f"draining {len(tasks)} background tasks")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if len(pending) > 0:
+            logger.warning(f"cancelling {len(pending)} tasks still running")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending, timeout=5)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "completed": self._counts["completed"],
+            "cancelled": self._counts["cancelled"],
+            "failed": self._counts["failed"],
+        }
+
+
+supervisor = TaskSupervisor(
+    policy=AbandonPolicy(Config.tasks_abandon_policy),
+    grace=Config.tasks_abandon_grace,
+)
@@ -0,0 +1,327 @@
+import io
+import os
+import uuid
+import typing
+import itertools
+import sqlalchemy
+import zstandard
+from pathlib import Path
+from collections import Counter
+from sqlalchemy.orm import Session
+from app.database import engine
+from app.logging import logger
+from app.commits import commits
+from app.archive import unpack_values
+from app import serialization
+import app.models as appmodels
+
+_SESSIONS_ = appmodels.GameSession.__table__
+_PLAYTHROUGHS_ = appmodels.GamePlaythrough.__table__
+_BLOCKS_ = appmodels.GameStoryBlock.__table__
+_ARCHIVES_ = appmodels.PlaythroughArchive.__table__
+
+# block ids are not carried over, they would clash with the target's own
+_BLOCK_COLUMNS_ = [column.name for column in _BLOCKS_.columns if column.name != "id"]
+# rows fetched per round trip from each server side cursor
+_FETCH_SIZE_ = 5000
+_STAGING_ = "transfer_staging"
+
+
+def _cursor_path(path: Path, direction: str) -> Path:
+    # one per direction, so importing a file never resumes from its export
+    return path.with_name(f"{path.name}.{direction}-cursor")
+
+
+def _save_cursor(path: Path, cursor: dict):
+    # written then renamed, so a crash never leaves half a cursor behind
+    partial = path.with_name(f".{path.name}.partial")
+    partial.write_bytes(serialization.dumps(cursor))
+    os.replace(partial, path)
+
+
+def _load_cursor(path: Path) -> dict | None:
+    if not path.exists():
+        return None
+    return serialization.loads(path.read_bytes())
+
+
+class _Groups:
+    """Rows of a stream ordered by a key, taken one key at a time"""
+
+    def __init__(self, rows: typing.Iterable, key: typing.Callable):
+        self._groups = itertools.groupby(rows, key)
+        self._next = next(self._groups, None)
+
+    def take(self, key) -> list:
+        # keys are only ever asked for in order, anything before is orphaned
+        while self._next is not None and self._next[0] < key:
+            self._next = next(self._groups, None)
+        if self._next is None or self._next[0] != key:
+            return []
+        group = list(self._next[1])
+        self._next = next(self._groups, None)
+        return group
+
+
+def _line(kind: str, values: dict) -> bytes:
+    return serialization.dumps({"kind": kind} | values) + b"\n"
+
+
+def export_catalog(
+    path: Path,
+    after: str | None = None,
+    resume: bool = False,
+    checkpoint_every: int = 1000,
+) -> Counter[str]:
+    """
+    Streams sessions, each followed by its playthroughs and their story
+    blocks, as zstd compressed NDJSON ordered by session id. Every table is
+    read through its own server side cursor and merged, so memory use stays
+    constant however large the catalog. A checkpoint after every so many
+    sessions ends a zstd frame and records how far the export got, a resumed
+    export truncates the file back to it and carries on from there
+    """
+    cursor_path = _cursor_path(path, "export")
+    offset = 0
+    if resume:
+        cursor = _load_cursor(cursor_path)
+        if cursor is not None:
+            after, offset = cursor["after"], cursor["offset"]
+            logger.info(f"transfer: resuming export after session {after}")
+
+    def session_filter(column: sqlalchemy.Column):
+        if after is None:
+            return column.is_not(None)
+        return column > uuid.UUID(after)
+
+    sessions = (
+        sqlalchemy.select(_SESSIONS_)
+        .where(session_filter(_SESSIONS_.c.id))
+        .order_by(_SESSIONS_.c.id)
+    )
+    playthroughs = (
+        sqlalchemy.select(_PLAYTHROUGHS_)
+        .where(session_filter(_PLAYTHROUGHS_.c.session_id))
+        .order_by(_PLAYTHROUGHS_.c.session_id, _PLAYTHROUGHS_.c.id)
+    )
+    blocks = (
+        sqlalchemy.select(
+            *(_BLOCKS_.c[name] for name in _BLOCK_COLUMNS_),
+            _PLAYTHROUGHS_.c.session_id,
+        )
+        .join(_PLAYTHROUGHS_, _PLAYTHROUGHS_.c.id == _BLOCKS_.c.playthrough_id)
+        .where(session_filter(_PLAYTHROUGHS_.c.session_id))
+        .order_by(
+            _PLAYTHROUGHS_.c.session_id, _BLOCKS_.c.playthrough_id, _BLOCKS_.c.number
+        )
+    )
+    archives = (
+        sqlalchemy.select(
+            _ARCHIVES_.c.playthrough_id,
+            _ARCHIVES_.c.blocks,
+            _PLAYTHROUGHS_.c.session_id,
+        )
+        .join(_PLAYTHROUGHS_, _PLAYTHROUGHS_.c.id == _ARCHIVES_.c.playthrough_id)
+        .where(session_filter(_PLAYTHROUGHS_.c.session_id))
+        .order_by(_PLAYTHROUGHS_.c.session_id, _ARCHIVES_.c.playthrough_id)
+    )
+
+    counts: Counter[str] = Counter()
+    mode = "r+b" if offset > 0 else "wb"
+    with (
+        open(path, mode) as file,
+        # one snapshot for every cursor, so they agree with each other
+        engine.connect().execution_options(
+            isolation_level="REPEATABLE READ", yield_per=_FETCH_SIZE_
+        ) as conn,
+    ):
+        file.truncate(offset)
+        file.seek(offset)
+        writer = zstandard.ZstdCompressor().stream_writer(file, closefd=False)
+
+        def checkpoint(last: uuid.UUID):
+            writer.flush(zstandard.FLUSH_FRAME)
+            file.flush()
+            os.fsync(file.fileno())
+            _save_cursor(cursor_path, {"after": str(last), "offset": file.tell()})
+
+        playthrough_groups = _Groups(conn.execute(playthroughs), lambda r: r.session_id)
+        block_groups = _Groups(
+            conn.execute(blocks), lambda r: (r.session_id, r.playthrough_id)
+        )
+        archive_groups = _Groups(
+            conn.execute(archives), lambda r: (r.session_id, r.playthrough_id)
+        )
+
+        last = None
+        for game_session in conn.execute(sessions):
+            writer.write(_line("session", dict(game_session._mapping)))
+            for playthrough in playthrough_groups.take(game_session.id):
+                key = (game_session.id, playthrough.id)
+                archived = archive_groups.take(key)
+                # archived blocks are exported, and imported, as live ones
+                writer.write(
+                    _line(
+                        "playthrough",
+                        dict(playthrough._mapping) | {"archived_at": None},
+                    )
+                )
+                for block in block_groups.take(key):
+                    values = dict(block._mapping)
+                    del values["session_id"]
+                    writer.write(_line("block", values))
+                    counts["block"] += 1
+                for archive in archived:
+                    for values in unpack_values(archive.blocks):
+                        values.pop("id", None)
+                        values["playthrough_id"] = playthrough.id
+                        writer.write(_line("block", values))
+                        counts["block"] += 1
+                counts["playthrough"] += 1
+
+            counts["session"] += 1
+            last = game_session.id
+            if counts["session"] % checkpoint_every == 0:
+                checkpoint(last)
+                logger.info(f"transfer: exported {counts['session']} sessions")
+
+        writer.flush(zstandard.FLUSH_FRAME)
+        if last is not None:
+            checkpoint(last)
+
+    return counts
+
+
+def _quote(name: str) -> str:
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def _upsert(table: sqlalchemy.Table, kind: str, columns: list[str]) -> str:
+    keys = [column.name for column in table.primary_key.columns]
+    updated = [name for name in columns if name not in keys]
+    return f"""
+        INSERT INTO {_quote(table.name)} ({", ".join(map(_quote, columns))})
+        SELECT {", ".join(f"r.{_quote(name)}" for name in columns)}
+        FROM {_STAGING_}, jsonb_populate_record(NULL::{_quote(table.name)}, line) AS r
+        WHERE line->>'kind' = '{kind}'
+        ON CONFLICT ({", ".join(map(_quote, keys))}) DO UPDATE SET
+        ({", ".join(map(_quote, updated))}) = ({", ".join(f"EXCLUDED.{_quote(name)}" for name in updated)})
+    """
+
+
+def _load_batch(lines: list[bytes], playthroughs: dict[str, int | None]):
+    with Session(engine) as session:
+        session.execute(
+            sqlalchemy.text(
+                f"CREATE TEMP TABLE IF NOT EXISTS {_STAGING_} (line jsonb) "
+                "ON COMMIT DELETE ROWS"
+            )
+        )
+        # text format COPY treats backslashes as escapes, the JSON's own are doubled
+        data = io.BytesIO(b"".join(line.replace(b"\\", b"\\\\") for line in lines))
+        dbapi_cursor = session.connection().connection.cursor()
+        dbapi_cursor.copy_expert(f"COPY {_STAGING_} (line) FROM STDIN", data)
+
+        session.execute(
+            sqlalchemy.text(
+                _upsert(_SESSIONS_, "session", [c.name for c in _SESSIONS_.columns])
+            )
+        )
+        session.execute(
+            sqlalchemy.text(
+                _upsert(
+                    _PLAYTHROUGHS_,
+                    "playthrough",
+                    [c.name for c in _PLAYTHROUGHS_.columns],
+                )
+            )
+        )
+
+        # a playthrough's blocks are replaced as a whole, under new ids
+        imported = f"SELECT (line->>'id')::uuid FROM {_STAGING_} WHERE line->>'kind' = 'playthrough'"
+        session.execute(
+            sqlalchemy.text(
+                f"DELETE FROM {_quote(_ARCHIVES_.name)} WHERE playthrough_id IN ({imported})"
+            )
+        )
+        session.execute(
+            sqlalchemy.text(
+                f"DELETE FROM {_quote(_BLOCKS_.name)} WHERE playthrough_id IN ({imported})"
+            )
+        )
+        session.execute(sqlalchemy.text(f"""
+                INSERT INTO {_quote(_BLOCKS_.name)} ({", ".join(map(_quote, _BLOCK_COLUMNS_))})
+                SELECT {", ".join(f"r.{_quote(name)}" for name in _BLOCK_COLUMNS_)}
+                FROM {_STAGING_}, jsonb_populate_record(NULL::{_quote(_BLOCKS_.name)}, line) AS r
+                WHERE line->>'kind' = 'block'
+                ORDER BY r.playthrough_id, r.number
+                """))
+
+        # running servers drop what they cached about the playthroughs
+        for playthrough_id, version in playthroughs.items():
+            commits.record(session, playthrough_id, version)
+        session.commit()
+
+
+def import_catalog(
+    path: Path, resume: bool = False, batch_size: int = 500
+) -> Counter[str]:
+    """
+    Loads an export through COPY, a batch of sessions at a time. Sessions and
+    playthroughs are upserted, and the story blocks of every imported
+    playthrough replace the ones it had, so importing the same file twice
+    changes nothing. Each batch commits along with how far the import got,
+    a resumed import skips the sessions already loaded
+    """
+    cursor_path = _cursor_path(path, "import")
+    after = None
+    if resume:
+        cursor = _load_cursor(cursor_path)
+        if cursor is not None:
+            after = uuid.UUID(cursor["after"])
+            logger.info(f"transfer: resuming import after session {after}")
+
+    counts: Counter[str] = Counter()
+    lines: list[bytes] = []
+    playthroughs: dict[str, int | None] = {}
+    batched = 0
+    last = None
+    skipping = False
+
+    def flush():
+        nonlocal lines, playthroughs, batched
+        if batched == 0:
+            return
+        _load_batch(lines, playthroughs)
+        _save_cursor(cursor_path, {"after": str(last)})
+        counts["session"] += batched
+        logger.info(f"transfer: imported {counts['session']} sessions")
+        lines, playthroughs, batched = [], {}, 0
+
+    with open(path, "rb") as file:
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            file, read_across_frames=True
+        )
+        for line in io.BufferedReader(reader, buffer_size=1 << 20):
+            values = serialization.loads(line)
+            kind = values["kind"]
+            if kind == "session":
+                session_id = uuid.UUID(values["id"])
+                skipping = after is not None and session_id <= after
+                if skipping:
+                    continue
+                if batched >= batch_size:
+                    flush()
+                last = session_id
+                batched += 1
+            elif skipping:
+                continue
+            elif kind == "playthrough":
+                playthroughs[values["id"]] = values["version"]
+                counts["playthrough"] += 1
+            else:
+                counts["block"] += 1
+            lines.append(line)
+        flush()
+
+    return counts
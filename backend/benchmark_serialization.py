@@ -0,0 +1,106 @@
+import json
+import random
+import timeit
+import argparse
+from app.serialization import CODECS
+
+parser = argparse.ArgumentParser(
+    description="Compares JSON codecs on GetGame responses of realistic sizes"
+)
+parser.add_argument("--viewers", type=int, default=8)
+parser.add_argument("--number", type=int, default=200)
+args = parser.parse_args()
+
+rng = random.Random(20250501)
+_WORDS_ = (
+    "the a of and to in lantern harbour whispered ancient storm tower crown "
+    "merchant forest river silver shadow map oath king queen thief sword "
+    "ember library vault bell ghost festival mask tide garden engine"
+).split()
+
+
+def words(count: int) -> str:
+    return " ".join(rng.choice(_WORDS_) for _ in range(count)).capitalize() + "."
+
+
+def game(blocks: int, lines: int) -> dict:
+    """A GetGame response, shaped as the frontend queries it"""
+    return {
+        "data": {
+            "game": {
+                "id": "5f0c7a52-8d1e-4d6b-9a8e-2b0f4f1c9d33",
+                "title": words(5),
+                "themes": [words(2) for _ in range(3)],
+                "synopsis": " ".join(words(25) for _ in range(12)),
+                "prologue": [words(30) for _ in range(4)],
+                "totalActions": 12,
+                "promoImageUrl": "https://example.com/media/promo.jpg",
+                "openingVideoUrl": "https://example.com/media/opening.mp4",
+                "characters": [
+                    {
+                        "id": i,
+                        "name": words(2),
+                        "age": str(20 + i),
+                        "backstory": words(60),
+                        "profileImageUrl": f"https://example.com/media/{i}.jpg",
+                    }
+                    for i in range(4)
+                ],
+                "storyBlocks": [
+                    {
+                        "id": i,
+                        "number": i,
+                        "isFinalAct": i == blocks - 1,
+                        "dialogue": [words(28) for _ in range(lines)],
+                        "previousAction": words(8),
+                        "backdropImageUrl": f"https://example.com/media/b{i}.jpg",
+                        "possibleActions": [words(6) for _ in range(3)],
+                        "actionsConsumed": 1,
+                    }
+                    for i in range(blocks)
+                ],
+                "finalVideoUrl": None,
+            }
+        }
+    }
+
+
+def stdlib(value) -> str:
+    # what strawberry and starlette did, per response and per socket
+    return json.dumps(value)
+
+
+sizes = {
+    "opening": game(blocks=1, lines=6),
+    "midgame": game(blocks=6, lines=8),
+    "finished": game(blocks=12, lines=12),
+}
+
+print(f"{'payload':<10} {'bytes':>8} {'codec':<8} {'per encode':>12} {'speedup':>8}")
+for name, payload in sizes.items():
+    size = len(stdlib(payload).encode())
+    baseline = min(timeit.repeat(lambda: stdlib(payload), number=args.number))
+    print(f"{name:<10} {size:>8} {'json':<8} {baseline / args.number * 1e6:>10.1f}us")
+    for codec in CODECS.values():
+        elapsed = min(timeit.repeat(lambda: codec.dumps(payload), number=args.number))
+        print(
+            f"{'':<10} {'':>8} {codec.name:<8} "
+            f"{elapsed / args.number * 1e6:>10.1f}us {baseline / elapsed:>7.1f}x"
+        )
+
+print(f"\nfanning out to {args.viewers} viewers")
+for name, payload in sizes.items():
+    per_socket = min(
+        timeit.repeat(
+            lambda: [stdlib(payload) for _ in range(args.viewers)], number=args.number
+        )
+    )
+    once = min(
+        timeit.repeat(
+            lambda: CODECS["orjson"].dumps(payload).decode(), number=args.number
+        )
+    )
+    print(
+        f"{name:<10} per socket {per_socket / args.number * 1e6:>9.1f}us, "
+        f"once {once / args.number * 1e6:>7.1f}us, {per_socket / once:>6.1f}x"
+    )
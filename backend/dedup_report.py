@@ -0,0 +1,24 @@
+import argparse
+import sqlalchemy.orm
+from app.config import Config
+from app.dedup import backfill, report
+from app.database import connection as conn
+
+parser = argparse.ArgumentParser(
+    description="Reports game sessions which are near duplicates of each other"
+)
+parser.add_argument("--threshold", type=float, default=Config.dedup_threshold)
+args = parser.parse_args()
+
+with sqlalchemy.orm.Session(conn) as session:
+    signed = backfill(session)
+    if signed > 0:
+        print(f"signed {signed} sessions without signatures")
+
+    groups = report(session, args.threshold)
+    for group in groups:
+        print(f"\n{group.kind}, at least {group.similarity:.0%} similar")
+        for session_id in group.session_ids:
+            print(f"  {session_id}")
+
+    print(f"\n{len(groups)} groups of near duplicate sessions")
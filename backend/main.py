@@ -1,20 +1,38 @@
 import os
+import uuid
 import asyncio
 import typing
 import strawberry
 import sqlalchemy
 import app.models as appmodels
 from enum import Enum
+from contextlib import asynccontextmanager
 from urllib.parse import quote
 from app.config import Config
-from fastapi import FastAPI, WebSocket
-from app.gamemaster.llms import llm
-from langchain_core.prompts import ChatPromptTemplate
+import fastapi
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from strawberry.fastapi import GraphQLRouter
 from sqlalchemy.orm import Session
 from app.database import connection
 from app.logging import logger
+from app.metrics import metrics
+from app import serialization
+from app.http_caching import CachingGraphQLRouter
+from app.inventory import inventory
+from app.connections import connections, Connection
+from app.tasks import supervisor, Abandoned
+from app.recovery import sweeper
+from app.archive import archiver
+from app.replicas import replicas
+from app.commits import commits
+from app.game_cache import game_cache
+from app.admission import admission, current_budget_key, Rejected
+from app.media import srcset, poster_url
+from app.media.storage import storage as media_storage
+from app.gamemaster.backdrops import start_backdrop, complete_backdrop
+from app.gamemaster.backdrop_cache import backdrop_cache
+from app.gamemaster.final_video import create_final_video
+from app.gamemaster.opening_block import opening_story_block
 from app.gamemaster.generate_next_story_block import (
     generate_next_story_block,
     TextAction,
@@ -33,6 +51,7 @@ class GameStoryBlock:
     dialogue: typing.List[str]
     previous_action: typing.Optional[str]
     backdrop_image_url: typing.Optional[str]
+    backdrop_image_srcset: typing.Optional[str]
     possible_actions: typing.List[str]
     actions_consumed: int
 
@@ -49,6 +68,7 @@ class GameStoryBlock:
             dialogue=block.dialogue,
             actions_consumed=block.actions_consumed,
             backdrop_image_url=block.backdrop_image_url,
+            backdrop_image_srcset=srcset(block.backdrop_image_url),
             possible_actions=block.possible_actions,
             previous_action=previous_action,
         )
@@ -81,28 +101,51 @@ class GameSession:
     characters: typing.List[Character]
     story_blocks: typing.List[GameStoryBlock]
     promo_image_url: str
+    promo_image_srcset: typing.Optional[str]
     opening_video_url: str
+    opening_video_poster_url: typing.Optional[str]
     final_video_url: typing.Optional[str]
+    final_video_hls_url: typing.Optional[str]
+    final_video_poster_url: typing.Optional[str]
     total_actions: int
 
-    def from_data(game_session: appmodels.GameSession):
+    def from_data(
+        game_session: appmodels.GameSession,
+        playthrough: typing.Optional[appmodels.GamePlaythrough] = None,
+    ):
+        """
+        Sessions are listed as they were generated, progress only exists once
+        they are played through, in which case the playthrough id is used
+        """
+        story_blocks = []
+        final_video_url = None
+        final_video_hls_url = None
+        if playthrough is not None:
+            story_blocks = playthrough.story_blocks
+            final_video_url = playthrough.final_video_url
+            final_video_hls_url = playthrough.final_video_hls_url
+
         return GameSession(
-            id=game_session.id,
+            id=game_session.id if playthrough is None else playthrough.id,
             title=game_session.title,
             themes=game_session.themes,
             synopsis=game_session.synopsis,
             prologue=game_session.prologue,
             promo_image_url=game_session.promo_image_url,
+            promo_image_srcset=srcset(game_session.promo_image_url),
             characters=list(
                 map(
                     Character.from_data,
                     game_session.characters,
                 )
             ),
-            story_blocks=list(map(GameStoryBlock.from_data, game_session.story_blocks)),
+            story_blocks=list(map(GameStoryBlock.from_data, story_blocks)),
             opening_video_url=game_session.opening_video_url,
+            opening_video_poster_url=poster_url(game_session.opening_video_url),
             total_actions=game_session.total_actions,
-            final_video_url=game_session.final_video_url,
+            final_video_url=final_video_url,
+            final_video_hls_url=final_video_hls_url,
+            final_video_poster_url=poster_url(final_video_url),
         )
 
 
@@ -184,25 +227,70 @@ class LumaGenerations:
 class Query:
     @strawberry.field
     def available_games() -> typing.List[GameSession]:
-        with Session(connection) as session:
-            statement = sqlalchemy.select(appmodels.GameSession).limit(100)
+        def load(session: Session) -> typing.List[GameSession]:
+            # fresh sessions first, so new players are not handed played ones
+            statement = (
+                sqlalchemy.select(appmodels.GameSession)
+                .order_by(
+                    appmodels.GameSession.claimed_at.is_not(None),
+                    appmodels.GameSession.created_at.desc(),
+                )
+                .limit(100)
+            )
 
             game_sessions = session.scalars(statement).all()
 
             return list(map(GameSession.from_data, game_sessions))
 
+        return replicas.read(load)
+
     @strawberry.field
     def game(id: str) -> typing.Optional[GameSession]:
-        with Session(connection) as session:
+        if Config.game_cache_enabled:
+            cached, ticket = game_cache.get(id)
+            if cached is not None:
+                return cached
+
+        def load(session: Session) -> tuple[int, GameSession] | None:
             statement = (
-                sqlalchemy.select(appmodels.GameSession)
-                .where(appmodels.GameSession.id == id)
+                sqlalchemy.select(appmodels.GamePlaythrough)
+                .where(appmodels.GamePlaythrough.id == id)
                 .limit(1)
             )
 
-            game_session = session.scalars(statement).one()
+            playthrough = session.scalars(statement).one()
+            if playthrough.archived_at is not None:
+                return None
 
-            return GameSession.from_data(game_session)
+            return playthrough.version, GameSession.from_data(
+                playthrough.session, playthrough
+            )
+
+        loaded = replicas.read(load, keys=[id])
+        if loaded is None:
+            # its story blocks are brought back first, and read from the primary
+            archiver.rehydrate(id)
+            with Session(connection) as session:
+                loaded = load(session)
+        version, game = loaded
+        if Config.game_cache_enabled:
+            game_cache.put(id, ticket, version, game)
+        return game
+
+    @strawberry.field
+    def debug_metrics() -> strawberry.scalars.JSON:
+        if not Config.debug:
+            raise Exception("not available")
+
+        return (
+            metrics.snapshot()
+            | {"failed_turn_rate": metrics.ratio("turns_failed", "turns")}
+            | {f"admission.{k}": v for k, v in admission.snapshot().items()}
+            | {f"tasks.{k}": v for k, v in supervisor.snapshot().items()}
+            | {f"replicas.{k}": v for k, v in replicas.snapshot().items()}
+            | {f"backdrop_cache.{k}": v for k, v in backdrop_cache.snapshot().items()}
+            | {f"game_cache.{k}": v for k, v in game_cache.snapshot().items()}
+        )
 
     @strawberry.field
     async def debug_list_generations(page: int, per_page: int) -> LumaGenerations:
@@ -283,32 +371,86 @@ class CommandType(Enum):
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def reset(self, id: str) -> str:
+    def start_playthrough(self, session_id: str) -> str:
         with Session(connection) as session:
             statement = (
                 sqlalchemy.select(appmodels.GameSession)
-                .where(appmodels.GameSession.id == id)
+                .where(appmodels.GameSession.id == session_id)
                 .limit(1)
             )
             game_session = session.scalars(statement).one()
-            game_session.story_blocks = []
+
+            playthrough = appmodels.GamePlaythrough()
+            playthrough.id = uuid.uuid4()
+            playthrough.session_id = game_session.id
+            playthrough.remaining_actions = game_session.total_actions
+            playthrough.version = 0
+            session.add_all([playthrough])
+            claimed = inventory.claim(session, game_session.id)
+            session.commit()
+
+            if claimed:
+                inventory.request_refill()
+
+            logger.debug(f"started playthrough {playthrough.id} of {game_session.id}")
+
+            return str(playthrough.id)
+
+    @strawberry.mutation
+    def reset(self, id: str) -> str:
+        with Session(connection) as session:
+            statement = (
+                sqlalchemy.select(appmodels.GamePlaythrough)
+                .where(appmodels.GamePlaythrough.id == id)
+                .limit(1)
+            )
+            playthrough = session.scalars(statement).one()
+            playthrough.story_blocks = []
+            # no longer finished, so no longer cached as such
+            playthrough.final_act_synoposis = None
+            playthrough.final_video_url = None
+            playthrough.final_video_hls_url = None
+            playthrough.touch()
+            archiver.forget(session, playthrough)
             del_statement = sqlalchemy.delete(appmodels.GameStoryBlock).where(
-                appmodels.GameStoryBlock.session_id == id
+                appmodels.GameStoryBlock.playthrough_id == id
             )
             session.execute(del_statement)
-            session.add_all([game_session])
+            session.add_all([playthrough])
             session.commit()
 
-            logger.debug("cleared game session")
+            logger.debug("cleared playthrough")
 
             return "success"
 
 
 schema = strawberry.Schema(query=Query, mutation=Mutation)
 
-graphql_app = GraphQLRouter(schema)
+graphql_app = CachingGraphQLRouter(schema, cacheable_fields={"game", "availableGames"})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    workers = []
+    if Config.inventory_enabled:
+        workers.append(asyncio.create_task(inventory.run()))
+    if Config.recovery_enabled:
+        workers.append(asyncio.create_task(sweeper.run()))
+    if Config.archive_enabled:
+        workers.append(asyncio.create_task(archiver.run()))
+    if len(replicas.replicas) > 0:
+        workers.append(asyncio.create_task(replicas.run()))
+    if Config.commits_notify:
+        workers.append(asyncio.create_task(commits.run()))
+
+    yield
+
+    for worker in workers:
+        worker.cancel()
+    await supervisor.drain(Config.tasks_drain_timeout)
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -321,80 +463,162 @@ app.add_middleware(
 app.include_router(graphql_app, prefix="/graphql")
 
 
+@app.get("/media/{key:path}")
+def media(key: str, request: Request):
+    return media_storage.response(key, request)
+
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, key: str | None = None):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    key: str | None = None,
+    last_event_id: int | None = fastapi.Query(None, alias="lastEventId"),
+):
+    # accepted first, a handshake refused outright reaches the client without
+    # its close code, and would be retried
     if key is None:
-        websocket.close(401, "missing session key")
+        await websocket.accept()
+        await websocket.close(code=4401, reason="missing session key")
         return
 
+    # the key identifies a playthrough, never the shared session it plays
     with Session(connection) as session:
         statement = (
-            sqlalchemy.select(appmodels.GameSession)
-            .where(appmodels.GameSession.id == key)
+            sqlalchemy.select(appmodels.GamePlaythrough)
+            .where(appmodels.GamePlaythrough.id == key)
             .limit(1)
         )
-        session.scalars(statement).one()
+        playthrough = session.scalars(statement).one_or_none()
+        if playthrough is None:
+            await websocket.accept()
+            await websocket.close(code=4404, reason="unknown session key")
+            return
+        key = str(playthrough.id)
+        archived = playthrough.archived_at is not None
 
-    await websocket.accept()
-    while True:
-        data = await websocket.receive_json()
+    # archived story blocks are brought back before the game can be played on
+    if archived:
+        archiver.rehydrate(key)
 
-        match data["type"]:
-            case "start-game":
-                asyncio.create_task(start_game_session(key, websocket))
-                continue
+    client = await connections.connect(key, websocket, last_event_id)
+    supervisor.resume(key)
+    try:
+        while True:
+            data = serialization.loads(await websocket.receive_text())
+            client.seen()
+
+            match data["type"]:
+                case "pong":
+                    continue
+
+                case "start-game":
+                    supervisor.spawn(
+                        start_game_session(key, client), key=key, name="start-game"
+                    )
+                    continue
 
-            case "submit-photo":
-                asyncio.create_task(submit_photo(key, websocket, data["url"]))
-                continue
+                case "submit-photo":
+                    supervisor.spawn(
+                        submit_photo(key, client, data["url"]),
+                        key=key,
+                        name="submit-photo",
+                    )
+                    continue
 
-            case "take-action":
-                asyncio.create_task(submit_action(key, websocket, data["action"]))
-                continue
+                case "take-action":
+                    supervisor.spawn(
+                        submit_action(key, client, data["action"]),
+                        key=key,
+                        name="take-action",
+                    )
+                    continue
 
-            case _:
-                print("unexpected data", data)
-                continue
+                case _:
+                    print("unexpected data", data)
+                    continue
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await connections.disconnect(client)
+        if connections.connected(key) == 0:
+            supervisor.abandon(key)
 
 
-async def start_game_session(key: str, ws: WebSocket):
-    await _generic_action(key, ws, "", "")
+def _notify_updated(playthrough: appmodels.GamePlaythrough):
+    connections.publish(str(playthrough.id), {"type": "updated"})
 
 
-async def submit_action(key: str, ws: WebSocket, action: str):
-    await _generic_action(key, ws, action, "")
+async def start_game_session(key: str, client: Connection):
+    await _generic_action(key, client, "", "")
 
 
-async def submit_photo(key: str, ws: WebSocket, photo_url: str):
-    await _generic_action(key, ws, "", photo_url)
+async def submit_action(key: str, client: Connection, action: str):
+    await _generic_action(key, client, action, "")
+
+
+async def submit_photo(key: str, client: Connection, photo_url: str):
+    await _generic_action(key, client, "", photo_url)
+
+
+def _reject(client: Connection, rejection: Rejected):
+    metrics.incr("turns_rejected")
+    client.send(
+        {
+            "type": "error",
+            "message": rejection.message,
+            "reason": rejection.reason,
+            "retryAfter": rejection.retry_after,
+        }
+    )
 
 
-async def _generic_action(key: str, ws: WebSocket, action: str, photo_url: str):
+async def _generic_action(key: str, client: Connection, action: str, photo_url: str):
+    websocket = client.websocket
+    address = websocket.client.host if websocket.client is not None else "unknown"
     try:
-        await _generic_action_inner(key, ws, action, photo_url)
+        admission.admit_turn(address, key)
+    except Rejected as e:
+        _reject(client, e)
+        return
+
+    # upstream calls made for this command, and its tasks, are charged to it
+    current_budget_key.set(key)
+    metrics.incr("turns")
+    try:
+        await _generic_action_inner(key, client, action, photo_url)
+    except Rejected as e:
+        _reject(client, e)
+    except Abandoned:
+        logger.info(f"stopped generating for abandoned playthrough {key}")
+        raise
     except Exception as e:
+        metrics.incr("turns_failed")
         logger.error(e)
-        await ws.send_json({"type": "error", "message": "something went wrong"})
+        client.send({"type": "error", "message": "something went wrong"})
+    finally:
+        admission.finish_turn(key)
 
 
-async def _generic_action_inner(key: str, ws: WebSocket, action: str, photo_url: str):
+async def _generic_action_inner(
+    key: str, client: Connection, action: str, photo_url: str
+):
     print("ATTEMPT")
     print(action)
     print(photo_url)
     with Session(connection) as session:
         statement = (
-            sqlalchemy.select(appmodels.GameSession)
-            .where(appmodels.GameSession.id == key)
+            sqlalchemy.select(appmodels.GamePlaythrough)
+            .where(appmodels.GamePlaythrough.id == key)
             .limit(1)
         )
-        game_session = session.scalars(statement).one()
+        playthrough = session.scalars(statement).one()
 
-        if action == "" and photo_url == "" and len(game_session.story_blocks) > 0:
+        if action == "" and photo_url == "" and len(playthrough.story_blocks) > 0:
             logger.debug("skipping start game session - game already started")
-            await ws.send_json({"type": "error", "message": "game already started"})
+            client.send({"type": "error", "message": "game already started"})
             return
 
-        await ws.send_json({"type": "updated"})
+        _notify_updated(playthrough)
 
         action_obj = TextAction(text="")
         if action != "":
@@ -402,162 +626,47 @@ async def _generic_action_inner(key: str, ws: WebSocket, action: str, photo_url:
         elif photo_url != "":
             action_obj = PhotoAction(url=photo_url)
 
-        next_block = await generate_next_story_block(
-            game_session=game_session, action=action_obj
-        )
+        backdrop = None
+        next_block = None
+        if action == "" and photo_url == "":
+            next_block = opening_story_block(playthrough)
+
+        if next_block is None:
+            # the backdrop renders from a scene summary while the dialogue is written
+            backdrop = start_backdrop(playthrough, action_obj)
+            try:
+                next_block = await generate_next_story_block(
+                    playthrough=playthrough, action=action_obj
+                )
+            except BaseException:
+                backdrop.cancel()
+                raise
 
-        game_session = session.scalars(statement).one()
-        game_session.story_blocks.append(next_block)
+        playthrough = session.scalars(statement).one()
+        playthrough.story_blocks.append(next_block)
+        playthrough.touch()
 
-        session.add_all([game_session])
+        session.add_all([playthrough])
         session.commit()
+        admission.finish_turn(key)
 
-        await ws.send_json({"type": "updated"})
+        _notify_updated(playthrough)
 
-        await _update_photo(session, ws, game_session, next_block)
+        # the backdrop is already being paid for, storing it finishes this stage
+        await _update_photo(session, playthrough, next_block, backdrop)
 
 
 async def _update_photo(
     session: Session,
-    ws: WebSocket,
-    game: appmodels.GameSession,
+    playthrough: appmodels.GamePlaythrough,
     story_block: appmodels.GameStoryBlock,
+    backdrop: asyncio.Task[str] | None,
 ):
-    if Config.stub_image_generation:
-        logger.debug("stub image - performing artificial wait")
-        await asyncio.sleep(3)
-        story_block.backdrop_image_url = (
-            f"https://placehold.co/400?text={quote('backdrop image URL')}"
-        )
-        logger.debug("stub image - DONE")
-    else:
-        generation = await luma_client.generations.image.create(
-            prompt=f"""
-Using the visual styles: {game.visual_style}
-
-Without including any text in the art, generate artwork for a novel inspired by the following dialogue:
-
-{'\n- '.join(story_block.dialogue)}
-""",
-            aspect_ratio="3:4",
-        )
-        completed = False
-        while not completed:
-            logger.debug("checking video")
-            gen = await luma_client.generations.get(id=generation.id)
-            if gen.state == "completed":
-                logger.debug("image ready")
-                completed = True
-                story_block.backdrop_image_url = gen.assets.image
-            elif gen.state == "failed":
-                raise RuntimeError(f"Generation failed: {gen.failure_reason}")
-            await asyncio.sleep(2)
-
-    session.add_all([story_block])
-    session.commit()
-
-    await ws.send_json({"type": "updated"})
+    # a prepared opening block comes with its backdrop, but is still the final
+    # act of a single action game
+    if backdrop is not None:
+        await complete_backdrop(session, playthrough, story_block, backdrop)
 
     if story_block.is_final_act:
-        await _create_final_video(session, ws, game)
-
-
-async def _create_final_video(
-    session: Session,
-    ws: WebSocket,
-    game: appmodels.GameSession,
-):
-    blocks = sorted(game.story_blocks, key=lambda b: b.number)
-
-    story_block_chain = (
-        ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    """
-{base_character}
-
-You will be provided with a synopsis for a short story, along with the reference
-material that influences the story. Use the synopsis to generate a video, and
-use the reference material to generate the video background, mood and setting.
-
-From this information, describe a video scene that would be suitable as a
-trailer for the short story in detail, going into detail on how the scene is
-laid out, who is in the foreground and the camera movements or scene
-transitions.
-
-Keep this description succinct and no longer than 1 paragraph.
-""",
-                ),
-                (
-                    "human",
-                    """
-## Reference Material
-{reference_material}
-
-## Synopsis
-{synopsis}
-
-## Story Events
-{story_events}
-""",
-                ),
-            ]
-        )
-        | llm
-    )
-
-    previous_generation = None
-    video_url = ""
-    for block in blocks:
-        keyframes = {}
-        if previous_generation is not None:
-            keyframes["frame0"] = {
-                "type": "generation",
-                "id": previous_generation.id,
-            }
-
-        story_block_response = await story_block_chain.ainvoke(
-            {
-                "base_character": "You are a helpful video director",
-                "synopsis": game.synopsis,
-                "reference_material": game.reference_material_summary,
-                "story_events": "\n- ".join(block.dialogue),
-            }
-        )
-
-        print(f"generating final video, frame {block.number} of {game.total_actions}")
-        print(story_block_response.content)
-        generation = await luma_client.generations.create(
-            model="ray-flash-2",
-            prompt=f"""
-Using the visual style: {game.visual_style}
-
-Generate a video using the following description:
-{story_block_response.content}
-""",
-        )
-
-        completed = False
-        while not completed:
-            print(f"checking video {block.number} of {game.total_actions}")
-            gen = await luma_client.generations.get(id=generation.id)
-            if gen.state == "completed":
-                print("end video gen")
-                video_url = gen.assets.video
-                break
-            elif gen.state == "failed":
-                raise RuntimeError(f"Generation failed: {gen.failure_reason}")
-
-            await asyncio.sleep(3)
-
-        previous_generation = generation
-
-    game.final_video_url = video_url
-
-    session.add_all([game])
-    session.commit()
-
-    print("video done")
-
-    await ws.send_json({"type": "updated"})
+        supervisor.checkpoint(str(playthrough.id))
+        await create_final_video(session, playthrough)
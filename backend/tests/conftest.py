@@ -0,0 +1,133 @@
+import os
+import shutil
+import socket
+import tempfile
+import subprocess
+from pathlib import Path
+
+# tests under tests/db run against a throwaway primary and streaming replica,
+# started with the Postgres binaries found on PG_BIN or the PATH, or against
+# the database DB_HOST points at when it is set
+_DB_TESTS_ = "db"
+
+collect_ignore = []
+_clusters: list[Path] = []
+
+
+def _pg_bin() -> Path | None:
+    if "PG_BIN" in os.environ:
+        return Path(os.environ["PG_BIN"])
+    initdb = shutil.which("initdb")
+    return None if initdb is None else Path(initdb).parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _run(pg_bin: Path, command: str, *args: str):
+    subprocess.run(
+        [str(pg_bin / command), *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+
+def _start(pg_bin: Path, directory: Path, port: int):
+    _run(
+        pg_bin,
+        "pg_ctl",
+        "start",
+        "--wait",
+        "-D",
+        str(directory),
+        "-l",
+        str(directory / "postgres.log"),
+        "-o",
+        f"-p {port} -c listen_addresses=127.0.0.1 -k {directory.parent}",
+    )
+    _clusters.append(directory)
+
+
+def _start_postgres(pg_bin: Path) -> tuple[int, int]:
+    root = Path(tempfile.mkdtemp(prefix="postgres-"))
+    primary, replica = root / "primary", root / "replica"
+    primary_port, replica_port = _free_port(), _free_port()
+
+    _run(pg_bin, "initdb", "-D", str(primary), "-U", "postgres", "-A", "trust")
+    _start(pg_bin, primary, primary_port)
+    _run(
+        pg_bin,
+        "pg_basebackup",
+        "-h",
+        "127.0.0.1",
+        "-p",
+        str(primary_port),
+        "-U",
+        "postgres",
+        "-D",
+        str(replica),
+        "-X",
+        "stream",
+    )
+    # rather than with -R, which writes options older walreceivers reject
+    (replica / "standby.signal").touch()
+    with open(replica / "postgresql.auto.conf", "a") as conf:
+        conf.write(
+            f"primary_conninfo = 'host=127.0.0.1 port={primary_port} user=postgres'\n"
+        )
+    _start(pg_bin, replica, replica_port)
+    return primary_port, replica_port
+
+
+def _migrate():
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+    from app.database import engine
+
+    alembic = AlembicConfig(str(Path(__file__).parent.parent / "alembic.ini"))
+    alembic.set_main_option(
+        "sqlalchemy.url", engine.url.render_as_string(hide_password=False)
+    )
+    command.upgrade(alembic, "head")
+
+
+def pytest_configure(config):
+    # the app reads its configuration on import, tests that need none of it
+    # still import modules that do
+    os.environ.setdefault("LUMAAI_API_KEY", "test")
+    os.environ.setdefault("MISTRAL_API_KEY", "test")
+    # mirrored media is written to a throwaway directory
+    os.environ.setdefault("MEDIA_ROOT", tempfile.mkdtemp(prefix="media-"))
+
+    pg_bin = _pg_bin()
+    if "DB_HOST" not in os.environ and pg_bin is not None and os.geteuid() != 0:
+        primary_port, replica_port = _start_postgres(pg_bin)
+        os.environ |= {
+            "DB_USERNAME": "postgres",
+            "DB_PASSWORD": "",
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(primary_port),
+            "DB_DATABASE": "postgres",
+            "DB_REPLICAS": f"127.0.0.1:{replica_port}",
+        }
+        _migrate()
+    elif "DB_HOST" not in os.environ:
+        # without a database, nor the binaries to start one, as Postgres
+        # refuses to run as root
+        collect_ignore.append(_DB_TESTS_)
+        for name in ("DB_USERNAME", "DB_PASSWORD", "DB_HOST", "DB_DATABASE"):
+            os.environ[name] = "test"
+        os.environ["DB_PORT"] = "5432"
+
+
+def pytest_unconfigure(config):
+    pg_bin = _pg_bin()
+    for directory in reversed(_clusters):
+        _run(pg_bin, "pg_ctl", "stop", "-D", str(directory), "-m", "immediate")
+    for directory in _clusters:
+        shutil.rmtree(directory.parent, ignore_errors=True)
+    _clusters.clear()
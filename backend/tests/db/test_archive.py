@@ -0,0 +1,117 @@
+import uuid
+import datetime
+from sqlalchemy.orm import Session
+import app.models as appmodels
+from app.database import engine
+from app.archive import Archiver, archiver, pack, unpack, unpack_values
+
+
+def _block(number: int) -> appmodels.GameStoryBlock:
+    block = appmodels.GameStoryBlock()
+    block.id = number
+    block.number = number
+    block.previous_action = f"action {number}"
+    block.actions_consumed = number
+    block.is_final_act = number == 2
+    block.dialogue = [f"line {number}", '"quoted" and ünïcode']
+    block.backdrop_image_url = f"https://example.com/{number}.png"
+    block.backdrop_ready = True
+    block.video_clip_url = None
+    block.created_at = datetime.datetime(2025, 4, number, 12, 30, tzinfo=datetime.UTC)
+    block.playthrough_id = uuid.uuid4()
+    block.possible_actions = ["go on"]
+    return block
+
+
+def test_unpack_restores_what_was_packed():
+    blocks = [_block(1), _block(2)]
+    restored = unpack(pack(blocks))
+
+    columns = [c.key for c in appmodels.GameStoryBlock.__table__.columns]
+    for block, copy in zip(blocks, restored, strict=True):
+        for column in columns:
+            if column != "playthrough_id":
+                assert getattr(copy, column) == getattr(block, column), column
+
+
+def test_the_playthrough_is_left_out():
+    (values,) = unpack_values(pack([_block(1)]))
+    assert "playthrough_id" not in values
+
+
+def _played(
+    rehydrated_days_ago: float | None, played_days_ago: float
+) -> appmodels.GamePlaythrough:
+    now = datetime.datetime.now(datetime.UTC)
+    game_session = appmodels.GameSession(
+        id=uuid.uuid4(),
+        title="title",
+        themes=[],
+        synopsis="synopsis",
+        visual_style="style",
+        promo_image_url="https://example.com/promo.png",
+        reference_material_summary="summary",
+        opening_video_url="https://example.com/opening.mp4",
+        opening_act_synopsis="opening",
+        middle_act_synopsis="middle",
+        character_data=[],
+        prologue=[],
+        total_actions=2,
+    )
+    playthrough = appmodels.GamePlaythrough(
+        id=uuid.uuid4(),
+        session=game_session,
+        remaining_actions=0,
+        final_video_url="https://example.com/final.mp4",
+    )
+    if rehydrated_days_ago is not None:
+        playthrough.rehydrated_at = now - datetime.timedelta(days=rehydrated_days_ago)
+    block = _block(1)
+    block.id = None
+    block.created_at = now - datetime.timedelta(days=played_days_ago)
+    block.playthrough = playthrough
+    with Session(engine) as session:
+        session.add_all([game_session, playthrough, block])
+        session.commit()
+        session.refresh(playthrough)
+        session.expunge_all()
+    return playthrough
+
+
+def _archived(playthrough: appmodels.GamePlaythrough) -> bool:
+    with Session(engine) as session:
+        return (
+            session.get(appmodels.GamePlaythrough, playthrough.id).archived_at
+            is not None
+        )
+
+
+def test_archives_playthroughs_left_alone():
+    untouched = _played(None, played_days_ago=10)
+    rehydrated = _played(5, played_days_ago=10)
+    Archiver(interval=0, after=86400, batch_size=100, months_ahead=0).archive()
+
+    assert _archived(untouched)
+    assert _archived(rehydrated)
+
+
+def test_keeps_playthroughs_played_recently():
+    played = _played(None, played_days_ago=0)
+    just_rehydrated = _played(0, played_days_ago=10)
+    # rehydrated long ago, but played since
+    played_since = _played(10, played_days_ago=0)
+    Archiver(interval=0, after=86400, batch_size=100, months_ahead=0).archive()
+
+    assert not _archived(played)
+    assert not _archived(just_rehydrated)
+    assert not _archived(played_since)
+
+
+def test_forget_clears_the_rehydration():
+    playthrough = _played(1, played_days_ago=1)
+    with Session(engine) as session:
+        playthrough = session.get(appmodels.GamePlaythrough, playthrough.id)
+        archiver.forget(session, playthrough)
+        session.commit()
+
+        assert playthrough.rehydrated_at is None
@@ -0,0 +1,33 @@
+from app.dedup import minhash, similarity
+
+_TEXT_ = (
+    "The old lighthouse keeper climbed the spiral stairs every evening to light "
+    "the lamp, watching the fishing boats return through the fog while the gulls "
+    "circled above the harbour and the bells of the chapel rang for vespers"
+)
+
+
+def test_identical_texts_are_identical():
+    assert similarity(minhash(_TEXT_).tobytes(), minhash(_TEXT_).tobytes()) == 1
+
+
+def test_ignores_case_and_punctuation():
+    shouted = _TEXT_.upper().replace(" ", ", ")
+    assert similarity(minhash(_TEXT_).tobytes(), minhash(shouted).tobytes()) == 1
+
+
+def test_near_duplicates_are_similar():
+    edited = _TEXT_.replace("vespers", "evening prayers")
+    assert similarity(minhash(_TEXT_).tobytes(), minhash(edited).tobytes()) > 0.7
+
+
+def test_unrelated_texts_are_not():
+    other = (
+        "A courier races across the desert city at noon, dodging market stalls "
+        "and camel trains to deliver a sealed letter to the governor's palace"
+    )
+    assert similarity(minhash(_TEXT_).tobytes(), minhash(other).tobytes()) < 0.1
+
+
+def test_short_texts_still_get_a_signature():
+    assert similarity(minhash("hi").tobytes(), minhash("Hi!").tobytes()) == 1
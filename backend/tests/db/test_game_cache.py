@@ -0,0 +1,79 @@
+import pytest
+from app.commits import commits
+from app.game_cache import GameStateCache
+
+
+@pytest.fixture(autouse=True)
+def listening(monkeypatch):
+    monkeypatch.setattr(commits, "listening", True)
+
+
+def test_caches_loaded_games():
+    cache = GameStateCache(max_bytes=10_000)
+    value, ticket = cache.get("a")
+    assert value is None
+    cache.put("a", ticket, 1, {"game": "a"})
+
+    assert cache.get("a") == ({"game": "a"}, 0)
+
+
+def test_nothing_is_cached_while_not_listening(monkeypatch):
+    monkeypatch.setattr(commits, "listening", False)
+    cache = GameStateCache(max_bytes=10_000)
+    _, ticket = cache.get("a")
+    cache.put("a", ticket, 1, {"game": "a"})
+
+    assert cache.get("a") == (None, 0)
+
+
+def test_invalidate_drops_older_versions_only():
+    cache = GameStateCache(max_bytes=10_000)
+    _, ticket = cache.get("a")
+    cache.put("a", ticket, 2, {"game": "a"})
+
+    cache.invalidate("a", 2)
+    assert cache.get("a")[0] == {"game": "a"}
+    cache.invalidate("a", 3)
+    assert cache.get("a")[0] is None
+
+
+def test_loads_started_before_an_invalidation_are_not_stored():
+    cache = GameStateCache(max_bytes=10_000)
+    _, ticket = cache.get("a")
+    cache.invalidate("a")
+    cache.put("a", ticket, 1, {"game": "stale"})
+
+    assert cache.get("a")[0] is None
+
+
+def test_loads_started_before_a_clear_are_not_stored():
+    cache = GameStateCache(max_bytes=10_000)
+    _, ticket = cache.get("a")
+    cache.clear()
+    cache.put("a", ticket, 1, {"game": "stale"})
+
+    assert cache.get("a")[0] is None
+
+
+def test_never_replaces_a_newer_version():
+    cache = GameStateCache(max_bytes=10_000)
+    _, newer = cache.get("a")
+    _, older = cache.get("a")
+    cache.put("a", newer, 2, {"version": 2})
+    cache.put("a", older, 1, {"version": 1})
+
+    assert cache.get("a")[0] == {"version": 2}
+
+
+def test_evicts_the_least_recently_used():
+    cache = GameStateCache(max_bytes=150)
+    for key in ("a", "b", "c"):
+        _, ticket = cache.get(key)
+        cache.put(key, ticket, 1, {"padding": "x" * 30})
+    cache.get("a")
+    _, ticket = cache.get("d")
+    cache.put("d", ticket, 1, {"padding": "x" * 30})
+
+    assert cache.size <= 150
+    assert cache.get("b")[0] is None
+    assert cache.get("a")[0] is not None
@@ -0,0 +1,168 @@
+import uuid
+import hashlib
+import pytest
+import strawberry
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+import app.models as appmodels
+from app.config import Config
+from app.database import engine
+from app.http_caching import CachingGraphQLRouter, _cacheable_scope
+
+_GAME_ = "query Game($id: String!) { game(id: $id) }"
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    def game(self, id: str) -> str:
+        return id
+
+    @strawberry.field
+    def available_games(self) -> list[str]:
+        return []
+
+    @strawberry.field
+    def uncached(self) -> str:
+        return "uncached"
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(
+        CachingGraphQLRouter(
+            strawberry.Schema(query=Query),
+            cacheable_fields={"game", "availableGames"},
+        ),
+        prefix="/graphql",
+    )
+    return TestClient(app)
+
+
+@pytest.fixture
+def playthrough_id() -> uuid.UUID:
+    game_session = appmodels.GameSession(
+        id=uuid.uuid4(),
+        title="title",
+        themes=[],
+        synopsis="synopsis",
+        visual_style="style",
+        promo_image_url="https://example.com/promo.png",
+        reference_material_summary="summary",
+        opening_video_url="https://example.com/opening.mp4",
+        opening_act_synopsis="opening",
+        middle_act_synopsis="middle",
+        character_data=[],
+        prologue=[],
+        total_actions=2,
+    )
+    playthrough = appmodels.GamePlaythrough(
+        id=uuid.uuid4(), session=game_session, remaining_actions=2
+    )
+    with Session(engine) as session:
+        session.add_all([game_session, playthrough])
+        session.commit()
+        return playthrough.id
+
+
+def _update(playthrough_id: uuid.UUID, **values):
+    with Session(engine) as session:
+        playthrough = session.get(appmodels.GamePlaythrough, playthrough_id)
+        for name, value in values.items():
+            setattr(playthrough, name, value)
+        playthrough.touch()
+        session.commit()
+
+
+def _game(client: TestClient, playthrough_id: uuid.UUID, **headers):
+    return client.post(
+        "/graphql",
+        json={"query": _GAME_, "variables": {"id": str(playthrough_id)}},
+        headers=headers,
+    )
+
+
+def _persisted(query_hash: str) -> dict:
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+
+
+def test_persisted_queries_are_registered_on_a_miss(client):
+    query = "{ uncached }"
+    query_hash = hashlib.sha256(query.encode()).hexdigest()
+
+    missed = client.post("/graphql", json={"extensions": _persisted(query_hash)})
+    assert missed.json()["errors"][0]["extensions"]["code"] == (
+        "PERSISTED_QUERY_NOT_FOUND"
+    )
+
+    registered = client.post(
+        "/graphql", json={"query": query, "extensions": _persisted(query_hash)}
+    )
+    assert registered.json() == {"data": {"uncached": "uncached"}}
+    hit = client.post("/graphql", json={"extensions": _persisted(query_hash)})
+    assert hit.json() == {"data": {"uncached": "uncached"}}
+
+
+def test_persisted_queries_must_match_their_hash(client):
+    response = client.post(
+        "/graphql", json={"query": "{ uncached }", "extensions": _persisted("0" * 64)}
+    )
+    assert response.status_code == 400
+
+
+def test_unchanged_games_are_not_modified(client, playthrough_id):
+    response = _game(client, playthrough_id)
+    etag = response.headers["etag"]
+    assert response.json() == {"data": {"game": str(playthrough_id)}}
+    assert response.headers["cache-control"] == "no-cache"
+
+    unchanged = _game(client, playthrough_id, **{"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["etag"] == etag
+
+    _update(playthrough_id, remaining_actions=1)
+    changed = _game(client, playthrough_id, **{"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+
+def test_finished_games_are_cached_briefly(client, playthrough_id):
+    _update(playthrough_id, final_video_url="https://example.com/final.mp4")
+    response = _game(client, playthrough_id)
+    assert response.headers["cache-control"] == (
+        f"public, max-age={Config.graphql_finished_max_age}"
+    )
+
+    # resetting a finished game is seen once the cached copy is revalidated
+    _update(playthrough_id, final_video_url=None)
+    reset = _game(client, playthrough_id, **{"If-None-Match": response.headers["etag"]})
+    assert reset.status_code == 200
+    assert reset.headers["cache-control"] == "no-cache"
+
+
+def test_other_queries_are_not_cached(client):
+    response = client.post("/graphql", json={"query": "{ uncached }"})
+    assert "etag" not in response.headers
+
+
+def test_cacheable_scope():
+    fields = {"game", "availableGames"}
+    playthrough_id = str(uuid.uuid4())
+
+    assert _cacheable_scope(_GAME_, None, {"id": playthrough_id}, fields) == [
+        playthrough_id
+    ]
+    assert _cacheable_scope("{ availableGames }", None, None, fields) is None
+    # sessions and playthroughs are versioned separately
+    assert (
+        _cacheable_scope(
+            f'{{ availableGames game(id: "{playthrough_id}") }}', None, None, fields
+        )
+        is False
+    )
+    assert _cacheable_scope(_GAME_, None, {"id": "not a uuid"}, fields) is False
+    assert _cacheable_scope("{ uncached }", None, None, fields) is False
+    assert _cacheable_scope("mutation { reset }", None, None, fields) is False
+    assert _cacheable_scope("{ broken", None, None, fields) is False
@@ -0,0 +1,111 @@
+import time
+import socket
+import pytest
+import contextlib
+import sqlalchemy
+from app.database import engine, replica_engines, _create_engine
+from app.replicas import Replica, ReplicaRouter, _PRIMARY_
+
+pytestmark = pytest.mark.skipif(
+    len(replica_engines) == 0, reason="no replica configured"
+)
+
+
+@contextlib.contextmanager
+def _closed_port():
+    """A local port nothing listens on, for as long as it is held"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        yield s.getsockname()[1]
+
+
+def _router(*replicas: Replica) -> ReplicaRouter:
+    return ReplicaRouter(list(replicas), max_lag=5, check_interval=1)
+
+
+def _replica() -> Replica:
+    name, replica_engine = next(iter(replica_engines.items()))
+    return Replica(name=name, engine=replica_engine)
+
+
+def _in_recovery(session) -> bool:
+    return session.execute(sqlalchemy.text("SELECT pg_is_in_recovery()")).scalar()
+
+
+def _wait_until_caught_up(router: ReplicaRouter, replica: Replica, since: float):
+    deadline = time.monotonic() + 10
+    while replica.caught_up_to < since:
+        assert time.monotonic() < deadline, "the replica never caught up"
+        time.sleep(0.05)
+        router.check()
+
+
+def test_reads_from_a_caught_up_replica():
+    replica = _replica()
+    router = _router(replica)
+    started_at = time.monotonic()
+    router.check()
+    _wait_until_caught_up(router, replica, started_at)
+
+    assert replica.healthy
+    assert router.read(_in_recovery) is True
+
+
+def test_skips_replicas_that_lag_too_far_behind():
+    replica = _replica()
+    replica.healthy = True
+    replica.caught_up_to = time.monotonic() - 60
+    router = _router(replica)
+
+    assert router._choose([]) is _PRIMARY_
+    assert router.read(_in_recovery) is False
+
+
+def test_reads_recent_writes_from_replicas_that_have_replayed_them():
+    replica = _replica()
+    router = _router(replica)
+    router.check()
+    _wait_until_caught_up(router, replica, time.monotonic())
+
+    router.wrote("written")
+    assert router._choose(["written"]) is _PRIMARY_
+    assert router._choose(["untouched"]) is replica
+
+    with engine.begin() as primary:
+        primary.execute(sqlalchemy.text("SELECT txid_current()"))
+    _wait_until_caught_up(router, replica, time.monotonic())
+    assert router._choose(["written"]) is replica
+
+
+def test_falls_back_to_the_primary_when_a_replica_fails():
+    with _closed_port() as port:
+        broken = Replica(
+            name="broken", engine=_create_engine("127.0.0.1", port), healthy=True
+        )
+        broken.caught_up_to = time.monotonic()
+        router = _router(broken)
+
+        with router.pinned():
+            assert router.read(_in_recovery) is False
+            # the rest of the request stays on the primary
+            assert router.read(_in_recovery) is False
+
+    assert not broken.healthy
+
+
+def test_check_marks_unreachable_replicas_unhealthy():
+    with _closed_port() as port:
+        broken = Replica(
+            name="broken", engine=_create_engine("127.0.0.1", port), healthy=True
+        )
+        _router(broken).check()
+
+    assert not broken.healthy
+
+
+def test_check_skips_databases_that_are_not_replicating():
+    # the primary itself, listed as a replica by mistake
+    primary = Replica(name="primary", engine=engine, healthy=True)
+    _router(primary).check()
+
+    assert not primary.healthy
@@ -0,0 +1,39 @@
+import uuid
+from sqlalchemy.orm import Session
+import app.models as appmodels
+from app.database import engine
+from app.transfer import export_catalog, import_catalog
+
+
+def _game_session():
+    with Session(engine) as session:
+        session.add(
+            appmodels.GameSession(
+                id=uuid.uuid4(),
+                title="title",
+                themes=[],
+                synopsis="synopsis",
+                visual_style="style",
+                promo_image_url="https://example.com/promo.png",
+                reference_material_summary="summary",
+                opening_video_url="https://example.com/opening.mp4",
+                opening_act_synopsis="opening",
+                middle_act_synopsis="middle",
+                character_data=[],
+                prologue=[],
+                total_actions=2,
+            )
+        )
+        session.commit()
+
+
+def test_an_import_never_resumes_from_the_export(tmp_path):
+    _game_session()
+    path = tmp_path / "catalog.ndjson.zst"
+    exported = export_catalog(path, resume=True)
+
+    imported = import_catalog(path, resume=True)
+    assert imported["session"] == exported["session"] > 0
+
+    # but carries on from where the last import got to
+    assert import_catalog(path, resume=True)["session"] == 0
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+import app.admission
+from app.admission import (
+    Admission,
+    Rejected,
+    RateLimiter,
+    SpendBudget,
+    TokenBucket,
+    UpstreamLimiter,
+    current_budget_key,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(app.admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_allows_a_burst_then_says_when_to_retry(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_bucket_refills_up_to_its_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.take()
+    clock[0] += 60
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() > 0
+
+
+def test_rate_limiter_keeps_a_bucket_per_key(clock):
+    limiter = RateLimiter("test", rate=1, burst=1)
+    limiter.check("a")
+    limiter.check("b")
+    with pytest.raises(Rejected) as rejected:
+        limiter.check("a")
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after == pytest.approx(1)
+
+
+def test_rate_limiter_forgets_the_least_recently_used_keys(clock):
+    limiter = RateLimiter("test", rate=1, burst=1, max_keys=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("c")
+    # a fresh bucket, the exhausted one was forgotten
+    limiter.check("a")
+
+
+def test_spend_budget_rejects_once_spent():
+    budget = SpendBudget(limit=1)
+    budget.charge("a", 0.6)
+    budget.check("a")
+    budget.charge("a", 0.6)
+    with pytest.raises(Rejected) as rejected:
+        budget.check("a")
+    assert rejected.value.reason == "budget_exhausted"
+    budget.check("b")
+
+
+def _admission() -> Admission:
+    admission = Admission()
+    admission.clients = RateLimiter("client", rate=1, burst=2)
+    admission.sessions = RateLimiter("session", rate=1, burst=1)
+    admission.budgets = SpendBudget(limit=1)
+    admission.upstreams = {"upstream": UpstreamLimiter("upstream", 1)}
+    return admission
+
+
+def test_one_turn_at_a_time(clock):
+    admission = _admission()
+    admission.admit_turn("client", "a")
+    with pytest.raises(Rejected) as rejected:
+        admission.admit_turn("client", "a")
+    assert rejected.value.reason == "busy"
+
+    admission.finish_turn("a")
+    clock[0] += 60
+    admission.admit_turn("client", "a")
+
+
+def test_rejected_turns_cost_the_client_nothing(clock):
+    admission = _admission()
+    admission.admit_turn("client", "a")
+    admission.finish_turn("a")
+    with pytest.raises(Rejected):
+        admission.admit_turn("client", "a")
+    admission.budgets.charge("b", 1)
+    with pytest.raises(Rejected):
+        admission.admit_turn("client", "b")
+
+    # the client's second token is still there
+    admission.admit_turn("client", "c")
+
+
+def test_upstream_calls_are_charged_to_the_playthrough():
+    admission = _admission()
+
+    async def call():
+        current_budget_key.set("a")
+        async with admission.upstream("upstream", cost=0.25):
+            pass
+
+    asyncio.run(call())
+    assert admission.budgets.spent("a") == 0.25
+
+
+def test_upstream_calls_are_rejected_after_the_queue_timeout():
+    admission = _admission()
+
+    async def calls():
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.upstream("upstream"):
+                held.set()
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await held.wait()
+        with pytest.raises(Rejected) as rejected:
+            async with admission.upstream("upstream", queue_timeout=0.01):
+                pass
+        assert rejected.value.reason == "overloaded"
+
+        # background work waits for the slot instead
+        waiting = asyncio.create_task(call_without_timeout())
+        await asyncio.sleep(0.02)
+        assert not waiting.done()
+        release.set()
+        await asyncio.gather(holder, waiting)
+
+    async def call_without_timeout():
+        async with admission.upstream("upstream", queue_timeout=None):
+            pass
+
+    asyncio.run(calls())
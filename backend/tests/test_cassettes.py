@@ -0,0 +1,83 @@
+import json
+import httpx
+import pytest
+from pathlib import Path
+from app.cassettes import Cassette, CassetteMiss
+
+_URL_ = "https://api.example.com/v1/generations"
+
+
+def _request(body: dict) -> httpx.Request:
+    return httpx.Request("POST", _URL_, json=body)
+
+
+def _record(cassette: Cassette, body: dict, reply: dict):
+    request = _request(body)
+    response = httpx.Response(200, json=reply, request=request)
+    cassette.record(request, response, 0.1)
+
+
+def _replay(cassette: Cassette, body: dict) -> dict:
+    return json.loads(cassette.replay(_request(body))["text"])
+
+
+@pytest.fixture
+def path(tmp_path) -> Path:
+    return tmp_path / "recording.jsonl.gz"
+
+
+def test_replays_in_recorded_order_then_repeats_the_last(path):
+    recorder = Cassette(path)
+    _record(recorder, {"prompt": "poll"}, {"state": "queued"})
+    _record(recorder, {"prompt": "poll"}, {"state": "completed"})
+    recorder.close()
+
+    cassette = Cassette(path)
+    assert _replay(cassette, {"prompt": "poll"}) == {"state": "queued"}
+    assert _replay(cassette, {"prompt": "poll"}) == {"state": "completed"}
+    assert _replay(cassette, {"prompt": "poll"}) == {"state": "completed"}
+
+
+def test_ignores_volatile_fields(path):
+    recorder = Cassette(path)
+    _record(recorder, {"prompt": "a", "random_seed": 1}, {"id": "a"})
+    recorder.close()
+
+    assert _replay(Cassette(path), {"prompt": "a", "random_seed": 2}) == {"id": "a"}
+
+
+def test_an_entry_is_replayed_once_whichever_way_it_matched(path):
+    recorder = Cassette(path)
+    _record(recorder, {"prompt": "a"}, {"id": "a"})
+    _record(recorder, {"prompt": "b"}, {"id": "b"})
+    _record(recorder, {"prompt": "c"}, {"id": "c"})
+    recorder.close()
+
+    cassette = Cassette(path)
+    assert _replay(cassette, {"prompt": "a"}) == {"id": "a"}
+    # falls back to the method and URL, skipping what was already replayed
+    assert _replay(cassette, {"prompt": "z"}) == {"id": "b"}
+    assert _replay(cassette, {"prompt": "c"}) == {"id": "c"}
+
+
+def test_a_cut_short_recording_keeps_its_complete_entries(path, tmp_path):
+    recorder = Cassette(path)
+    _record(recorder, {"prompt": "a"}, {"id": "a"})
+    _record(recorder, {"prompt": "b"}, {"id": "b"})
+    # as the process left it, had it died without closing the file
+    cut = tmp_path / "cut.jsonl.gz"
+    cut.write_bytes(path.read_bytes())
+    recorder.close()
+
+    cassette = Cassette(cut)
+    assert _replay(cassette, {"prompt": "a"}) == {"id": "a"}
+    assert _replay(cassette, {"prompt": "b"}) == {"id": "b"}
+
+
+def test_misses_unrecorded_requests(path):
+    recorder = Cassette(path)
+    _record(recorder, {"prompt": "a"}, {"id": "a"})
+    recorder.close()
+
+    with pytest.raises(CassetteMiss):
+        Cassette(path).replay(httpx.Request("GET", _URL_))
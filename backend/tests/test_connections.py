@@ -0,0 +1,105 @@
+import asyncio
+import time
+from app.connections import ConnectionManager, Frame
+
+
+class _Client:
+    def __init__(self, key: str):
+        self.key = key
+        self.sent: list[dict] = []
+
+    def send(self, event: dict | Frame) -> bool:
+        self.sent.append(event.event if isinstance(event, Frame) else event)
+        return True
+
+
+def _manager(history_size: int = 4) -> ConnectionManager:
+    return ConnectionManager(
+        queue_size=8,
+        history_size=history_size,
+        heartbeat_interval=15,
+        heartbeat_timeout=45,
+        send_timeout=10,
+    )
+
+
+def _replayed(manager: ConnectionManager, key: str, last_event_id: int) -> list:
+    client = _Client(key)
+    manager._replay(client, last_event_id)
+    return [event["type"] for event in client.sent]
+
+
+def test_replays_missed_events():
+    manager = _manager()
+    seen = manager.publish("a", {"type": "updated"})
+    manager.publish("a", {"type": "error", "message": "oops"})
+    manager.publish("b", {"type": "updated"})
+
+    assert _replayed(manager, "a", seen["id"]) == ["error"]
+
+
+def test_nothing_missed():
+    manager = _manager()
+    seen = manager.publish("a", {"type": "updated"})
+
+    assert _replayed(manager, "a", seen["id"]) == []
+
+
+def test_resyncs_once_events_are_evicted():
+    manager = _manager(history_size=2)
+    seen = manager.publish("a", {"type": "updated"})
+    for _ in range(3):
+        manager.publish("a", {"type": "updated"})
+
+    assert _replayed(manager, "a", seen["id"]) == ["resync"]
+
+
+def test_resyncs_without_history():
+    manager = _manager()
+    seen = manager.publish("a", {"type": "updated"})
+
+    assert _replayed(manager, "b", seen["id"]) == ["resync"]
+
+
+def test_resyncs_ids_from_another_worker():
+    earlier = _manager()
+    # ids start from the time a worker started
+    time.sleep(0.001)
+    manager = _manager()
+    time.sleep(0.001)
+    later = _manager()
+    from_earlier = earlier.publish("a", {"type": "updated"})
+    manager.publish("a", {"type": "updated"})
+    from_later = later.publish("a", {"type": "updated"})
+
+    assert _replayed(manager, "a", from_earlier["id"]) == ["resync"]
+    assert _replayed(manager, "a", from_later["id"]) == ["resync"]
+
+
+class _WebSocket:
+    def __init__(self):
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self):
+        await asyncio.sleep(0.01)
+        self.closed = True
+
+
+def test_disconnecting_waits_for_the_socket_to_close():
+    manager = _manager()
+    websocket = _WebSocket()
+
+    async def run():
+        connection = await manager.connect("a", websocket)
+        await manager.disconnect(connection)
+        assert websocket.closed
+        assert all(task.done() for task in connection._tasks)
+        assert manager.connected("a") == 0
+
+    asyncio.run(run())
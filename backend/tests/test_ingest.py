@@ -0,0 +1,28 @@
+from app.gamemaster.ingest import chunk_text
+
+
+def test_short_text_is_a_single_chunk():
+    assert chunk_text("One paragraph.\n\nAnother one.", 100) == [
+        "One paragraph.\n\nAnother one."
+    ]
+
+
+def test_breaks_between_paragraphs():
+    text = "\n\n".join(["a" * 40, "b" * 40, "c" * 40])
+    assert chunk_text(text, 90) == [f"{'a' * 40}\n\n{'b' * 40}", "c" * 40]
+
+
+def test_breaks_long_paragraphs_between_sentences():
+    sentences = [f"Sentence number {i} is here." for i in range(10)]
+    chunks = chunk_text(" ".join(sentences), 60)
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert [s for chunk in chunks for s in chunk.split("\n\n")] == sentences
+
+
+def test_cuts_overlong_sentences():
+    chunks = chunk_text("x" * 250, 100)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_skips_blank_paragraphs():
+    assert chunk_text("\n\n  \n\nonly this\n\n\n", 100) == ["only this"]
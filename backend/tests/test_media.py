@@ -0,0 +1,96 @@
+import io
+import pytest
+from pathlib import Path
+from PIL import Image
+from app.config import Config
+from app.media.storage import storage
+import app.media as media
+
+
+@pytest.fixture(autouse=True)
+def forget_manifests():
+    media._manifests.clear()
+    yield
+    media._manifests.clear()
+
+
+@pytest.fixture
+def probes(monkeypatch) -> list[str]:
+    probed = []
+    exists = storage.exists
+
+    def counting(key: str) -> bool:
+        probed.append(key)
+        return exists(key)
+
+    monkeypatch.setattr(storage, "exists", counting)
+    return probed
+
+
+def _image(directory: Path, width: int = 2000) -> Path:
+    path = directory / "image.png"
+    Image.new("RGB", (width, width // 2), "purple").save(path)
+    return path
+
+
+def test_srcset_comes_from_the_manifest(tmp_path, probes):
+    key = "aa/image-with-manifest.png"
+    media._create_image_variants(key, _image(tmp_path), tmp_path)
+    media._manifests.clear()
+    probes.clear()
+
+    srcset = media.srcset(storage.url(key))
+
+    assert srcset == ", ".join(
+        f"{storage.url(media._variant_key(key, width))} {width}w"
+        for width in Config.media_image_widths
+    )
+    assert probes == []
+
+
+def test_variants_are_never_wider_than_the_original(tmp_path):
+    key = "aa/narrow-image.png"
+    widths = sorted(Config.media_image_widths)
+    media._create_image_variants(key, _image(tmp_path, widths[1]), tmp_path)
+    media._manifests.clear()
+
+    assert media.srcset(storage.url(key)) == (
+        f"{storage.url(media._variant_key(key, widths[0]))} {widths[0]}w"
+    )
+    assert not storage.exists(media._variant_key(key, widths[1]))
+    variant = storage.read(media._variant_key(key, widths[0]))
+    with Image.open(io.BytesIO(variant)) as image:
+        assert image.width == widths[0]
+
+
+def test_legacy_assets_are_checked_once(tmp_path, probes):
+    key = "aa/image-without-manifest.png"
+    width = Config.media_image_widths[0]
+    variant = tmp_path / "variant.webp"
+    variant.write_bytes(b"webp")
+    storage.put_file(media._variant_key(key, width), variant, "image/webp")
+
+    url = storage.url(key)
+    assert (
+        media.srcset(url) == f"{storage.url(media._variant_key(key, width))} {width}w"
+    )
+    probed = len(probes)
+    assert media.srcset(url) is not None
+    assert media.poster_url(url) is None
+    assert media.poster_url(url) is None
+    assert len(probes) == probed + 1
+
+
+def test_missing_poster_is_remembered(tmp_path, probes):
+    key = "aa/video-without-poster.mp4"
+    media._record_manifest(key, tmp_path, poster=False)
+    media._manifests.clear()
+
+    assert media.poster_url(storage.url(key)) is None
+    assert probes == []
+
+
+def test_unmirrored_urls_are_ignored(probes):
+    assert media.srcset("https://example.com/image.png") is None
+    assert media.poster_url(None) is None
+    assert probes == []
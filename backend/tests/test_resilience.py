@@ -0,0 +1,117 @@
+import time
+import asyncio
+import pytest
+from app.gamemaster.resilience import (
+    CallPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    circuit_breaker,
+    invoke_resilient,
+)
+
+_POLICY_ = CallPolicy(timeout=5, retries=0, backoff=0, hedge=False)
+
+
+def _opened(breaker: CircuitBreaker) -> CircuitBreaker:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_repeated_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_after=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.before_call()
+
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_after=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.before_call()
+
+
+def test_allows_one_trial_after_reset():
+    breaker = _opened(CircuitBreaker("test", failure_threshold=2, reset_after=0))
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_trial_reopens():
+    breaker = _opened(CircuitBreaker("test", failure_threshold=2, reset_after=0.05))
+    time.sleep(0.06)
+
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_trial_releases_circuit():
+    name = "test-cancelled-trial"
+    breaker = _opened(circuit_breaker(name))
+    breaker.reset_after = 0
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        trial = asyncio.create_task(invoke_resilient(name, hang, _POLICY_))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        async def answer():
+            return "answer"
+
+        return await invoke_resilient(name, answer, _POLICY_)
+
+    assert asyncio.run(scenario()) == "answer"
+
+
+def test_timed_out_trial_reopens():
+    name = "test-timed-out-trial"
+    breaker = _opened(circuit_breaker(name))
+    breaker.reset_after = 0
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(
+            invoke_resilient(
+                name, hang, CallPolicy(timeout=0.01, retries=0, hedge=False)
+            )
+        )
+    breaker.reset_after = 60
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_rejected_requests_do_not_open_circuit():
+    name = "test-rejected"
+    breaker = circuit_breaker(name)
+
+    async def reject():
+        raise ValueError("bad request")
+
+    for _ in range(breaker.failure_threshold + 1):
+        with pytest.raises(ValueError):
+            asyncio.run(invoke_resilient(name, reject, _POLICY_))
+    breaker.before_call()
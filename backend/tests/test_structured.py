@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from pydantic import BaseModel
+from langchain_core.messages import AIMessage
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import app.gamemaster.structured as structured
+from app.gamemaster.utils import clean_and_parse_json
+from app.gamemaster.structured import StructuredOutputError, resolve_structured
+
+
+class Block(BaseModel):
+    dialogue: list[str]
+    is_final_act: bool
+
+
+_VALID_ = '{"dialogue": ["Hello"], "is_final_act": false}'
+
+
+@pytest.fixture
+def repairs(monkeypatch):
+    """Sets the repair model's responses, in order"""
+
+    def respond(*responses: str) -> FakeListChatModel:
+        model = FakeListChatModel(responses=list(responses))
+        monkeypatch.setattr(structured, "repair_llm", model)
+        return model
+
+    respond()
+    return respond
+
+
+def _resolve(response) -> Block:
+    return asyncio.run(resolve_structured(response, Block, "test"))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        _VALID_,
+        f"```json\n{_VALID_}\n```",
+        f"Here is the next block:\n{_VALID_}\nEnjoy!",
+        '{"dialogue": ["Hello",], "is_final_act": false,}',
+    ],
+)
+def test_parses_untidy_json(text):
+    assert clean_and_parse_json(text) == {"dialogue": ["Hello"], "is_final_act": False}
+
+
+def test_recovers_cut_off_json():
+    assert clean_and_parse_json('{"dialogue": ["Hello", "Good') == {
+        "dialogue": ["Hello", "Good"]
+    }
+    assert clean_and_parse_json('{"dialogue": ["Hello"], "is_fin') == {
+        "dialogue": ["Hello"]
+    }
+
+
+def test_rejects_text_without_json():
+    with pytest.raises(ValueError):
+        clean_and_parse_json("I cannot continue this story")
+
+
+def test_uses_what_the_provider_parsed(repairs):
+    parsed = Block(dialogue=["Parsed"], is_final_act=True)
+    assert _resolve({"raw": AIMessage(content=""), "parsed": parsed}) is parsed
+
+
+def test_parses_the_raw_message_without_repairing(repairs):
+    block = _resolve({"raw": AIMessage(content=f"```{_VALID_}```"), "parsed": None})
+    assert block == Block(dialogue=["Hello"], is_final_act=False)
+
+
+def test_repairs_invalid_output_once(repairs):
+    repairs(f"Fixed: {_VALID_}")
+    block = _resolve(AIMessage(content='{"dialogue": "Hello"}'))
+    assert block == Block(dialogue=["Hello"], is_final_act=False)
+
+
+def test_gives_up_when_the_repair_is_invalid_too(repairs):
+    model = repairs('{"dialogue": "still wrong"}', _VALID_)
+    with pytest.raises(StructuredOutputError):
+        _resolve(AIMessage(content="not even JSON"))
+    # a single repair attempt, the second response was never asked for
+    assert model.i == 1
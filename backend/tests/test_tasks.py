@@ -0,0 +1,101 @@
+import asyncio
+from app.tasks import AbandonPolicy, Abandoned, TaskSupervisor
+
+
+async def _staged(supervisor: TaskSupervisor, key: str, stages: list[str]):
+    for stage in ("first", "second", "third"):
+        supervisor.checkpoint(key)
+        stages.append(stage)
+        await asyncio.sleep(0.02)
+
+
+def test_abandoned_after_the_grace_period():
+    supervisor = TaskSupervisor(AbandonPolicy.CANCEL, grace=0.05)
+
+    async def run():
+        task = supervisor.spawn(asyncio.sleep(1), key="a")
+        supervisor.abandon("a")
+        await asyncio.sleep(0.02)
+        assert not task.done()
+        await asyncio.sleep(0.06)
+        assert task.cancelled()
+
+    asyncio.run(run())
+    assert supervisor.snapshot()["cancelled"] == 1
+
+
+def test_resuming_within_the_grace_period_keeps_the_work():
+    supervisor = TaskSupervisor(AbandonPolicy.CANCEL, grace=0.05)
+
+    async def run():
+        task = supervisor.spawn(asyncio.sleep(0.1), key="a")
+        supervisor.abandon("a")
+        await asyncio.sleep(0.02)
+        supervisor.resume("a")
+        await task
+
+    asyncio.run(run())
+    assert supervisor.snapshot()["completed"] == 1
+
+
+def test_finish_stage_stops_at_the_next_checkpoint():
+    supervisor = TaskSupervisor(AbandonPolicy.FINISH_STAGE, grace=0)
+    stages: list[str] = []
+
+    async def run():
+        task = supervisor.spawn(_staged(supervisor, "a", stages), key="a")
+        await asyncio.sleep(0.01)
+        supervisor.abandon("a")
+        await asyncio.wait([task])
+        assert isinstance(task.exception(), Abandoned)
+
+    asyncio.run(run())
+    assert stages == ["first"]
+    assert not supervisor.busy("a")
+
+
+def test_finish_all_ignores_abandonment():
+    supervisor = TaskSupervisor(AbandonPolicy.FINISH_ALL, grace=0)
+    stages: list[str] = []
+
+    async def run():
+        task = supervisor.spawn(_staged(supervisor, "a", stages), key="a")
+        supervisor.abandon("a")
+        await task
+
+    asyncio.run(run())
+    assert stages == ["first", "second", "third"]
+
+
+def test_drain_cancels_what_outlasts_the_timeout():
+    supervisor = TaskSupervisor(AbandonPolicy.CANCEL, grace=10)
+
+    async def run():
+        quick = supervisor.spawn(asyncio.sleep(0.01), key="a")
+        slow = supervisor.spawn(asyncio.sleep(10), key="b")
+        supervisor.abandon("a")
+        await supervisor.drain(0.05)
+        assert quick.done() and not quick.cancelled()
+        assert slow.cancelled()
+
+    asyncio.run(run())
+    assert supervisor.snapshot() == {
+        "running": 0,
+        "completed": 1,
+        "cancelled": 1,
+        "failed": 0,
+    }
+
+
+def test_failures_are_counted():
+    supervisor = TaskSupervisor(AbandonPolicy.CANCEL, grace=0)
+
+    async def fail():
+        raise RuntimeError("upstream down")
+
+    async def run():
+        task = supervisor.spawn(fail(), name="failing")
+        await asyncio.wait([task])
+
+    asyncio.run(run())
+    assert supervisor.snapshot()["failed"] == 1
@@ -0,0 +1,40 @@
+import time
+import argparse
+from pathlib import Path
+from app.transfer import export_catalog, import_catalog
+
+parser = argparse.ArgumentParser(
+    description="Moves game sessions, with their playthroughs and story blocks, "
+    "in and out of the database as zstd compressed NDJSON"
+)
+commands = parser.add_subparsers(dest="command", required=True)
+
+export_parser = commands.add_parser("export", help="streams the catalog to a file")
+export_parser.add_argument("path", type=Path)
+export_parser.add_argument("--after", help="only export sessions after this id")
+export_parser.add_argument(
+    "--resume", action="store_true", help="carry on from the last checkpoint"
+)
+
+import_parser = commands.add_parser("import", help="upserts an exported catalog")
+import_parser.add_argument("path", type=Path)
+import_parser.add_argument(
+    "--resume", action="store_true", help="skip sessions already imported"
+)
+import_parser.add_argument(
+    "--batch-size", type=int, default=500, help="sessions loaded per transaction"
+)
+
+args = parser.parse_args()
+
+started_at = time.monotonic()
+if args.command == "export":
+    counts = export_catalog(args.path, after=args.after, resume=args.resume)
+else:
+    counts = import_catalog(args.path, resume=args.resume, batch_size=args.batch_size)
+
+print(
+    f"{args.command}ed {counts['session']} sessions, "
+    f"{counts['playthrough']} playthroughs and {counts['block']} story blocks "
+    f"in {time.monotonic() - started_at:.1f}s"
+)
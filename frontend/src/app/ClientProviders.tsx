@@ -2,12 +2,38 @@
 
 import { ToastProvider } from "@/ui/overlays/toast";
 import { FullPageLoader } from "@/ui/progress/loader";
-import { ApolloClient, ApolloProvider, InMemoryCache } from "@apollo/client";
+import {
+  ApolloClient,
+  ApolloProvider,
+  HttpLink,
+  InMemoryCache,
+} from "@apollo/client";
+import { createPersistedQueryLink } from "@apollo/client/link/persisted-queries";
 import React from "react";
 import { Suspense, type ReactNode } from "react";
 
+async function sha256(query: string) {
+  const digest = await crypto.subtle.digest(
+    "SHA-256",
+    new TextEncoder().encode(query),
+  );
+
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+// hashed queries are sent via GET so that the browser (and any CDN in front of
+// the API) can revalidate them with ETags
+const persistedQueryLink = createPersistedQueryLink({
+  sha256,
+  useGETForHashedQueries: true,
+});
+
 const client = new ApolloClient({
-  uri: `${process.env.NEXT_PUBLIC_API_URL}/graphql`,
+  link: persistedQueryLink.concat(
+    new HttpLink({ uri: `${process.env.NEXT_PUBLIC_API_URL}/graphql` }),
+  ),
   cache: new InMemoryCache(),
 });
 
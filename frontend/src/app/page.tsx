@@ -1,10 +1,12 @@
 "use client";
 
-import { useSuspenseQuery } from "@apollo/client";
+import { useMutation, useSuspenseQuery } from "@apollo/client";
 import { gql } from "@generated/gql";
 import Link from "next/link";
+import { useRouter } from "next/navigation";
 
 export default function Home() {
+  const router = useRouter();
   const sessionsQuery = useSuspenseQuery(
     gql(`
   query AvailableGamesQuery {
@@ -22,16 +24,19 @@ export default function Home() {
         background
         profilePhotoUrl
       }
-
-      storyBlocks {
-        actionsConsumed
-        isFinalAct
-      }
     }
   }
     `),
   );
 
+  const [startPlaythrough, startPlaythroughMutation] = useMutation(
+    gql(`
+  mutation StartPlaythrough($sessionId: String!) {
+    startPlaythrough(sessionId: $sessionId)
+  }
+    `),
+  );
+
   return (
     <main className="h-screen w-screen flex flex-col items-center p-8">
       <h1 className="my-8 text-3xl">Alternative Stories</h1>
@@ -61,9 +66,22 @@ export default function Home() {
 
             <div className="w-full max-w-md p-4 bg-slate-800/30 absolute bottom-0 left-1/2 -translate-x-1/2 rounded-t-lg">
               <h2 className="text-3xl">
-                <Link href={`/session/${game.id}`} className="link">
+                <button
+                  type="button"
+                  className="link"
+                  disabled={startPlaythroughMutation.loading}
+                  onClick={() => {
+                    startPlaythrough({
+                      variables: { sessionId: game.id },
+                    }).then(({ data }) => {
+                      if (data) {
+                        router.push(`/session/${data.startPlaythrough}`);
+                      }
+                    });
+                  }}
+                >
                   {game.title}
-                </Link>
+                </button>
               </h2>
 
               <div className="flex flex-row gap-2 flex-wrap mt-4">
@@ -34,7 +34,13 @@ type GameEvent =
       message: string;
     };
 
+type ServerEvent =
+  | (GameEvent & { id?: number })
+  | { type: "ping"; id?: number }
+  | { type: "resync"; id?: number };
+
 type PlayerServerEvent =
+  | { type: "pong" }
   | { type: "start-game" }
   | { type: "take-action"; action: string }
   | { type: "submit-photo"; url: string };
@@ -68,31 +74,119 @@ interface PlayerNextDialogueIntent {
   type: "next-dialogue";
 }
 
+const RECONNECT_DELAY_MS = 1000;
+const MAX_RECONNECT_DELAY_MS = 30_000;
+
+// the server turned the connection down, reconnecting would not help
+function isRejection(code: number) {
+  return code === 1008 || (code >= 4000 && code < 5000);
+}
+
 class GameController {
-  socket: WebSocket;
+  socket: WebSocket | null = null;
+  url: string;
+  onEvent?: (event: GameEvent) => void;
+  lastEventId: number | null = null;
+  reconnectAttempts = 0;
+  reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+  stopped = true;
 
   constructor({
     url,
     onEvent,
   }: { url: string; onEvent?: (event: GameEvent) => void }) {
-    this.socket = new WebSocket(url);
+    this.url = url;
+    this.onEvent = onEvent;
+  }
+
+  start() {
+    if (!this.stopped) return;
+    this.stopped = false;
+    this.socket = this.connect();
+  }
+
+  stop() {
+    this.stopped = true;
+    if (this.reconnectTimer !== null) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
+    this.socket?.close();
+    this.socket = null;
+  }
+
+  reconnect() {
+    // backs off exponentially with jitter, so a restarting server is not stampeded
+    const delay =
+      Math.min(
+        MAX_RECONNECT_DELAY_MS,
+        RECONNECT_DELAY_MS * 2 ** this.reconnectAttempts,
+      ) *
+      (0.5 + Math.random() / 2);
+    this.reconnectAttempts += 1;
+    this.reconnectTimer = setTimeout(() => {
+      this.reconnectTimer = null;
+      this.socket = this.connect();
+    }, delay);
+  }
+
+  connect(): WebSocket {
+    // resuming only replays the events missed while disconnected
+    const url =
+      this.lastEventId === null
+        ? this.url
+        : `${this.url}&lastEventId=${this.lastEventId}`;
+    const socket = new WebSocket(url);
 
-    this.socket.addEventListener("open", () => {
+    socket.addEventListener("open", () => {
       console.log("connection opened");
+      this.reconnectAttempts = 0;
     });
 
-    this.socket.addEventListener("close", () => {
-      console.log("connection closed");
+    socket.addEventListener("close", (event) => {
+      console.log("connection closed", event.code, event.reason);
+      if (this.stopped || socket !== this.socket) return;
+
+      if (isRejection(event.code)) {
+        this.stopped = true;
+        this.socket = null;
+        this.onEvent?.({
+          type: "error",
+          message: event.reason || "the game could not be joined",
+        });
+        return;
+      }
+
+      this.reconnect();
     });
 
-    this.socket.addEventListener("message", (event) => {
+    socket.addEventListener("message", (event) => {
       console.log("on message", event.data);
-      onEvent?.(JSON.parse(event.data));
+      const serverEvent: ServerEvent = JSON.parse(event.data);
+      if (serverEvent.id !== undefined) {
+        this.lastEventId = serverEvent.id;
+      }
+
+      switch (serverEvent.type) {
+        case "ping":
+          this.send({ type: "pong" });
+          break;
+
+        case "resync":
+          this.onEvent?.({ type: "updated" });
+          break;
+
+        default:
+          this.onEvent?.(serverEvent);
+          break;
+      }
     });
+
+    return socket;
   }
 
   send(event: PlayerServerEvent) {
-    this.socket.send(JSON.stringify(event));
+    this.socket?.send(JSON.stringify(event));
   }
 }
 
@@ -166,6 +260,11 @@ export default function SessionPage() {
     });
   }, [key, currentGameQuery.refetch, showToast]);
 
+  useEffect(() => {
+    controller.start();
+    return () => controller.stop();
+  }, [controller]);
+
   const currentGame = currentGameQuery.data.game;
 
   const onPlayerEvent = useCallback(